@@ -0,0 +1,97 @@
+import argparse
+import os
+import tempfile
+from nhanes_dl import download
+from nhanes_dl.mortality import mortalityStore
+from nhanes_dl.pipeline import buildNhanesCachePipeline
+from nhanes_dl.types import appendCodebooks, joinCodebooks, linkCodebookWithMortality
+from benchmarks import harness
+from benchmarks.synthetic import buildFixtures, codebookName, serveFixtures
+
+# Times the download, cache and join hot paths against synthetic years served from a local http server
+# python -m benchmarks.bench_cache --seqn 100000 --codebooks 200 --columns 40 --output after.json --compare before.json
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seqn", type=int, default=10000, help="SEQNs per year")
+    parser.add_argument("--codebooks", type=int, default=40, help="codebooks per year")
+    parser.add_argument("--columns", type=int, default=20, help="columns per codebook")
+    parser.add_argument("--years", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=8, help="download threads")
+    parser.add_argument("--cacheFormat", default=download.defaultCacheFormat)
+    parser.add_argument("--cases", nargs="*", help="only run these cases")
+    parser.add_argument("--output", help="save the results to this json file")
+    parser.add_argument("--compare", help="json results of a previous run to compare against")
+    args = parser.parse_args()
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "compare", "cases")}
+
+    with tempfile.TemporaryDirectory() as directory:
+        fixtures = os.path.join(directory, "cdc")
+        years = buildFixtures(fixtures, args.seqn, args.codebooks, args.columns, args.years)
+        print(f"{args.years} years x {args.codebooks} codebooks x {args.columns} columns, {args.seqn} SEQN each")
+
+        with serveFixtures(fixtures):
+            warm = os.path.join(directory, "warm")
+            for year in years:
+                download.buildNhanesYearCache(warm, year, workers=args.workers, cacheFormat=args.cacheFormat)
+            download.readCacheOrDownloadMortalityYears(warm, set(years), cacheFormat=args.cacheFormat)
+
+            def fresh(name, i):
+                return os.path.join(directory, f"{name}-{i}")
+
+            def coldDownload(i):
+                mortalityStore.clear()
+                cacheDir = fresh("cold", i)
+
+                def run():
+                    for year in years:
+                        download.buildNhanesYearCache(cacheDir, year, workers=args.workers,
+                                                      cacheFormat=args.cacheFormat)
+                    download.readCacheOrDownloadMortalityYears(cacheDir, set(years), cacheFormat=args.cacheFormat)
+                return run
+
+            def coldPipeline(i):
+                cacheDir = fresh("pipeline", i)
+                return lambda: buildNhanesCachePipeline(cacheDir, set(years), ioWorkers=args.workers,
+                                                        cacheFormat=args.cacheFormat)
+
+            def warmRead(i):
+                return lambda: download.readCacheNhanesYearsWithMortality(warm, set(years), args.cacheFormat)
+
+            def warmReadLinked(i):
+                # The first call links and writes the file, only mapping it is timed
+                download.readCacheLinkedYears(warm, set(years), args.cacheFormat)
+                return lambda: download.readCacheLinkedYears(warm, set(years), args.cacheFormat)
+
+            def readYear(year):
+                return [download.readCacheCodebook(warm, year, codebookName(year, c), args.cacheFormat)
+                        for c in range(args.codebooks)]
+
+            def join(i):
+                frames = readYear(years[0])
+                return lambda: joinCodebooks(frames)
+
+            def append(i):
+                frames = [joinCodebooks(readYear(year)) for year in years]
+                return lambda: appendCodebooks(frames)
+
+            def link(i):
+                codebooks = appendCodebooks([joinCodebooks(readYear(year)) for year in years])
+                mortality = download.readCacheMortalityYears(warm, set(years), args.cacheFormat)
+                return lambda: linkCodebookWithMortality(codebooks, mortality)
+
+            cases = {"cold_download": coldDownload, "cold_pipeline": coldPipeline, "warm_read": warmRead,
+                     "warm_read_linked": warmReadLinked,
+                     "joinCodebooks": join, "appendCodebooks": append, "linkMortality": link}
+            results = harness.runCases(cases, args.repeat, args.cases)
+
+    if args.output:
+        harness.save(args.output, config, results)
+    if args.compare:
+        harness.compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from nhanes_dl.mortality import parseMortality
+from benchmarks.synthetic import fakeMortality, readFwf, writeMortality
+
+# Times parseMortality against the read_fwf + to_numeric parser it replaced on a synthetic .dat file
+# python -m benchmarks.bench_mortality --rows 2000000
+
+
+def timed(f):
+    start = time.perf_counter()
+    res = f()
+    return res, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "mortality.dat")
+        writeMortality(fakeMortality(np.arange(args.rows)), path)
+        print(f"{args.rows} rows, {os.path.getsize(path) / 2 ** 20:.1f} MiB")
+
+        def vectorized():
+            with open(path, "rb") as f:
+                return parseMortality(f.read())
+
+        for name, f in [("read_fwf", lambda: readFwf(path)), ("parseMortality", vectorized)]:
+            res, seconds = timed(f)
+            memory = res.memory_usage(deep=True).sum() / 2 ** 20
+            print(f"{name:>15}: {seconds:7.2f}s {memory:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
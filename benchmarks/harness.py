@@ -0,0 +1,97 @@
+import json
+import multiprocessing
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Runs benchmark cases and compares their results between runs
+# A case prepares its input untimed, then the callable it returns is timed. Each case runs in a fresh forked process
+# so its peak RSS isn't inflated by the cases before it (on platforms without fork they share this process)
+
+Case = Callable[[int], Callable[[], object]]
+
+
+def peakRSS() -> Optional[float]:
+    """
+    Peak resident memory of this process in MiB, None where it can't be measured
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _run(case: Case, repeat: int) -> Dict:
+    baseline = peakRSS()
+    seconds = []
+    for i in range(repeat):
+        f = case(i)
+        start = time.perf_counter()
+        f()
+        seconds.append(time.perf_counter() - start)
+    return {"seconds": seconds, "best": min(seconds), "median": statistics.median(seconds),
+            "baselineMiB": baseline, "peakMiB": peakRSS()}
+
+
+# Cases are closures, so rather than pickled they are handed to the forked process through this global
+_case: Optional[Case] = None
+
+
+def _runForked(repeat: int) -> Dict:
+    return _run(_case, repeat)
+
+
+def runCase(case: Case, repeat: int = 3) -> Dict:
+    global _case
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return _run(case, repeat)
+    _case = case
+    try:
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("fork")) as pool:
+            return pool.submit(_runForked, repeat).result()
+    finally:
+        _case = None
+
+
+def runCases(cases: Dict[str, Case], repeat: int = 3, only: Optional[List[str]] = None) -> Dict[str, Dict]:
+    results = {}
+    for name, case in cases.items():
+        if only and name not in only:
+            continue
+        results[name] = res = runCase(case, repeat)
+        peak = "-" if res["peakMiB"] is None else \
+            f"{res['peakMiB']:.0f} MiB ({res['peakMiB'] - res['baselineMiB']:+.0f} MiB over the case's start)"
+        print(f"{name:>16}: best {res['best']:8.3f}s  median {res['median']:8.3f}s  peak {peak}", flush=True)
+    return results
+
+
+def save(path: str, config: Dict, results: Dict[str, Dict]):
+    with open(path, "w") as f:
+        json.dump({"config": config, "cases": results}, f, indent=1)
+
+
+def compare(previousPath: str, results: Dict[str, Dict], threshold: float = 0.1):
+    """
+    Prints the change of every case against the results saved at previousPath, flagging ones slower by threshold
+    """
+    with open(previousPath) as f:
+        previous = json.load(f)["cases"]
+    print(f"\ncompared to {previousPath}")
+    for name, res in results.items():
+        if name not in previous:
+            continue
+        before = previous[name]
+        ratio = res["best"] / before["best"] if before["best"] else float("inf")
+        flag = "  SLOWER" if ratio > 1 + threshold else ""
+        memory = ""
+        if res["peakMiB"] is not None and before.get("peakMiB") is not None:
+            memory = f"  peak {res['peakMiB'] - before['peakMiB']:+.0f} MiB"
+        print(f"{name:>16}: {before['best']:8.3f}s -> {res['best']:8.3f}s ({ratio:5.2f}x){memory}{flag}")
@@ -0,0 +1,263 @@
+import math
+import os
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+from nhanes_dl import catalog, download, types
+from nhanes_dl.types import ContinuousNHANES, allContinuousNHANES, getStartEndYear
+
+# Synthetic NHANES years for the benchmarks, laid out like the CDC website so they can be served locally
+# Every year has codebooks XPT files covering 60-100% of its SEQNs with columns wide of small integer variables
+# (10% missing, like most NHANES questionnaire answers), its linked mortality file and a catalog listing them
+# The file writers and localServer are shared with the tests, which run the download functions against them
+
+
+def _pad(s: str, width: int) -> bytes:
+    return s.encode("ascii")[:width].ljust(width)
+
+
+def _ibmFloat(x: float) -> bytes:
+    if x is None or (isinstance(x, float) and math.isnan(x)):
+        # SAS missing value "."
+        return b"\x2e" + b"\x00" * 7
+    if x == 0:
+        return b"\x00" * 8
+
+    sign = 0x80 if x < 0 else 0
+    x = abs(x)
+    exponent = 0
+    while x >= 1:
+        x /= 16
+        exponent += 1
+    while x < 1 / 16:
+        x *= 16
+        exponent -= 1
+    fraction = int(round(x * 2 ** 56))
+    if fraction >= 2 ** 56:
+        fraction >>= 4
+        exponent += 1
+
+    return bytes([sign | (exponent + 64)]) + fraction.to_bytes(7, "big")
+
+
+def _ibmFloats(values: np.ndarray) -> np.ndarray:
+    """
+    Same as _ibmFloat over a whole column, returns a (rows, 8) uint8 array
+    """
+    values = np.asarray(values, dtype="float64")
+    missing = np.isnan(values)
+    zero = values == 0
+    x = np.abs(np.where(missing | zero, 1.0, values))
+
+    exponent = np.floor(np.log2(x) / 4).astype("int64") + 1
+    fraction = x / 16.0 ** exponent
+    # log2 can round across a power of 16
+    exponent = np.where(fraction >= 1, exponent + 1, np.where(fraction < 1 / 16, exponent - 1, exponent))
+    fraction = np.rint(x / 16.0 ** exponent * 2 ** 56).astype("uint64")
+    overflow = fraction >= 2 ** 56
+    fraction = np.where(overflow, fraction >> np.uint64(4), fraction)
+    exponent = np.where(overflow, exponent + 1, exponent)
+
+    first = np.where(values < 0, 0x80, 0) | (exponent + 64)
+    words = (first.astype("uint64") << np.uint64(56)) | fraction
+    words = np.where(zero, np.uint64(0), np.where(missing, np.uint64(0x2e << 56), words))
+    return words.astype(">u8").view("uint8").reshape(-1, 8)
+
+
+def writeXPT(df: pd.DataFrame, path: str, name: str = "DATA"):
+    """
+    Writes a DataFrame (index included as a column when named) to a SAS XPORT v5 file
+    Numeric columns are written as 8 byte IBM floats, everything else as char
+    """
+    if df.index.name is not None:
+        df = df.reset_index()
+
+    stamp = "01JAN22:00:00:00"
+    header = "HEADER RECORD*******{}HEADER RECORD!!!!!!!{}"
+    out = bytearray()
+    out += _pad(header.format("LIBRARY ", "0" * 30), 80)
+    out += _pad("SAS     SAS     SASLIB  6.06    bsd4.2  " + " " * 24 + stamp, 80)
+    out += _pad(stamp, 80)
+    out += _pad(header.format("MEMBER  ", "000000000000000001600000000140"), 80)
+    out += _pad(header.format("DSCRPTR ", "0" * 30), 80)
+    out += _pad("SAS     " + name.ljust(8) + "SASDATA 6.06    bsd4.2  " + " " * 24 + stamp, 80)
+    out += _pad(stamp + " " * 16 + " " * 40 + " " * 8, 80)
+    out += _pad(header.format("NAMESTR ", f"000000{len(df.columns):04d}00000000000000000000"), 80)
+
+    fields = []
+    position = 0
+    for i, column in enumerate(df.columns):
+        numeric = pd.api.types.is_numeric_dtype(df[column])
+        if numeric:
+            length = 8
+        else:
+            length = max([len(str(v)) for v in df[column].dropna()] + [1])
+        fields.append((column, numeric, length))
+        out += struct.pack(">hhhh8s40s8shhh2s8shhl52s", 1 if numeric else 2, 0, length, i + 1,
+                           _pad(column, 8), _pad("", 40), _pad("", 8), 0, 0, 0, b"  ",
+                           _pad("", 8), 0, 0, position, b"\x00" * 52)
+        position += length
+    out += b" " * (-len(out) % 80)
+
+    out += _pad(header.format("OBS     ", "0" * 30), 80)
+    columns = []
+    for (column, numeric, length) in fields:
+        if numeric:
+            columns.append(_ibmFloats(df[column].to_numpy(dtype="float64", na_value=np.nan)))
+        else:
+            padded = b"".join(_pad("" if pd.isna(v) else str(v), length) for v in df[column])
+            columns.append(np.frombuffer(padded, dtype="uint8").reshape(-1, length))
+    if len(df):
+        out += np.concatenate(columns, axis=1).tobytes()
+    out += b" " * (-len(out) % 80)
+
+    with open(path, "wb") as f:
+        f.write(bytes(out))
+
+
+def fakeMortality(seqn, seed: int = 0) -> pd.DataFrame:
+    """
+    Returns random linked mortality records for seqn, in the columns of a mortality .dat file
+    """
+    rng = np.random.default_rng(seed)
+    n = len(seqn)
+    eligible = rng.random(n) < 0.9
+
+    def codes(low, high, missing=None):
+        res = pd.Series(rng.integers(low, high + 1, n), dtype="Int64")
+        return res.mask(~eligible if missing is None else missing)
+
+    mortstat = codes(0, 1)
+    dead = (mortstat == 1).fillna(False).to_numpy()
+    return pd.DataFrame({
+        "PUBLICID": seqn,
+        "ELIGSTAT": np.where(eligible, 1, 2),
+        "MORTSTAT": mortstat,
+        "UCOD_LEADING": codes(1, 10, ~dead),
+        "DIABETES": codes(0, 1, ~dead),
+        "HYPERTEN": codes(0, 1, ~dead),
+        "DODQTR": codes(1, 4, ~dead),
+        "DODYEAR": codes(2005, 2019, ~dead),
+        "WGT_NEW": codes(1000, 99999),
+        "SA_WGT_NEW": codes(1000, 99999),
+        "PERMTH_INT": codes(0, 180),
+        "PERMTH_EXM": codes(0, 180),
+    })
+
+
+def writeMortality(df: pd.DataFrame, path: str):
+    """
+    Writes mortality records to a fixed width .dat file, missing values are written as "."
+    """
+    from nhanes_dl.mortality import allMortalityColumns, mortalityWidths
+    fields = []
+    for column, width in zip(allMortalityColumns, mortalityWidths):
+        values = df[column].astype("string").fillna(".")
+        fields.append(values.str.ljust(width) if column == "PUBLICID" else values.str.rjust(width))
+
+    lines = fields[0].str.cat(fields[1:])
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def readFwf(path: str) -> pd.DataFrame:
+    """
+    Parses a mortality .dat file with pd.read_fwf like downloadMortality used to,
+    the reference parseMortality is tested and benchmarked against
+    """
+    from nhanes_dl import mortality
+    data = pd.read_fwf(path, widths=mortality.mortalityWidths, header=None)
+    data.columns = mortality.allMortalityColumns
+    return data.assign(SEQN=data.PUBLICID).drop(columns=mortality.toDropColumns).apply(
+        lambda x: pd.to_numeric(x, errors="coerce")).set_index("SEQN")
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@contextmanager
+def localServer(directory: str, handler=_QuietHandler):
+    """
+    Serves directory over http on a free local port, yielding the base url
+    """
+    server = _ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(handler, directory=directory))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def codebookName(year: ContinuousNHANES, i: int) -> str:
+    return f"B{i:03d}_{'ABCDEFGHIJK'[sorted(allContinuousNHANES()).index(year)]}"
+
+
+def mortalityPath(year: ContinuousNHANES) -> str:
+    s, e = getStartEndYear(year)
+    return f"mortality/NHANES_{s}_{e}_MORT_2019_PUBLIC.dat"
+
+
+def buildFixtures(directory: str, seqn: int = 10000, codebooks: int = 40, columns: int = 20,
+                  years: int = 2, seed: int = 0) -> List[ContinuousNHANES]:
+    """
+    Writes the files of years synthetic NHANES years under directory, returns the years
+    """
+    rng = np.random.default_rng(seed)
+    built = sorted(allContinuousNHANES())[:years]
+    os.makedirs(os.path.join(directory, "mortality"), exist_ok=True)
+    catalogRows = []
+    for k, year in enumerate(built):
+        s, e = getStartEndYear(year)
+        yearDir = os.path.join(directory, f"{s}-{e}")
+        os.makedirs(yearDir, exist_ok=True)
+        people = np.arange(seqn) + (k + 1) * 1000000
+
+        for i in range(codebooks):
+            name = codebookName(year, i)
+            rows = np.sort(rng.choice(people, int(seqn * rng.uniform(0.6, 1.0)), replace=False))
+            values = rng.integers(1, 10, (len(rows), columns)).astype("float64")
+            values[rng.random(values.shape) < 0.1] = np.nan
+            df = pd.DataFrame(values, columns=[f"V{i:03d}{j:03d}" for j in range(columns)],
+                              index=pd.Index(rows.astype("float64"), name="SEQN"))
+            writeXPT(df, os.path.join(yearDir, f"{name}.XPT"), name)
+            catalogRows.append({"startYear": s, "endYear": e, "dataFile": name})
+
+        writeMortality(fakeMortality(people, seed + k), os.path.join(directory, mortalityPath(year)))
+
+    pd.DataFrame(catalogRows).to_csv(os.path.join(directory, "nhanes_codebooks.csv"), index=False)
+    return built
+
+
+@contextmanager
+def serveFixtures(directory: str):
+    """
+    Serves the fixtures of directory over local http and points nhanes_dl at them
+    """
+    with localServer(directory) as url, tempfile.TemporaryDirectory() as catalogDir:
+        previous: Dict = {"nhanesURL": types.nhanesURL, "defaultCatalog": catalog.defaultCatalog,
+                          "mortalityURL": download.mortalityURL}
+        types.nhanesURL = url
+        catalog.defaultCatalog = catalog.CodebookCatalog(f"{url}/nhanes_codebooks.csv", catalogDir)
+        download.mortalityURL = lambda year: f"{url}/{mortalityPath(year)}"
+        try:
+            yield url
+        finally:
+            types.nhanesURL = previous["nhanesURL"]
+            catalog.defaultCatalog = previous["defaultCatalog"]
+            download.mortalityURL = previous["mortalityURL"]
@@ -0,0 +1,163 @@
+import json
+import re
+from io import BytesIO
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.error import HTTPError, URLError
+import pandas as pd
+from nhanes_dl.retry import getRetryPolicy
+from nhanes_dl.transport import getTransport
+from nhanes_dl.types import CodebookDescription, DownloadException, HTTPStatusException
+
+# The codebook catalog is the nhanes-scraper csv listing every data file of every NHANES year
+# It only changes when the scraper is rerun, so it is loaded once per process and kept on disk between runs
+
+catalogURL = "https://raw.githubusercontent.com/LeviButcher/nhanes-scraper/master/results/nhanes_codebooks.csv"
+catalogCacheDir = os.path.join(os.path.expanduser("~"), ".cache", "nhanes_dl")
+# Seconds a persisted catalog is trusted before it is revalidated against catalogURL
+catalogMaxAge = 24 * 60 * 60
+
+# Data files are named after their component with a suffix per cycle (DEMO_D, DEMO_E, ...), the 1999-2000 ones have none
+cycleSuffix = re.compile(r"_[A-Z]$")
+
+
+def familyOf(dataFile: str) -> str:
+    """
+    Name of the component a data file belongs to, i.e DEMO for DEMO_D
+    """
+    return cycleSuffix.sub("", dataFile)
+
+
+class CodebookCatalog:
+    """
+    Process level view of the codebook catalog, indexed by (startYear, endYear)
+    The catalog is persisted to cacheDir along with the ETag/Last-Modified it was served with,
+    once older than maxAge it is revalidated with a conditional request.
+    If the revalidation fails the persisted copy is used, so cached reads keep working offline.
+    """
+
+    def __init__(self, url: Optional[str] = None, cacheDir: Optional[str] = None,
+                 maxAge: Optional[float] = None):
+        self.url = url or catalogURL
+        self.cacheDir = catalogCacheDir if cacheDir is None else cacheDir
+        self.maxAge = catalogMaxAge if maxAge is None else maxAge
+        self._lock = threading.Lock()
+        self._all = None
+        self._byYear = {}
+        self._byFamily = {}
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.cacheDir, "nhanes_codebooks.csv")
+
+    @property
+    def metaPath(self) -> str:
+        return f"{self.path}.json"
+
+    def all(self) -> CodebookDescription:
+        if self._all is None:
+            with self._lock:
+                if self._all is None:
+                    self._index(self._load())
+        return CodebookDescription(self._all)
+
+    def year(self, startEnd: Tuple[int, int]) -> CodebookDescription:
+        allDescriptions = self.all()
+        return CodebookDescription(self._byYear.get(startEnd, allDescriptions.iloc[0:0]))
+
+    def family(self, name: str) -> Dict[Tuple[int, int], List[str]]:
+        """
+        Data files of the component name (i.e DEMO or BPX) in every year that has it, by (startYear, endYear)
+        """
+        self.all()
+        return self._byFamily.get(name.upper(), {})
+
+    def clear(self):
+        """
+        Forgets the in memory catalog, the next lookup reloads it from disk or the network
+        """
+        with self._lock:
+            self._all = None
+            self._byYear = {}
+            self._byFamily = {}
+
+    def refresh(self) -> CodebookDescription:
+        """
+        Revalidates the persisted catalog now, regardless of its age
+        """
+        with self._lock:
+            self._index(self._load(force=True))
+        return CodebookDescription(self._all)
+
+    def _index(self, res: pd.DataFrame):
+        # Removes any duplicate rows, if any exist
+        res = res.drop_duplicates(subset=["startYear", "endYear", "dataFile"])
+        self._byYear = {(int(s), int(e)): group
+                        for (s, e), group in res.groupby(["startYear", "endYear"], sort=False)}
+        byFamily = {}
+        for s, e, dataFile in zip(res.startYear, res.endYear, res.dataFile):
+            byFamily.setdefault(familyOf(dataFile), {}).setdefault((int(s), int(e)), []).append(dataFile)
+        self._byFamily = byFamily
+        self._all = res
+
+    def _readMeta(self) -> Dict:
+        try:
+            with open(self.metaPath) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load(self, force: bool = False) -> pd.DataFrame:
+        meta = self._readMeta()
+        persisted = bool(self.cacheDir) and os.path.exists(self.path)
+        fresh = time.time() - meta.get("checked", 0) < self.maxAge
+
+        if persisted and fresh and not force:
+            return pd.read_csv(self.path)
+
+        headers = {}
+        if persisted and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if persisted and meta.get("lastModified"):
+            headers["If-Modified-Since"] = meta["lastModified"]
+
+        # With a persisted copy to fall back on there's no point waiting on retries
+        def fetch():
+            return getTransport().request(self.url, headers)
+
+        try:
+            response = fetch() if persisted else getRetryPolicy().call(fetch, self.url)
+        except (HTTPError, URLError, DownloadException) as e:
+            if persisted:
+                return pd.read_csv(self.path)
+            if isinstance(e, (HTTPError, HTTPStatusException)):
+                raise DownloadException(f"Failed to download codebook catalog\n{self.url}")
+            raise DownloadException("Request timed out")
+
+        if response.status == 304 and persisted:
+            self._persist(None, dict(meta))
+            return pd.read_csv(self.path)
+
+        body = response.body
+        meta = {"etag": response.headers.get("ETag"),
+                "lastModified": response.headers.get("Last-Modified")}
+        self._persist(body, meta)
+        return pd.read_csv(BytesIO(body))
+
+    def _persist(self, body: Optional[bytes], meta: Dict):
+        if not self.cacheDir:
+            return
+        os.makedirs(self.cacheDir, exist_ok=True)
+        if body is not None:
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(body)
+            os.replace(tmp, self.path)
+        meta["checked"] = time.time()
+        with open(self.metaPath, "w") as f:
+            json.dump(meta, f)
+
+
+defaultCatalog = CodebookCatalog()
@@ -0,0 +1,173 @@
+import operator
+from typing import Iterator, List, NamedTuple, Optional
+import pandas as pd
+from nhanes_dl import download
+from nhanes_dl.formats import SEQNRange, defaultCacheFormat
+from nhanes_dl.mortality import getMortalityColumns
+from nhanes_dl.types import Codebook, ContinuousNHANES, LinkedDataset, appendCodebooks, \
+    joinCodebooks, linkCodebookWithMortality
+
+# Runs the plan of a LinkedDataset against its cache directory
+# Filter columns are read first, so the selected variables are only kept for the rows that pass the filters
+# A plan can also be run one partition at a time, a NHANES year and a range of its SEQNs, so datasets larger
+# than memory are processed in batches (see batches). The SEQN range of every cached file is in the manifest,
+# files outside a partition aren't opened and parquet files only have their overlapping row groups read
+
+# SEQNs per partition when none is given
+defaultPartitionRows = 50000
+
+
+class Partition(NamedTuple):
+    """
+    The rows of a NHANES year with low <= SEQN <= high
+    """
+    year: ContinuousNHANES
+    low: float
+    high: float
+
+
+filterOperators = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda column, value: column.isin(value),
+    "not in": lambda column, value: ~column.isin(value),
+}
+
+
+def _overlaps(entry: dict, seqnRange: Optional[SEQNRange]) -> bool:
+    if seqnRange is None or "seqnMin" not in entry:
+        return True
+    return entry["seqnMin"] <= seqnRange[1] and seqnRange[0] <= entry["seqnMax"]
+
+
+def _readVariables(ds: LinkedDataset, year: ContinuousNHANES, cacheFormat: str,
+                   variables: Optional[List[str]], keep: Optional[pd.Index] = None,
+                   seqnRange: Optional[SEQNRange] = None) -> Codebook:
+    """
+    Reads variables (all when None) from the cached codebooks of year, only the rows in keep
+    and in seqnRange when given
+    """
+    codebookVariables = download.cachedCodebookVariables(ds.cacheDir, year, cacheFormat)
+    if variables is None:
+        variables = [v for columns in codebookVariables.values() for v in columns]
+    toRead = download.selectCodebookVariables(codebookVariables, variables)
+    entries = (download.cachedEntries(ds.cacheDir, year, cacheFormat) or {}) if seqnRange is not None else {}
+
+    res = []
+    for codebook, columns in toRead.items():
+        if not _overlaps(entries.get(codebook, {}), seqnRange):
+            continue
+        book = download.readCacheCodebook(ds.cacheDir, year, codebook, cacheFormat, columns, seqnRange)
+        if book is None:
+            continue
+        res.append(book if keep is None else book[book.index.isin(keep)])
+    return joinCodebooks(res)
+
+
+def _filterMask(df: pd.DataFrame, filters) -> pd.Series:
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in filters:
+        if column not in df.columns:
+            return pd.Series(False, index=df.index)
+        mask &= filterOperators[op](df[column], value).fillna(False).astype(bool)
+    return mask
+
+
+def collectYear(ds: LinkedDataset, year: ContinuousNHANES, seqnRange: Optional[SEQNRange] = None) -> Codebook:
+    """
+    Runs the plan for one year, only for the SEQNs in seqnRange when given
+    """
+    cacheFormat = ds.cacheFormat or defaultCacheFormat
+    mortalityColumns = getMortalityColumns()
+    filterColumns = list(dict.fromkeys(c for c, _, _ in ds.filters))
+    selected = None if ds.variables is None else [v for v in ds.variables if v not in mortalityColumns]
+    linkMortality = ds.mortality or any(v in mortalityColumns for v in (ds.variables or []))
+
+    mortality = None
+    if linkMortality or any(c in mortalityColumns for c in filterColumns):
+        mortality = download.readCacheMortality(ds.cacheDir, year, cacheFormat, seqnRange)
+
+    keep = None
+    if ds.filters:
+        toFilter = _readVariables(ds, year, cacheFormat,
+                                  [c for c in filterColumns if c not in mortalityColumns], seqnRange=seqnRange)
+        if mortality is not None and any(c in mortalityColumns for c in filterColumns):
+            toFilter = toFilter.join(mortality[[c for c in filterColumns if c in mortalityColumns]], how="outer")
+        keep = toFilter.index[_filterMask(toFilter, ds.filters)]
+
+    res = _readVariables(ds, year, cacheFormat, selected, keep, seqnRange)
+    if keep is not None:
+        # Rows that pass the filters but have none of the selected variables are kept, like an eager read
+        res = res.reindex(keep)
+    if linkMortality and mortality is not None:
+        if keep is not None:
+            mortality = mortality[mortality.index.isin(keep)]
+        res = linkCodebookWithMortality(res, mortality)
+
+    if ds.variables is not None:
+        columns = ds.variables + (mortalityColumns if ds.mortality else [])
+        res = res[[c for c in dict.fromkeys(columns) if c in res.columns]]
+    return Codebook(res)
+
+
+def collect(ds: LinkedDataset) -> Codebook:
+    return appendCodebooks([collectYear(ds, year) for year in ds.years])
+
+
+def seqnBounds(ds: LinkedDataset, year: ContinuousNHANES) -> Optional[SEQNRange]:
+    """
+    Returns the lowest and highest SEQN cached for year, None if nothing is cached
+    Taken from the manifest, files it has no SEQN range for have their SEQN read
+    """
+    cacheFormat = ds.cacheFormat or defaultCacheFormat
+    entries = download.cachedEntries(ds.cacheDir, year, cacheFormat)
+    if entries is None:
+        names = download.cachedCodebooks(ds.cacheDir, year, cacheFormat) + ["mortality"]
+        entries = {name: {} for name in names}
+
+    lows, highs = [], []
+    for name, entry in entries.items():
+        if "seqnMin" not in entry:
+            seqn = download.readCacheCodebook(ds.cacheDir, year, name, cacheFormat, [])
+            if seqn is None or len(seqn) == 0:
+                continue
+            entry = {"seqnMin": seqn.index.min(), "seqnMax": seqn.index.max()}
+        lows.append(entry["seqnMin"])
+        highs.append(entry["seqnMax"])
+    return (min(lows), max(highs)) if lows else None
+
+
+def partitions(ds: LinkedDataset, rows: int = defaultPartitionRows) -> List[Partition]:
+    """
+    Splits the years of the plan into SEQN ranges of rows SEQNs, NHANES numbers the people of a year consecutively
+    so a partition holds about rows people
+    """
+    res = []
+    for year in ds.years:
+        bounds = seqnBounds(ds, year)
+        if bounds is None:
+            continue
+        low, high = bounds
+        while low <= high:
+            res.append(Partition(year, low, min(high, low + rows - 1)))
+            low += rows
+    return res
+
+
+def collectPartition(ds: LinkedDataset, partition: Partition) -> Codebook:
+    return collectYear(ds, partition.year, (partition.low, partition.high))
+
+
+def batches(ds: LinkedDataset, rows: int = defaultPartitionRows) -> Iterator[Codebook]:
+    """
+    Yields the result of the plan one partition at a time, so only about rows rows are in memory at once
+    Partitions without any rows are skipped
+    """
+    for partition in partitions(ds, rows):
+        res = collectPartition(ds, partition)
+        if len(res):
+            yield res
@@ -1,11 +1,29 @@
-from typing import Set, List
+import hashlib
+import os
+import tempfile
+import time
+from io import BytesIO
+from typing import Callable, Dict, Iterable, Optional, Set, List, Tuple
 import pandas as pd
-from urllib.error import HTTPError, URLError
 from nhanes_dl.types import ContinuousNHANES, appendCodebooks, appendMortalities, \
     codebookURL, Codebook, Mortality, getStartEndYear, joinCodebooks, \
     linkCodebookWithMortality, mortalityURL, \
-    CodebookDownload, DownloadException, getYearsCodebookDescriptions, allContinuousNHANES
-from nhanes_dl.utils import makeDirectoryIfNotExists, readOrUpdateCache
+    CodebookDownload, DownloadException, getYearsCodebookDescriptions, allContinuousNHANES, \
+    DuplicateSEQNException, HTTPStatusException, NetworkException, ParseException, resolveFamily
+from nhanes_dl.utils import makeDirectoryIfNotExists, mapConcurrently, readOrUpdateCache
+from nhanes_dl.formats import CsvFormat, SEQNRange, defaultCacheFormat, formatOfPath, getCacheFormat
+from nhanes_dl.locks import FileLock, temporaryPath, writeAtomically
+from nhanes_dl.events import emit, logger, loggedStats, timed
+from nhanes_dl.retry import getRetryPolicy
+from nhanes_dl.transport import Response, getTransport
+from nhanes_dl.dtypes import compact, restoreDtypes
+from nhanes_dl.manifest import keyOfPath, manifestFor, recordCacheFile
+from nhanes_dl.mirror import RawMirror, mirrorFor
+from nhanes_dl.eviction import recordAccess
+from nhanes_dl.journal import DONE, FAILED, journalFor
+from nhanes_dl.rollup import getRollup
+from nhanes_dl.mortality import mortalityColumnSpecs, mortalityWidths, allMortalityColumns, \
+    toDropColumns, getMortalityColumns, parseMortality, mortalityStore
 
 
 # Kinda think I should convert the return types to either...
@@ -16,141 +34,317 @@ def toUpperCase(xs: List[str]):
     return list(map(lambda l: l.upper(), xs))
 
 
-mortalityColumnSpecs = [(1, 14), (15, 15), (16, 16),
-                        (17, 19), (20, 20), (21, 21),
-                        (22, 22), (23, 26), (27, 34),
-                        (35, 42), (43, 45), (46, 48)]
+# Codebooks too large to download into memory, they can only be cached by streaming them (see streamCodebookToCache)
+# They are long format (many rows per SEQN) so they are never joined with the other codebooks of a year
+streamedCodebooks = ["PAXMIN", "PAXRAW_D", "PAXRAW_C"]
+ignoreCodebooks = ["RDC"] + streamedCodebooks
 
-mortalityWidths = [e - (s-1) for s, e in mortalityColumnSpecs]
+# Rows read from a XPT file at a time when streaming it
+defaultChunksize = 100000
 
 
-allMortalityColumns = toUpperCase(["publicid", "eligstat", "mortstat", "ucod_leading", "diabetes",
-                                   "hyperten", "dodqtr", "dodyear", "wgt_new", "sa_wgt_new", "permth_int", "permth_exm"
-                                   ])
+def isStreamedCodebook(codebook: str) -> bool:
+    return any([codebook.startswith(streamed) for streamed in streamedCodebooks])
 
-toDropColumns = toUpperCase(
-    ["publicid", "dodqtr", "dodyear", "wgt_new", "sa_wgt_new"])
 
+def isIgnoredCodebook(codebook: str, chunksize: Optional[int] = None) -> bool:
+    """
+    Whether a cache build leaves codebook out, streamed codebooks are only cached when a chunksize is given
+    """
+    if isStreamedCodebook(codebook):
+        return not chunksize
+    return any(codebook.startswith(ignore) for ignore in ignoreCodebooks)
 
-def getMortalityColumns() -> List[str]:
-    return [x for x in allMortalityColumns if x not in toDropColumns]
 
+def joinableCodebooks(codebooks: List[str]) -> List[str]:
+    return [x for x in codebooks if not isStreamedCodebook(x)]
 
-def downloadCodebook(year: ContinuousNHANES, codebook: str) -> Codebook:
+
+def instrumented(url: str, fetch: Callable[[], Response], size: Optional[Callable[[Response], int]] = None) -> Response:
     """
-    Downloads a NHANES codebook from the CDC website.
-    Throws a DownloadException if the download fails, doesn't have a SEQN, or repeats SEQN multiple times
+    Calls fetch emitting a downloadStart event, then a download or downloadFailed event (see nhanes_dl.events)
+    size returns the bytes downloaded, by default the length of the body
     """
-    ignoreCodebooks = ["PAXMIN", "RDC", "PAXRAW_D", "PAXRAW_C"]
+    emit("downloadStart", url=url)
+    start = time.perf_counter()
+    try:
+        response = fetch()
+    except Exception as e:
+        emit("downloadFailed", url=url, error=str(e), seconds=time.perf_counter() - start)
+        raise
+    emit("download", url=url, status=response.status, seconds=time.perf_counter() - start,
+         bytes=size(response) if size is not None else len(response.body or b""))
+    return response
+
 
+def fetchIfChanged(url: str, validators: Optional[Dict] = None) -> Tuple[Optional[bytes], Dict]:
+    """
+    Downloads url unless it hasn't changed since validators, the ETag/Last-Modified/sha256 of a previous download
+    Sends a conditional request when it can, a 304 or the same content returns None as the body
+    Returns the body with the new validators. Transient failures are retried (see nhanes_dl.retry),
+    the ones that remain are raised as a NetworkException or HTTPStatusException
+    """
+    validators = validators or {}
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("lastModified"):
+        headers["If-Modified-Since"] = validators["lastModified"]
+
+    response = getRetryPolicy().call(lambda: instrumented(url, lambda: getTransport().request(url, headers)), url)
+    if response.status == 304:
+        return None, validators
+
+    body = response.body
+    res = {"etag": response.headers.get("ETag"),
+           "lastModified": response.headers.get("Last-Modified"),
+           "sha256": hashlib.sha256(body).hexdigest()}
+    if res["sha256"] == validators.get("sha256"):
+        return None, res
+    return body, res
+
+
+def _failed(e: DownloadException, message: str) -> DownloadException:
+    # Keeps the type (and status code) of a classified failure, with a message naming what failed
+    e.args = (message,)
+    return e
+
+
+def fetchCodebook(year: ContinuousNHANES, codebook: str, validators: Optional[Dict] = None,
+                  mirror: Optional[RawMirror] = None) -> Tuple[Optional[Codebook], Dict]:
+    """
+    Downloads a NHANES codebook unless it hasn't changed since validators (see fetchIfChanged)
+    Returns the codebook, or None if it hasn't changed, with the validators to store for it
+    The downloaded XPT file is kept in mirror when given (see nhanes_dl.mirror)
+    Throws a DownloadException if the download fails, doesn't have a SEQN, or repeats SEQN without a Rollup
+    """
     url = codebookURL(year, codebook)
-    print(year, codebook)
+    logger.debug("Downloading %s for %s", codebook, year)
 
     try:
         if any([codebook.startswith(ignore) for ignore in ignoreCodebooks]):
             raise DownloadException("Ignore codebook download")
 
-        res = Codebook(pd.read_sas(url, index="SEQN"))
-
-        if any(res.index.duplicated()):
-            # May want to change to to roll up the Dataframe
-            raise DownloadException(f"Repeating SEQN rows - {url}")
-        return res
-    except HTTPError:
-        raise DownloadException(
-            f"Failed to download {codebook} for {year}\n{url}")
-    except URLError:
-        raise DownloadException("Request timed out")
+        body, validators = fetchIfChanged(url, validators)
+    except HTTPStatusException as e:
+        raise _failed(e, f"Failed to download {codebook} for {year}\n{url}")
+    except NetworkException as e:
+        raise _failed(e, "Request timed out")
+    if body is None:
+        return None, validators
+    if mirror is not None:
+        mirror.put(manifestKey(year, codebook), body, url, validators)
+    return parseCodebook(body, url), validators
+
+
+def parseCodebook(body: bytes, url: str) -> Codebook:
+    """
+    Reads the bytes of the XPT file downloaded from url into a codebook indexed by SEQN
+    A codebook repeating SEQN is rolled up to one row per SEQN when it has a declared Rollup
+    Throws a ParseException if it isn't a valid XPT file, doesn't have a SEQN, or repeats SEQN without a Rollup
+    """
+    try:
+        with timed("parse", source=url) as fields:
+            res = Codebook(pd.read_sas(BytesIO(body), format="xport", index="SEQN"))
+            fields["rows"] = len(res)
     except KeyError:
-        raise DownloadException(f"No SEQN index - {url}")
+        raise ParseException(f"No SEQN index - {url}")
     except OverflowError:
-        raise DownloadException(f"A value is over maximum size")
+        raise ParseException(f"A value is over maximum size")
     except ValueError:
-        raise DownloadException(f"Was not a valid csv file - {url}")
+        raise ParseException(f"Was not a valid csv file - {url}")
 
+    if res.index.has_duplicates:
+        # Long format codebooks are rolled up to a row per SEQN when declared (see nhanes_dl.rollup)
+        rollup = getRollup(os.path.splitext(os.path.basename(url))[0])
+        if rollup is None:
+            raise DuplicateSEQNException(f"Repeating SEQN rows - {url}")
+        res = Codebook(rollup.apply(res, url))
+    return compact(res, url)
 
-def downloadCodebookWithRetry(year, codebook):
+
+def downloadCodebook(year: ContinuousNHANES, codebook: str) -> Codebook:
+    """
+    Downloads a NHANES codebook from the CDC website.
+    Throws a DownloadException if the download fails, doesn't have a SEQN, or repeats SEQN without a Rollup
     """
-    Download the codebook and retries it again if failed due to Network Error
+    res, _ = fetchCodebook(year, codebook)
+    return res
+
+
+def streamCodebookToCache(year: ContinuousNHANES, codebook: str, cachePath: str,
+                          chunksize: int = defaultChunksize) -> int:
+    """
+    Downloads a NHANES codebook to a temporary file then converts it into cachePath chunksize rows at a time
+    Memory stays bounded by chunksize no matter how large the codebook is. Returns the rows written
+    SEQN may repeat, so the cached file is long format. The downloaded file is kept in the raw mirror of the
+    cache directory, if it has one
+    Throws a DownloadException if the download fails or the codebook has no SEQN
     """
     url = codebookURL(year, codebook)
+    logger.debug("Streaming %s for %s", codebook, year)
+
+    def fetch():
+        # A retry starts the temporary file over
+        raw.seek(0)
+        raw.truncate()
+        return instrumented(url, lambda: getTransport().download(url, raw), lambda _: raw.tell())
+
+    with tempfile.NamedTemporaryFile(suffix=".XPT") as raw:
+        try:
+            getRetryPolicy().call(fetch, url)
+            raw.flush()
+        except HTTPStatusException as e:
+            raise _failed(e, f"Failed to download {codebook} for {year}\n{url}")
+        except NetworkException as e:
+            raise _failed(e, "Request timed out")
+
+        mirror = mirrorFor(os.path.dirname(os.path.dirname(cachePath)) or ".")
+        if mirror is not None:
+            mirror.putFile(manifestKey(year, codebook), raw.name, url)
+        rows = convertXPTFile(raw.name, url, cachePath, chunksize)
+
+    recordCacheFile(cachePath, rows=rows)
+    return rows
+
+
+def convertXPTFile(path: str, url: str, cachePath: str, chunksize: int = defaultChunksize) -> int:
+    """
+    Converts the XPT file at path, downloaded from url, into cachePath chunksize rows at a time
+    Returns the rows written. Throws a ParseException if it isn't a valid XPT file with a SEQN
+    """
+    cacheFormat = formatOfPath(cachePath)
+    partialPath = temporaryPath(cachePath)
+    rows = 0
     try:
-        return downloadCodebook(year, codebook)
-    except DownloadException as de:
-        mes = str(de)
-        if (mes == "Request timed out") or (mes == f"Failed to download {codebook} for {year}\n{url}"):
-            return downloadCodebook(year, codebook)
+        with timed("parse", source=url) as fields, \
+                pd.read_sas(path, format="xport", index="SEQN", chunksize=chunksize) as reader:
+            rows = fields["rows"] = cacheFormat.writeChunks(reader, partialPath)
+    except KeyError:
+        raise ParseException(f"No SEQN index - {url}")
+    except ValueError:
+        raise ParseException(f"Was not a valid xpt file - {url}")
+    finally:
+        if os.path.exists(partialPath) and rows == 0:
+            os.remove(partialPath)
 
-        raise DownloadException(f"Failed during retry of download")
+    if rows == 0:
+        raise ParseException(f"Empty codebook - {url}")
+    os.replace(partialPath, cachePath)
+    return rows
+
+
+def downloadCodebookWithRetry(year, codebook):
+    """
+    Download the codebook, every download retries transient failures with the retry policy (see nhanes_dl.retry)
+    """
+    return downloadCodebook(year, codebook)
 
 
-def downloadCodebooks(cd: CodebookDownload) -> Codebook:
+def downloadCodebooks(cd: CodebookDownload, workers: int = 1) -> Codebook:
     # Should throw an exception whenever something fails to download
     """
     Return all CodeBooks within specified for the NHANES year
+    workers sets how many codebooks are downloaded at once, column order is the same for any amount
     """
-    def handleDownload(year, codebook):
+    def handleDownload(codebook):
         try:
-            return downloadCodebookWithRetry(year, codebook)
+            return downloadCodebookWithRetry(cd.year, codebook)
         except DownloadException:
             return []
 
-    res = [handleDownload(cd.year, c)
-           for c in cd.codebooks]
+    res = mapConcurrently(handleDownload, cd.codebooks, workers)
     res = [c for c in res if not isinstance(c, list)]
 
     return joinCodebooks(res)
 
 
-def downloadAllCodebooksForYear(c: ContinuousNHANES) -> Codebook:
+def downloadAllCodebooksForYear(c: ContinuousNHANES, workers: int = 1) -> Codebook:
     """
     returns DataFrame of all codebook data for a NHANES year
     """
     desc = getYearsCodebookDescriptions(c)
     toDownload = CodebookDownload(c, *desc.dataFile)
-    return downloadCodebooks(toDownload)
+    return downloadCodebooks(toDownload, workers)
 
 
-def downloadAllCodebooksForYears(c: Set[ContinuousNHANES]) -> Codebook:
-    res = [downloadAllCodebooksForYear(y) for y in c]
+def downloadAllCodebooksForYears(c: Set[ContinuousNHANES], workers: int = 1) -> Codebook:
+    res = [downloadAllCodebooksForYear(y, workers) for y in c]
     return appendCodebooks(res)
 
 
-def downloadAllCodebooks() -> Codebook:
-    return downloadAllCodebooksForYears(allContinuousNHANES())
+def downloadAllCodebooks(workers: int = 1) -> Codebook:
+    return downloadAllCodebooksForYears(allContinuousNHANES(), workers)
 
 
-def downloadCodebooksForYears(c: Set[CodebookDownload]) -> Codebook:
+def downloadCodebooksForYears(c: Iterable[CodebookDownload], workers: int = 1,
+                              yearWorkers: Optional[int] = None) -> Codebook:
     """
-    returns DataFrame of appended codebook data for all CodebookDownloads
+    returns DataFrame of appended codebook data for all CodebookDownloads, in year order
+    The years are downloaded at once (yearWorkers of them, all by default) so it takes about as long as the slowest
+    year, workers sets how many codebooks of a year are downloaded at once
     """
-    res = [downloadCodebooks(x) for x in c]
+    downloads = sorted(c, key=lambda x: x.year)
+    res = mapConcurrently(lambda x: downloadCodebooks(x, workers), downloads,
+                          len(downloads) if yearWorkers is None else yearWorkers)
 
     return Codebook(appendCodebooks(res))
 
 
-def downloadMortality(year: ContinuousNHANES) -> Mortality:
+def downloadCodebookFamily(family: str, years: Optional[Set[ContinuousNHANES]] = None, workers: int = 1) -> Codebook:
     """
-    returns DataFrame of the ContinuousNHANES mortality data
+    Downloads a codebook family (i.e DEMO or BPX) for years (all by default) and appends them
+    The family is resolved against the catalog into each year's data file (DEMO_D, DEMO_E, ...)
     """
+    return downloadCodebooksForYears(resolveFamily(family, years), workers)
+
 
+def fetchMortality(year: ContinuousNHANES, validators: Optional[Dict] = None,
+                   mirror: Optional[RawMirror] = None) -> Tuple[Optional[Mortality], Dict]:
+    """
+    Downloads the ContinuousNHANES mortality data unless it hasn't changed since validators (see fetchIfChanged)
+    The downloaded .dat file is kept in mirror when given (see nhanes_dl.mirror)
+    """
     url = mortalityURL(year)
 
     try:
-        data = pd.read_fwf(url, widths=mortalityWidths)
-        data.columns = allMortalityColumns
-        return data.assign(SEQN=data.PUBLICID).drop(columns=toDropColumns).apply(
-            lambda x: pd.to_numeric(x, errors="coerce")).set_index("SEQN")
-    except HTTPError:
-        raise DownloadException(
-            f"Failed to download mortality data for {year}\n{url}")
+        raw, validators = fetchIfChanged(url, validators)
+    except HTTPStatusException as e:
+        raise _failed(e, f"Failed to download mortality data for {year}\n{url}")
+    except NetworkException as e:
+        raise _failed(e, "Request timed out")
+
+    if raw is None:
+        return None, validators
+    if mirror is not None:
+        mirror.put(manifestKey(year, "mortality"), raw, url, validators)
+    with timed("parse", source=url) as fields:
+        res = parseMortality(raw)
+        fields["rows"] = len(res)
+    return res, validators
+
+
+def downloadMortality(year: ContinuousNHANES) -> Mortality:
+    """
+    returns DataFrame of the ContinuousNHANES mortality data
+    """
+    res, _ = fetchMortality(year)
+    return res
+
+
+def storedMortality(year: ContinuousNHANES) -> Mortality:
+    """
+    returns DataFrame of the ContinuousNHANES mortality data, only downloading it once per process
+    (see nhanes_dl.mortality.mortalityStore)
+    """
+    return mortalityStore.get(year, lambda: downloadMortality(year))
 
 
 def downloadMortalityForYears(years: Set[ContinuousNHANES]) -> Mortality:
     """
     returns DataFrame of the ContinuousNHANES mortality data of the years passed in
     """
-    res = [downloadMortality(x) for x in years]
+    res = [storedMortality(x) for x in years]
     return appendMortalities(res)
 
 
@@ -159,7 +353,7 @@ def downloadCodebookWithMortality(year: ContinuousNHANES, codebook: str) -> Code
 
     """
     book = downloadCodebook(year, codebook)
-    mort = downloadMortality(year)
+    mort = storedMortality(year)
 
     return linkCodebookWithMortality(book, mort)
 
@@ -169,7 +363,7 @@ def downloadCodebooksWithMortality(c: CodebookDownload) -> Codebook:
     returns DataFrame of the ContinuousNHANES mortality data of the years passed in
     """
     book = downloadCodebooks(c)
-    mort = downloadMortality(c.year)
+    mort = storedMortality(c.year)
 
     return linkCodebookWithMortality(book, mort)
 
@@ -192,81 +386,321 @@ def downloadAllCodebooksWithMortalityForYears(c: Set[ContinuousNHANES]) -> Codeb
     return linkCodebookWithMortality(codebooks, mortality)
 
 
-# Download each nhanes code for that year, then cache the csv file in a directory
-def buildNhanesYearCache(cacheDir: str, c: ContinuousNHANES, updateCache: bool = False) -> bool:
+# Download each nhanes code for that year, then cache it in a directory as cacheFormat (see nhanes_dl.formats)
+# chunksize streams the codebooks too large to download into memory, chunksize rows at a time
+# Every codebook's outcome is recorded in the build journal (see nhanes_dl.journal), a codebook it records as done is
+# skipped while its file is unchanged. retryFailed only caches the codebooks that failed last time
+def buildNhanesYearCache(cacheDir: str, c: ContinuousNHANES, updateCache: bool = False,
+                         workers: int = 1, cacheFormat: str = defaultCacheFormat,
+                         chunksize: Optional[int] = None, retryFailed: bool = False) -> bool:
     makeDirectoryIfNotExists(cacheDir)
     description = getYearsCodebookDescriptions(c)
     dataFile = description.dataFile
     yearPath = nhanesYearSavePath(c)
     saveBase = f"{cacheDir}/{yearPath}"
     makeDirectoryIfNotExists(saveBase)
-
-    for codebookName in dataFile:
+    journal = journalFor(cacheDir)
+    if retryFailed:
+        failed = journal.withStatus(FAILED)
+        dataFile = [x for x in dataFile if manifestKey(c, x) in failed]
+
+    def cacheCodebook(codebookName):
+        key = manifestKey(c, codebookName)
+        savePath = f"{cacheDir}/{codebookSavePath(c, codebookName, cacheFormat)}"
+        cached = os.path.exists(savePath)
+        if cached and not updateCache and journaledCache(cacheDir, key, savePath):
+            emit("cacheHit", path=savePath)
+            recordAccess(savePath, hit=True)
+            return
+        if isIgnoredCodebook(codebookName, chunksize):
+            journal.skipped(key, "ignored codebook")
+            return
+        # A file the journal doesn't vouch for is cached again, an older csv cache is converted
+        update = updateCache or cached
         try:
-            savePath = f"{saveBase}/{codebookName}.csv"
-            readOrUpdateCache(
-                savePath, lambda: downloadCodebook(c, codebookName), updateCache)
-        except DownloadException:
-            print("Failed Download")
+            if chunksize and isStreamedCodebook(codebookName):
+                readOrStreamCache(savePath, c, codebookName, update, chunksize)
+                rows = manifestFor(cacheDir).get(key).get("rows")
+            else:
+                rows = len(readOrUpdateCache(
+                    savePath, lambda: downloadCodebookToCache(cacheDir, c, codebookName), update))
+            journal.done(key, savePath, rows, manifestFor(cacheDir).get(key).get("checksum"))
+        except DownloadException as e:
+            logger.warning("Failed to download %s for %s: %s", codebookName, c, e)
+            journal.failed(key, str(e) or type(e).__name__)
+
+    mapConcurrently(cacheCodebook, dataFile, workers)
+    return True
+
+
+def buildNhanesCache(cacheDir: str, updateCache: bool = False, workers: int = 1,
+                     cacheFormat: str = defaultCacheFormat, chunksize: Optional[int] = None,
+                     processes: Optional[int] = None, years: Optional[Set[ContinuousNHANES]] = None,
+                     retryFailed: bool = False) -> bool:
+    """
+    Caches every codebook of years (every ContinuousNHANES by default)
+    With processes the build is pipelined, workers threads fetch while processes convert (see nhanes_dl.pipeline)
+    and a report of what was cached, skipped and failed is saved to the cache directory
+    An interrupted build picks up where it stopped when run again, see resumeNhanesCache
+    """
+    if processes:
+        from nhanes_dl.pipeline import buildNhanesCachePipeline
+        report = buildNhanesCachePipeline(cacheDir, years, updateCache, workers, processes, cacheFormat, chunksize,
+                                          retryFailed=retryFailed)
+        logger.info(report.summary())
+        return True
+
+    makeDirectoryIfNotExists(cacheDir)
+    allSets = sorted(allContinuousNHANES() if years is None else years)
+    journalFor(cacheDir).startBuild(years=[int(y) for y in allSets], cacheFormat=cacheFormat, chunksize=chunksize)
+    with loggedStats(f"buildNhanesCache {cacheDir}"):
+        for year in allSets:
+            buildNhanesYearCache(cacheDir, year, updateCache, workers, cacheFormat, chunksize, retryFailed)
     return True
 
 
-def buildNhanesCache(cacheDir: str, updateCache: bool = False) -> bool:
-    allSets = allContinuousNHANES()
-    for year in allSets:
-        buildNhanesYearCache(cacheDir, year, updateCache)
+def resumeNhanesCache(cacheDir: str, retryFailed: bool = False, workers: int = 1,
+                      processes: Optional[int] = None) -> bool:
+    """
+    Runs the last build of cacheDir again, only caching what it didn't get to (see nhanes_dl.journal)
+    retryFailed only caches the codebooks that failed
+    """
+    last = journalFor(cacheDir).lastBuild()
+    if not last:
+        raise ValueError(f"{cacheDir} has no build to resume")
+    years = {ContinuousNHANES(y) for y in last["years"]}
+    return buildNhanesCache(cacheDir, False, workers, last["cacheFormat"], last["chunksize"], processes, years,
+                            retryFailed)
+
+
+def readOrStreamCache(savePath: str, year: ContinuousNHANES, codebook: str, updateCache: bool = False,
+                      chunksize: int = defaultChunksize) -> str:
+    """
+    Streams the codebook into savePath unless it is already cached, returning savePath
+    The codebook isn't read back, use readCacheCodebook (with columns) or the CacheFormat to read it
+    """
+    if os.path.exists(savePath) and not updateCache:
+        logger.debug("%s - already exists", savePath)
+        emit("cacheHit", path=savePath)
+        recordAccess(savePath, hit=True)
+        return savePath
+    emit("cacheMiss", path=savePath)
+    recordAccess(savePath, hit=False)
+    with FileLock(savePath):
+        if not os.path.exists(savePath) or updateCache:
+            streamCodebookToCache(year, codebook, savePath, chunksize)
+    return savePath
+
+
+def readCacheOrStreamCodebook(cacheDir: str, year: ContinuousNHANES, codebook: str,
+                              updateCache: bool = False, cacheFormat: str = defaultCacheFormat,
+                              chunksize: int = defaultChunksize) -> str:
+    """
+    Caches a codebook of any size by streaming it, returning the path it is cached at
+    """
+    makeDirectoryIfNotExists(cacheDir)
+    makeDirectoryIfNotExists(f"{cacheDir}/{nhanesYearSavePath(year)}")
+    savePath = f"{cacheDir}/{codebookSavePath(year, codebook, cacheFormat)}"
+    return readOrStreamCache(savePath, year, codebook, updateCache, chunksize)
+
+
+def migrateCache(cacheDir: str, cacheFormat: str = defaultCacheFormat, removeCsv: bool = False) -> List[str]:
+    """
+    Converts every csv file of a cache directory to cacheFormat, returning the paths written
+    Files already converted are skipped, removeCsv deletes each csv once it is converted
+    """
+    toFormat = getCacheFormat(cacheFormat)
+    written = []
+    if toFormat.name == CsvFormat.name:
+        return written
+
+    for y in allContinuousNHANES():
+        saveDir = f"{cacheDir}/{nhanesYearSavePath(y)}"
+        if not os.path.isdir(saveDir):
+            continue
+        for fileName in sorted(os.listdir(saveDir)):
+            name, extension = os.path.splitext(fileName)
+            if extension != CsvFormat.extension:
+                continue
+            csvPath = f"{saveDir}/{fileName}"
+            savePath = f"{saveDir}/{name}{toFormat.extension}"
+            if not os.path.exists(savePath):
+                res = CsvFormat().read(csvPath)
+                writeAtomically(savePath, lambda tmp: toFormat.write(res, tmp))
+                recordCacheFile(savePath, res)
+                written.append(savePath)
+            if removeCsv:
+                os.remove(csvPath)
+    return written
+
+
+def manifestKey(year: ContinuousNHANES, name: str) -> str:
+    return f"{nhanesYearSavePath(year)}/{name}"
+
+
+def downloadCodebookToCache(cacheDir: str, year: ContinuousNHANES, codebook: str) -> Codebook:
+    """
+    Downloads a codebook, recording the validators it was served with in the cache manifest
+    """
+    res, validators = fetchCodebook(year, codebook, mirror=mirrorFor(cacheDir))
+    manifestFor(cacheDir).update(manifestKey(year, codebook), **validators)
+    return res
+
+
+def downloadMortalityToCache(cacheDir: str, year: ContinuousNHANES) -> Mortality:
+    """
+    Downloads the mortality data of year, recording the validators it was served with in the cache manifest
+    """
+    res, validators = fetchMortality(year, mirror=mirrorFor(cacheDir))
+    manifestFor(cacheDir).update(manifestKey(year, "mortality"), **validators)
+    return res
+
+
+def _sameContent(res: pd.DataFrame, validators: Dict, recorded: Dict, savePath: str) -> bool:
+    # Whether what was downloaded again is what is cached, by the sha256 recorded for it or else the cached data
+    if recorded.get("sha256"):
+        return recorded["sha256"] == validators.get("sha256")
+    cached = readCachePath(savePath)
+    if cached is None or list(cached.columns) != list(res.columns) or len(cached) != len(res):
+        return False
+    try:
+        pd.testing.assert_frame_equal(cached, res, check_dtype=False, check_index_type=False,
+                                      check_column_type=False, check_categorical=False)
+    except (AssertionError, TypeError, ValueError):
+        return False
     return True
 
 
+def refreshCache(cacheDir: str, years: Optional[Set[ContinuousNHANES]] = None, workers: int = 1,
+                 cacheFormat: str = defaultCacheFormat) -> Dict[str, List[str]]:
+    """
+    Re-downloads only the cached codebooks and mortality data that changed on the CDC website
+    Each one is requested conditionally with the validators in the cache manifest, unchanged ones aren't converted again
+    Returns which entries were refreshed, unchanged or failed. An entry without validators (i.e cached by an older
+    version) is downloaded once and only rewritten (and reported refreshed) if its content differs from the cache file
+    Changed files are also kept in the raw mirror of cacheDir when it has one
+    """
+    manifest = manifestFor(cacheDir)
+    mirror = mirrorFor(cacheDir)
+    report = {"refreshed": [], "unchanged": [], "failed": []}
+    toRefresh = []
+    for year in sorted(allContinuousNHANES() if years is None else years):
+        names = joinableCodebooks(getYearsCodebookDescriptions(year).dataFile) + ["mortality"]
+        for name in names:
+            savePath = f"{cacheDir}/{codebookSavePath(year, name, cacheFormat)}"
+            if cachedPaths(savePath):
+                toRefresh.append((year, name, savePath))
+
+    def refresh(entry):
+        year, name, savePath = entry
+        key = manifestKey(year, name)
+        fetch = fetchMortality if name == "mortality" else lambda y, v, m: fetchCodebook(y, name, v, m)
+        # Entries cached before the raw mirror was enabled are downloaded again to fill it
+        recorded = manifest.get(key)
+        validators = recorded if mirror is None or key in mirror else {}
+        try:
+            res, validators = fetch(year, validators, mirror)
+            if res is not None and _sameContent(res, validators, recorded, savePath):
+                res = None
+            if res is not None:
+                with FileLock(savePath):
+                    writeAtomically(savePath, lambda tmp: formatOfPath(savePath).write(res, tmp))
+                    recordCacheFile(savePath, res)
+                if name == "mortality":
+                    mortalityStore.evict(year)
+                    mortalityStore.evict(_mortalityStoreKey(cacheDir, year))
+            manifest.update(key, **validators)
+            return key, "unchanged" if res is None else "refreshed"
+        except DownloadException:
+            return key, "failed"
+
+    with loggedStats(f"refreshCache {cacheDir}"):
+        for key, status in mapConcurrently(refresh, toRefresh, workers):
+            report[status].append(key)
+    return report
+
+
 def readCacheOrDownloadCodebook(cacheDir: str, year: ContinuousNHANES, codebook: str,
-                                updateCache: bool = False) -> pd.DataFrame:
-    savePath = f"{cacheDir}/{codebookSavePath(year, codebook)}"
+                                updateCache: bool = False, cacheFormat: str = defaultCacheFormat) -> pd.DataFrame:
+    savePath = f"{cacheDir}/{codebookSavePath(year, codebook, cacheFormat)}"
     saveDir = f"{cacheDir}/{nhanesYearSavePath(year)}"
     makeDirectoryIfNotExists(saveDir)
 
     try:
         return readOrUpdateCache(savePath,
-                                 lambda: downloadCodebook(year, codebook),
+                                 lambda: downloadCodebookToCache(cacheDir, year, codebook),
                                  updateCache)
     except DownloadException:
         return
 
 
-def readCacheOrDownloadAllCodebooks(cacheDir: str, year: ContinuousNHANES, updateCache: bool = False):
+def readCacheOrDownloadAllCodebooks(cacheDir: str, year: ContinuousNHANES, updateCache: bool = False,
+                                    cacheFormat: str = defaultCacheFormat):
     description = getYearsCodebookDescriptions(year)
-    dataFile = description.dataFile
-    allCodebooks = [readCacheOrDownloadCodebook(cacheDir, year, x, updateCache)
+    dataFile = joinableCodebooks(description.dataFile)
+    allCodebooks = [readCacheOrDownloadCodebook(cacheDir, year, x, updateCache, cacheFormat)
                     for x in dataFile]
     return joinCodebooks(allCodebooks)
 
 
-def readCacheOrDownloadNhanesYearCodebooks(cacheDir: str, years: Set[ContinuousNHANES], updateCache: bool = False):
+def readCacheOrDownloadNhanesYearCodebooks(cacheDir: str, years: Set[ContinuousNHANES], updateCache: bool = False,
+                                           cacheFormat: str = defaultCacheFormat):
     allResults = [readCacheOrDownloadAllCodebooks(
-        cacheDir, year, updateCache) for year in years]
+        cacheDir, year, updateCache, cacheFormat) for year in years]
     return appendCodebooks(allResults)
 
 
-def readCacheOrDownloadMortality(cacheDir: str, year: ContinuousNHANES, updateCache: bool = False):
+def readCacheOrDownloadCodebookFamily(cacheDir: str, family: str, years: Optional[Set[ContinuousNHANES]] = None,
+                                      updateCache: bool = False, cacheFormat: str = defaultCacheFormat,
+                                      workers: Optional[int] = None) -> Codebook:
+    """
+    readCacheOrDownloadCodebook for every data file of a codebook family (see downloadCodebookFamily)
+    The files of every year are read or downloaded at once (workers of them, all by default), then appended in year order
+    """
+    downloads = resolveFamily(family, years)
+    files = [(x.year, codebook) for x in downloads for codebook in sorted(x.codebooks)]
+    res = mapConcurrently(lambda f: readCacheOrDownloadCodebook(cacheDir, f[0], f[1], updateCache, cacheFormat),
+                          files, len(files) if workers is None else workers)
+    byYear = {x.year: [] for x in downloads}
+    for (year, _), df in zip(files, res):
+        byYear[year].append(df)
+    return appendCodebooks([joinCodebooks(frames) for frames in byYear.values()])
+
+
+def _mortalityStoreKey(cacheDir: str, year: ContinuousNHANES) -> Tuple[str, ContinuousNHANES]:
+    return os.path.abspath(cacheDir), year
+
+
+def readCacheOrDownloadMortality(cacheDir: str, year: ContinuousNHANES, updateCache: bool = False,
+                                 cacheFormat: str = defaultCacheFormat):
     saveDir = f"{cacheDir}/{nhanesYearSavePath(year)}"
-    savePath = f"{saveDir}/mortality.csv"
+    makeDirectoryIfNotExists(saveDir)
+    savePath = f"{cacheDir}/{mortalitySavePath(year, cacheFormat)}"
+    # Stored per cache directory, so filling each one records its own validators and raw mirror file
+    key = _mortalityStoreKey(cacheDir, year)
+    if updateCache:
+        mortalityStore.evict(key)
     try:
         return readOrUpdateCache(savePath,
-                                 lambda: downloadMortality(year),
+                                 lambda: mortalityStore.get(key, lambda: downloadMortalityToCache(cacheDir, year)),
                                  updateCache)
     except DownloadException:
         return
 
 
-def readCacheOrDownloadMortalityYears(cacheDir: str, years: Set[ContinuousNHANES], updateCache: bool = False):
+def readCacheOrDownloadMortalityYears(cacheDir: str, years: Set[ContinuousNHANES], updateCache: bool = False,
+                                      cacheFormat: str = defaultCacheFormat):
     res = [readCacheOrDownloadMortality(
-        cacheDir, y, updateCache) for y in years]
+        cacheDir, y, updateCache, cacheFormat) for y in years]
     return appendMortalities(res)
 
 
-def readCacheOrDownloadAllCodebooksWithMortality(cacheDir: str, years: Set[ContinuousNHANES], updateCache: bool = False):
+def readCacheOrDownloadAllCodebooksWithMortality(cacheDir: str, years: Set[ContinuousNHANES], updateCache: bool = False,
+                                                 cacheFormat: str = defaultCacheFormat):
     codebooks = readCacheOrDownloadNhanesYearCodebooks(
-        cacheDir, years, updateCache)
-    mortality = readCacheOrDownloadMortalityYears(cacheDir, years, updateCache)
+        cacheDir, years, updateCache, cacheFormat)
+    mortality = readCacheOrDownloadMortalityYears(
+        cacheDir, years, updateCache, cacheFormat)
     return linkCodebookWithMortality(codebooks, mortality)
 
 
@@ -275,51 +709,306 @@ def nhanesYearSavePath(c: ContinuousNHANES):
     return f"{s}-{e}"
 
 
-def codebookSavePath(c: ContinuousNHANES, codebookName: str):
+def codebookSavePath(c: ContinuousNHANES, codebookName: str, cacheFormat: str = defaultCacheFormat):
     year = nhanesYearSavePath(c)
-    return f"{year}/{codebookName}.csv"
+    return f"{year}/{codebookName}{getCacheFormat(cacheFormat).extension}"
 
 
-def readCacheCodebook(cacheDir: str, year: ContinuousNHANES, codebook: str):
-    savePath = f"{cacheDir}/{codebookSavePath(year, codebook)}"
-    try:
-        return pd.read_csv(savePath).set_index("SEQN")
-    except Exception:
-        print(f"Couldn't read cache - {savePath}")
+def mortalitySavePath(c: ContinuousNHANES, cacheFormat: str = defaultCacheFormat):
+    return codebookSavePath(c, "mortality", cacheFormat)
+
+
+def cachedPaths(savePath: str) -> List[str]:
+    """
+    Returns the files savePath is cached as, the csv written by older versions comes after savePath
+    """
+    csvPath = f"{os.path.splitext(savePath)[0]}{CsvFormat.extension}"
+    return [p for p in dict.fromkeys([savePath, csvPath]) if os.path.exists(p)]
+
+
+def journaledCache(cacheDir: str, key: str, savePath: str, verify: bool = False) -> bool:
+    """
+    Whether the codebook of key is cached at savePath (or its older csv), so a build can skip it
+    A file the journal recorded must still match it (see BuildJournal.isDone), one it doesn't know of
+    (i.e cached before there was a journal) must be readable and is recorded as done
+    """
+    journal = journalFor(cacheDir)
+    entry = journal.get(key)
+    for path in cachedPaths(savePath):
+        if entry.get("status") == DONE and entry.get("file") == os.path.relpath(path, cacheDir):
+            return journal.isDone(key, path, verify)
+        try:
+            formatOfPath(path).schema(path)
+        except Exception:
+            continue
+        journal.done(key, path, manifestFor(cacheDir).get(key).get("rows"))
+        return True
+    return False
+
+
+def readCachePath(savePath: str, columns: Optional[List[str]] = None,
+                  seqnRange: Optional[SEQNRange] = None) -> pd.DataFrame:
+    """
+    Reads a cache file, falling back to the csv written by older versions when savePath isn't cached
+    Only columns and the rows in seqnRange are read when given. Returns None if neither can be read
+    A csv gets back the dtypes recorded for it in the manifest, then the dtype policy is applied (see nhanes_dl.dtypes)
+    """
+    for path in cachedPaths(savePath):
+        try:
+            cacheFormat = formatOfPath(path)
+            res = cacheFormat.read(path, columns, seqnRange)
+        except Exception:
+            continue
+        if cacheFormat.name == CsvFormat.name:
+            entry = manifestFor(os.path.dirname(os.path.dirname(path)) or ".").get(keyOfPath(path))
+            if entry.get("format") == CsvFormat.name:
+                res = restoreDtypes(res, entry.get("columns", {}))
+        recordAccess(path)
+        return compact(res, path)
+    logger.warning("Couldn't read cache - %s", savePath)
+    return None
+
+
+def readCacheCodebook(cacheDir: str, year: ContinuousNHANES, codebook: str,
+                      cacheFormat: str = defaultCacheFormat, columns: Optional[List[str]] = None,
+                      seqnRange: Optional[SEQNRange] = None):
+    return readCachePath(f"{cacheDir}/{codebookSavePath(year, codebook, cacheFormat)}", columns, seqnRange)
+
+
+def cachedEntries(cacheDir: str, year: ContinuousNHANES,
+                  cacheFormat: str = defaultCacheFormat) -> Optional[Dict[str, Dict]]:
+    """
+    Returns the manifest entry of every codebook of a NHANES year cached as cacheFormat (or csv), keyed by codebook
+    Returns None when the manifest has nothing for the year, i.e the cache was built before there was one
+    Files of a year the manifest only partly lists (cached before there was one) are recorded first
+    """
+    manifest = manifestFor(cacheDir)
+    files = manifest.cachedFiles(nhanesYearSavePath(year))
+    if not files:
         return None
+    if _indexYear(cacheDir, year, listed=files):
+        files = manifest.cachedFiles(nhanesYearSavePath(year))
+    extensions = [getCacheFormat(cacheFormat).extension, CsvFormat.extension]
+    return {name: entry for name, entry in files.items()
+            if os.path.splitext(entry["file"])[1] in extensions}
+
+
+def cachedCodebooks(cacheDir: str, year: ContinuousNHANES, cacheFormat: str = defaultCacheFormat) -> List[str]:
+    """
+    Returns which codebooks of a NHANES year are cached, in catalog order
+    """
+    entries = cachedEntries(cacheDir, year, cacheFormat)
+    dataFile = getYearsCodebookDescriptions(year).dataFile
+    if entries is None:
+        return [x for x in dataFile if cachedPaths(f"{cacheDir}/{codebookSavePath(year, x, cacheFormat)}")]
+    return [x for x in dataFile if x in entries]
 
 
-def readCacheAllCodebooks(cacheDir: str, year: ContinuousNHANES):
+def _indexYear(cacheDir: str, year: ContinuousNHANES, listed: Optional[Dict[str, Dict]] = None) -> int:
+    """
+    Records the cache files of a NHANES year directory whose codebook isn't in listed (when given) in the manifest
+    Files that can't be read are left out. Returns how many files were recorded
+    """
+    saveDir = f"{cacheDir}/{nhanesYearSavePath(year)}"
+    if not os.path.isdir(saveDir):
+        return 0
+    recorded = 0
+    for fileName in sorted(os.listdir(saveDir)):
+        path = f"{saveDir}/{fileName}"
+        if listed is not None and os.path.splitext(fileName)[0] in listed:
+            continue
+        try:
+            cacheFormat = formatOfPath(path)
+        except ValueError:
+            continue
+        try:
+            rows = len(cacheFormat.read(path, []))
+        except Exception:
+            if listed is None:
+                raise
+            continue
+        recordCacheFile(path, rows=rows)
+        recorded += 1
+    return recorded
+
+
+def indexCache(cacheDir: str) -> int:
+    """
+    Records every cache file of a cache directory in its manifest, for caches built before there was one
+    Returns how many files were recorded
+    """
+    return sum(_indexYear(cacheDir, y) for y in allContinuousNHANES())
+
+
+def readCacheAllCodebooks(cacheDir: str, year: ContinuousNHANES, cacheFormat: str = defaultCacheFormat):
     description = getYearsCodebookDescriptions(year)
-    dataFile = description.dataFile
-    res = [readCacheCodebook(cacheDir, year, codebook)
-           for codebook in dataFile]
+    dataFile = joinableCodebooks(description.dataFile)
+    entries = cachedEntries(cacheDir, year, cacheFormat)
+    if entries is not None:
+        # Only the codebooks the manifest lists are read, no need to try every codebook of the catalog
+        res = [readCachePath(f"{cacheDir}/{entries[codebook]['file']}")
+               for codebook in dataFile if codebook in entries]
+    else:
+        res = [readCacheCodebook(cacheDir, year, codebook, cacheFormat)
+               for codebook in dataFile]
     res = [x for x in res if x is not None]
     return joinCodebooks(res)
 
 
-def readCacheNhanesYears(cacheDir: str, years: Set[ContinuousNHANES]):
-    res = [readCacheAllCodebooks(cacheDir, y) for y in years]
+def readCacheNhanesYears(cacheDir: str, years: Set[ContinuousNHANES], cacheFormat: str = defaultCacheFormat):
+    res = [readCacheAllCodebooks(cacheDir, y, cacheFormat) for y in years]
     return appendCodebooks(res)
 
 
-def readCacheMortality(cacheDir: str, year: ContinuousNHANES):
-    saveDir = f"{cacheDir}/{nhanesYearSavePath(year)}"
-    savePath = f"{saveDir}/mortality.csv"
-    try:
-        return pd.read_csv(savePath).set_index("SEQN")
-    except Exception:
-        print(f"Couldn't read cache - {savePath}")
-        return None
+def cachedCodebookVariables(cacheDir: str, year: ContinuousNHANES,
+                            cacheFormat: str = defaultCacheFormat) -> Dict[str, List[str]]:
+    """
+    Returns the variables of every cached codebook of a NHANES year, from the manifest or else the file schemas
+    Codebooks are in catalog order, ones that aren't cached or are streamed (long format) are left out
+    """
+    description = getYearsCodebookDescriptions(year)
+    dataFile = joinableCodebooks(description.dataFile)
+    entries = cachedEntries(cacheDir, year, cacheFormat)
+    if entries is not None:
+        return {codebook: list(entries[codebook]["columns"]) for codebook in dataFile if codebook in entries}
+
+    res = {}
+    for codebook in dataFile:
+        for path in cachedPaths(f"{cacheDir}/{codebookSavePath(year, codebook, cacheFormat)}"):
+            try:
+                res[codebook] = formatOfPath(path).columns(path)
+                break
+            except Exception:
+                continue
+    return res
+
+
+def selectCodebookVariables(codebookVariables: Dict[str, List[str]], variables: List[str]) -> Dict[str, List[str]]:
+    """
+    Returns which codebook each variable is read from, only codebooks with a selected variable are kept
+    A variable found in multiple codebooks is read from the first one
+    """
+    remaining = list(dict.fromkeys(variables))
+    res = {}
+    for codebook, columns in codebookVariables.items():
+        found = [v for v in remaining if v in set(columns)]
+        if found:
+            res[codebook] = found
+            remaining = [v for v in remaining if v not in found]
+    return res
+
+
+def readCacheVariables(cacheDir: str, year: ContinuousNHANES, variables: List[str],
+                       cacheFormat: str = defaultCacheFormat) -> Codebook:
+    """
+    returns DataFrame of only the variables asked for (i.e RIDAGEYR, LBXGLU) for a NHANES year
+    Only the codebooks containing them are read, and only those columns of them
+    Variables that aren't in any cached codebook are left out
+    """
+    toRead = selectCodebookVariables(
+        cachedCodebookVariables(cacheDir, year, cacheFormat), variables)
+    res = [readCachePath(f"{cacheDir}/{codebookSavePath(year, codebook, cacheFormat)}", columns)
+           for codebook, columns in toRead.items()]
+    res = [x for x in res if x is not None]
+    if not res:
+        return Codebook(pd.DataFrame(index=pd.Index([], name="SEQN")))
+
+    joined = joinCodebooks(res)
+    return Codebook(joined[[v for v in dict.fromkeys(variables) if v in joined.columns]])
+
+
+def readCacheNhanesYearsVariables(cacheDir: str, years: Set[ContinuousNHANES], variables: List[str],
+                                  cacheFormat: str = defaultCacheFormat) -> Codebook:
+    res = [readCacheVariables(cacheDir, y, variables, cacheFormat) for y in years]
+    return appendCodebooks(res)
+
+
+def readCacheOrDownloadVariables(cacheDir: str, year: ContinuousNHANES, variables: List[str],
+                                 updateCache: bool = False, workers: int = 1,
+                                 cacheFormat: str = defaultCacheFormat) -> Codebook:
+    """
+    Same as readCacheVariables, but caches the year first
+    The catalog doesn't list the variables of each codebook, so any codebook not cached yet is downloaded
+    """
+    buildNhanesYearCache(cacheDir, year, updateCache, workers, cacheFormat)
+    return readCacheVariables(cacheDir, year, variables, cacheFormat)
+
+
+def readCacheOrDownloadNhanesYearsVariables(cacheDir: str, years: Set[ContinuousNHANES], variables: List[str],
+                                            updateCache: bool = False, workers: int = 1,
+                                            cacheFormat: str = defaultCacheFormat) -> Codebook:
+    res = [readCacheOrDownloadVariables(cacheDir, y, variables, updateCache, workers, cacheFormat)
+           for y in years]
+    return appendCodebooks(res)
+
 
+def readCacheMortality(cacheDir: str, year: ContinuousNHANES, cacheFormat: str = defaultCacheFormat,
+                       seqnRange: Optional[SEQNRange] = None):
+    return readCachePath(f"{cacheDir}/{mortalitySavePath(year, cacheFormat)}", None, seqnRange)
 
-def readCacheMortalityYears(cacheDir: str, years: Set[ContinuousNHANES]):
-    res = [readCacheMortality(cacheDir, y) for y in years]
+
+def readCacheMortalityYears(cacheDir: str, years: Set[ContinuousNHANES], cacheFormat: str = defaultCacheFormat):
+    res = [readCacheMortality(cacheDir, y, cacheFormat) for y in years]
     res = [x for x in res if x is not None]
     return appendMortalities(res)
 
 
-def readCacheNhanesYearsWithMortality(cacheDir: str, years: Set[ContinuousNHANES]):
-    codebooks = readCacheNhanesYears(cacheDir, years)
-    mortality = readCacheMortalityYears(cacheDir, years)
+def readCacheNhanesYearsWithMortality(cacheDir: str, years: Set[ContinuousNHANES],
+                                      cacheFormat: str = defaultCacheFormat):
+    codebooks = readCacheNhanesYears(cacheDir, years, cacheFormat)
+    mortality = readCacheMortalityYears(cacheDir, years, cacheFormat)
     return linkCodebookWithMortality(codebooks, mortality)
+
+
+# Directory of a cache the linked datasets of readCacheLinkedYears are kept in
+linkedDirectory = "linked"
+
+
+def _linkedSources(cacheDir: str, years: Set[ContinuousNHANES]) -> str:
+    # Digest of every file cached for years, it changes whenever one of them does
+    # A file is described by its manifest checksum, or its size and mtime when the manifest doesn't list it
+    entries = manifestFor(cacheDir).entries()
+    files = []
+    for y in sorted(years):
+        saveDir = f"{cacheDir}/{nhanesYearSavePath(y)}"
+        for fileName in sorted(os.listdir(saveDir)) if os.path.isdir(saveDir) else []:
+            path = f"{saveDir}/{fileName}"
+            try:
+                formatOfPath(path)
+            except ValueError:
+                continue
+            entry = entries.get(keyOfPath(path), {})
+            if entry.get("file") == os.path.relpath(path, cacheDir) and entry.get("checksum"):
+                files.append((fileName, entry["checksum"]))
+            else:
+                stat = os.stat(path)
+                files.append((fileName, stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha256(repr(files).encode()).hexdigest()[:16]
+
+
+def readCacheLinkedYears(cacheDir: str, years: Set[ContinuousNHANES], cacheFormat: str = defaultCacheFormat,
+                         linkedFormat: str = "feather") -> Codebook:
+    """
+    readCacheNhanesYearsWithMortality kept in the cache as one linkedFormat file, so later calls read it
+    instead of joining again. As feather (uncompressed) the file is memory mapped, processes on a host
+    reading it share one copy in the page cache rather than each holding their own
+    The file is named after a digest of the years' cache files, so it is linked again once one changes
+    """
+    name = "_".join(str(int(y)) for y in sorted(years))
+    linkedDir = f"{cacheDir}/{linkedDirectory}"
+    savePath = f"{linkedDir}/{name}-{_linkedSources(cacheDir, years)}{getCacheFormat(linkedFormat).extension}"
+    if os.path.exists(savePath):
+        emit("cacheHit", path=savePath)
+        recordAccess(savePath, hit=True)
+    else:
+        makeDirectoryIfNotExists(linkedDir)
+        # Only written here, the file is mapped below like on a hit
+        readOrUpdateCache(savePath, lambda: readCacheNhanesYearsWithMortality(cacheDir, years, cacheFormat))
+        for stale in os.listdir(linkedDir):
+            path = f"{linkedDir}/{stale}"
+            if stale.startswith(f"{name}-") and path != savePath and not stale.endswith((".lock", ".partial")):
+                with FileLock(path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                    manifestFor(cacheDir).remove(keyOfPath(path))
+    return readCachePath(savePath)
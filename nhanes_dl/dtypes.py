@@ -0,0 +1,107 @@
+import time
+from typing import Dict, Optional
+import numpy as np
+import pandas as pd
+from nhanes_dl.events import emit, logger
+from nhanes_dl.merge import _smallIntegerDtype
+
+# Opt in compaction of codebook dtypes. pd.read_sas returns every numeric NHANES variable as float64 and every
+# character one as bytes, though most variables are small codes (1, 2, 7, 9) or integers like ages
+# A DtypePolicy stores integral columns as nullable Int8/Int16/Int32, optionally low cardinality ones as categoricals,
+# and character columns as pyarrow strings. Once set (see setDtypePolicy) it is applied to every downloaded codebook
+# and every cache read. The binary cache formats keep the compact dtypes, csv caches get them back from the manifest
+
+
+class DtypePolicy:
+    """
+    integers stores float columns only holding integers as the smallest nullable int dtype
+    categoryMaxCodes stores integer columns with at most that many distinct codes as categoricals instead
+    strings stores character columns as pyarrow strings, with empty values missing
+    """
+
+    def __init__(self, integers: bool = True, categoryMaxCodes: Optional[int] = None, strings: bool = True):
+        self.integers = integers
+        self.categoryMaxCodes = categoryMaxCodes
+        self.strings = strings
+
+    def column(self, values: pd.Series) -> pd.Series:
+        dtype = values.dtype
+        if self.strings and dtype == object:
+            return _strings(values)
+        if not isinstance(dtype, np.dtype) or dtype.kind not in "fiu":
+            return values
+
+        array = values.to_numpy(dtype="float64")
+        nullable = _smallIntegerDtype([array])
+        if nullable is None:
+            return values
+        if self.categoryMaxCodes:
+            codes = np.unique(array[~np.isnan(array)])
+            if 0 < len(codes) <= self.categoryMaxCodes:
+                categories = pd.Index(codes.astype(nullable.numpy_dtype))
+                return values.astype(nullable).astype(pd.CategoricalDtype(categories))
+        return values.astype(nullable) if self.integers else values
+
+    def apply(self, df: pd.DataFrame, source: str = "") -> pd.DataFrame:
+        """
+        Returns df with compact dtypes, emitting a compact event with the bytes saved (see nhanes_dl.events)
+        """
+        start = time.perf_counter()
+        before = memoryUsage(df)
+        res = pd.DataFrame({i: self.column(df.iloc[:, i]) for i in range(df.shape[1])}, index=df.index)
+        res.columns = df.columns
+        after = memoryUsage(res)
+        logger.debug("Compacted %s from %d to %d bytes", source, before, after)
+        emit("compact", source=source, bytesBefore=before, bytesAfter=after, saved=before - after,
+             seconds=time.perf_counter() - start)
+        return res
+
+
+def _strings(values: pd.Series) -> pd.Series:
+    decoded = values.map(lambda v: v.decode("latin-1") if isinstance(v, bytes) else v)
+    return decoded.mask(decoded == "").astype("string[pyarrow]")
+
+
+def memoryUsage(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True).sum())
+
+
+def restoreDtypes(df: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    """
+    Casts the columns of df read from a csv cache back to the dtypes recorded for them in the manifest
+    """
+    casts = {c: t for c, t in dtypes.items() if c in df.columns and str(df[c].dtype) != t}
+    for column, dtype in casts.items():
+        try:
+            if dtype == "category":
+                df[column] = df[column].astype(_smallIntegerDtype([df[column].to_numpy(dtype="float64")])
+                                               or "float64").astype("category")
+            else:
+                df[column] = df[column].astype(dtype)
+        except (TypeError, ValueError):
+            continue
+    return df
+
+
+_policy: Optional[DtypePolicy] = None
+
+
+def getDtypePolicy() -> Optional[DtypePolicy]:
+    return _policy
+
+
+def setDtypePolicy(policy: Optional[DtypePolicy]) -> Optional[DtypePolicy]:
+    """
+    Applies policy to every downloaded codebook and cache read from now on, None turns compaction off
+    Returns the previous policy. A pipelined build hands it to its conversion processes when it starts
+    """
+    global _policy
+    previous, _policy = _policy, policy
+    return previous
+
+
+def compact(df: pd.DataFrame, source: str = "") -> pd.DataFrame:
+    """
+    Applies the dtype policy to df when one is set
+    """
+    return df if _policy is None or df is None else _policy.apply(df, source)
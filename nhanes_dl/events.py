@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List
+
+# Instrumentation of nhanes_dl. Messages go to the "nhanes_dl" logger, configure logging to see them
+# and every download, cache lookup, parse, join and retry is emitted as an event to the subscribed listeners
+#
+# event           fields
+# downloadStart   url
+# download        url, status (304 when unchanged), bytes, seconds
+# downloadFailed  url, error, seconds
+# retry           url, attempt, delay, error
+# cacheHit        path
+# cacheMiss       path
+# cacheWrite      path, rows, seconds
+# parse           source, rows, seconds
+# join, append, linkMortality   frames, rows, columns, seconds
+# compact         source, bytesBefore, bytesAfter, saved, seconds
+# rollup          source, rows, groups, seconds
+# evict           path, bytes
+
+logger = logging.getLogger("nhanes_dl")
+logger.addHandler(logging.NullHandler())
+
+Listener = Callable[[str, Dict], None]
+
+# Replaced rather than mutated, so emit can iterate it without a lock
+_listeners: List[Listener] = []
+_listenersLock = threading.Lock()
+
+
+def subscribe(listener: Listener) -> Listener:
+    """
+    Calls listener(event, fields) for every event from now on, returns listener
+    """
+    global _listeners
+    with _listenersLock:
+        _listeners = _listeners + [listener]
+    return listener
+
+
+def unsubscribe(listener: Listener):
+    global _listeners
+    with _listenersLock:
+        _listeners = [x for x in _listeners if x is not listener]
+
+
+def emit(event: str, **fields):
+    for listener in _listeners:
+        try:
+            listener(event, fields)
+        except Exception:
+            logger.exception("Listener failed on %s", event)
+
+
+@contextmanager
+def timed(event: str, **fields) -> Iterator[Dict]:
+    """
+    Emits event with the seconds the block took, fields set on the yielded dict are emitted too
+    Nothing is emitted if the block raises
+    """
+    start = time.perf_counter()
+    yield fields
+    emit(event, seconds=time.perf_counter() - start, **fields)
+
+
+def frameFields(frames, res) -> Dict:
+    return {"frames": len([f for f in frames if f is not None]), "rows": len(res), "columns": len(res.columns)}
+
+
+class StageStats:
+    """
+    Listener totalling events by name, the count, busy seconds (summed over threads), bytes, rows and bytes saved
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.totals: Dict[str, Dict[str, float]] = {}
+
+    def __call__(self, event: str, fields: Dict):
+        with self._lock:
+            total = self.totals.setdefault(event, {"count": 0, "seconds": 0.0, "bytes": 0, "rows": 0, "saved": 0})
+            total["count"] += 1
+            for k in ("seconds", "bytes", "rows", "saved"):
+                total[k] += fields.get(k) or 0
+
+    def summary(self) -> str:
+        with self._lock:
+            totals = {k: dict(v) for k, v in sorted(self.totals.items())}
+        lines = [f"{time.perf_counter() - self.started:.2f}s elapsed"]
+        for event, total in totals.items():
+            line = f"{event:>14}: {total['count']:6d}"
+            if total["seconds"]:
+                line += f" {total['seconds']:9.2f}s busy"
+                if total["bytes"]:
+                    line += f" {total['bytes'] / 2 ** 20 / total['seconds']:8.1f} MiB/s"
+                if total["rows"]:
+                    line += f" {total['rows'] / total['seconds']:11.0f} rows/s"
+            if total["saved"]:
+                line += f" {total['saved'] / 2 ** 20:8.1f} MiB saved"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+@contextmanager
+def collectStats() -> Iterator[StageStats]:
+    """
+    Totals the events of the block, i.e
+    with collectStats() as stats:
+        buildNhanesCache(cacheDir)
+    print(stats.summary())
+    """
+    stats = subscribe(StageStats())
+    try:
+        yield stats
+    finally:
+        unsubscribe(stats)
+
+
+@contextmanager
+def loggedStats(operation: str) -> Iterator[StageStats]:
+    """
+    collectStats that logs the summary at INFO once the block is done, used by the bulk operations
+    """
+    with collectStats() as stats:
+        yield stats
+    logger.info("%s\n%s", operation, stats.summary())
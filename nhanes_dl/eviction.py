@@ -0,0 +1,274 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+from nhanes_dl.catalog import familyOf
+from nhanes_dl.events import emit, logger
+from nhanes_dl.locks import FileLock, writeAtomically
+from nhanes_dl.manifest import keyOfPath, manifestFor
+from nhanes_dl.mirror import mirrorDirName, mirrorFor
+
+# Size budget of a cache directory, for caches on shared scratch disks
+# A budget caps the bytes the cache files of a directory take, once a write goes over it the least recently used
+# files are evicted until it fits again. Pinned codebooks are never evicted. An evicted codebook is cached again
+# by the next readCacheOrDownload* call that needs it, like one that was never cached
+# The files of the raw mirror (see nhanes_dl.mirror) count too, keyed "raw/{startYear}-{endYear}/{codebook}"
+#
+# {cacheDir}/cache_budget.json  maxBytes and the pinned codebooks, set with setCacheBudget and pin
+# {cacheDir}/cache_access.json  last access of every cached codebook and the hits and misses of cache reads
+# Accesses are kept in memory and written every accessFlushSeconds (and before evicting), so reads don't write files
+
+budgetFileName = "cache_budget.json"
+accessFileName = "cache_access.json"
+accessFlushSeconds = 30
+
+
+def _readJson(path: str) -> Dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _writeJson(path: str, value: Dict):
+    def write(tmp):
+        with open(tmp, "w") as f:
+            json.dump(value, f, indent=1, sort_keys=True)
+    writeAtomically(path, write)
+
+
+class AccessLog:
+    """
+    Last access time of every codebook of a cache directory, with the hits and misses of its cache reads
+    Processes sharing the directory merge what they recorded when flushing
+    """
+
+    def __init__(self, cacheDir: str):
+        self.cacheDir = cacheDir
+        self._lock = threading.Lock()
+        self._accessed: Dict[str, float] = {}
+        self._hits = 0
+        self._misses = 0
+        self._flushed = time.time()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.cacheDir, accessFileName)
+
+    def record(self, key: str, hit: Optional[bool] = None):
+        """
+        Records an access of key now, counted as a hit or miss of a cache read when hit is given
+        """
+        with self._lock:
+            self._accessed[key] = time.time()
+            if hit is not None:
+                self._hits += hit
+                self._misses += not hit
+            due = time.time() - self._flushed > accessFlushSeconds
+        if due:
+            self.flush()
+
+    def flush(self) -> Dict:
+        """
+        Merges what was recorded since the last flush into the access file, returns its content
+        """
+        with self._lock:
+            accessed, hits, misses = self._accessed, self._hits, self._misses
+            self._accessed, self._hits, self._misses = {}, 0, 0
+            self._flushed = time.time()
+        if not os.path.isdir(self.cacheDir):
+            return {}
+        with FileLock(self.path):
+            saved = _readJson(self.path)
+            merged = saved.setdefault("accessed", {})
+            for key, at in accessed.items():
+                merged[key] = max(at, merged.get(key, 0))
+            saved["hits"] = saved.get("hits", 0) + hits
+            saved["misses"] = saved.get("misses", 0) + misses
+            if accessed or hits or misses:
+                _writeJson(self.path, saved)
+        return saved
+
+    def forget(self, keys: Iterable[str]):
+        keys = set(keys)
+        with self._lock:
+            for key in keys:
+                self._accessed.pop(key, None)
+        with FileLock(self.path):
+            saved = _readJson(self.path)
+            accessed = saved.get("accessed", {})
+            if keys & set(accessed):
+                saved["accessed"] = {k: v for k, v in accessed.items() if k not in keys}
+                _writeJson(self.path, saved)
+
+
+_accessLogs: Dict[str, AccessLog] = {}
+_accessLogsLock = threading.Lock()
+
+
+def accessLogFor(cacheDir: str) -> AccessLog:
+    key = os.path.abspath(cacheDir)
+    with _accessLogsLock:
+        log = _accessLogs.get(key)
+        if log is None:
+            log = _accessLogs[key] = AccessLog(cacheDir)
+        return log
+
+
+def recordAccess(path: str, hit: Optional[bool] = None):
+    """
+    Records a read (hit or miss when given) of the cache file at {cacheDir}/{startYear}-{endYear}/{codebook}.{extension}
+    """
+    accessLogFor(os.path.dirname(os.path.dirname(path)) or ".").record(keyOfPath(path), hit)
+
+
+def getCacheBudget(cacheDir: str) -> Dict:
+    """
+    Returns the budget of cacheDir, its maxBytes (None when unbounded) and pinned codebooks
+    """
+    budget = _readJson(os.path.join(cacheDir, budgetFileName))
+    return {"maxBytes": budget.get("maxBytes"), "pinned": budget.get("pinned", [])}
+
+
+def _changeBudget(cacheDir: str, change):
+    os.makedirs(cacheDir, exist_ok=True)
+    path = os.path.join(cacheDir, budgetFileName)
+    with FileLock(path):
+        budget = getCacheBudget(cacheDir)
+        change(budget)
+        _writeJson(path, budget)
+
+
+def setCacheBudget(cacheDir: str, maxBytes: Optional[int]) -> List[str]:
+    """
+    Caps the bytes the cache files of cacheDir (and its raw mirror, if enabled) take at maxBytes, None removes the cap
+    Evicts right away if the cache is already over it, returning the keys evicted
+    """
+    _changeBudget(cacheDir, lambda budget: budget.update(maxBytes=maxBytes))
+    return evict(cacheDir)
+
+
+def pin(cacheDir: str, *codebooks: str):
+    """
+    Never evicts codebooks, each a manifest key ("2005-2006/DEMO_D"), a data file (DEMO_D) or a family (DEMO)
+    """
+    _changeBudget(cacheDir, lambda budget: budget.update(pinned=sorted(set(budget["pinned"]) | set(codebooks))))
+
+
+def unpin(cacheDir: str, *codebooks: str):
+    _changeBudget(cacheDir, lambda budget: budget.update(pinned=sorted(set(budget["pinned"]) - set(codebooks))))
+
+
+def isPinned(key: str, pinned: Iterable[str]) -> bool:
+    # Pinning a codebook also pins its raw file
+    if key.startswith(f"{mirrorDirName}/"):
+        key = key.split("/", 1)[1]
+    codebook = key.split("/", 1)[-1]
+    return bool({key, codebook, familyOf(codebook)} & set(pinned))
+
+
+def budgetedFiles(cacheDir: str) -> Dict[str, Dict]:
+    """
+    Returns the path and bytes of every file the budget of cacheDir counts, keyed by its manifest key,
+    or "raw/{key}" for a file of the raw mirror ("raw/objects/..." for one no key holds anymore)
+    A raw file held by several keys is only counted once
+    """
+    res = {k: {"path": os.path.join(cacheDir, v["file"]), "bytes": v.get("bytes", 0)}
+           for k, v in manifestFor(cacheDir).entries().items() if "file" in v}
+    mirror = mirrorFor(cacheDir)
+    counted = set()
+    for name, path in (mirror.files() if mirror is not None else {}).items():
+        res[f"{mirrorDirName}/{name}"] = {"path": path, "bytes": 0 if path in counted else os.path.getsize(path)}
+        counted.add(path)
+    return res
+
+
+def _remove(cacheDir: str, key: str, file: Dict) -> Optional[int]:
+    # Returns the bytes freed, None when the file is locked
+    if key.startswith(f"{mirrorDirName}/"):
+        return mirrorFor(cacheDir).remove(key.split("/", 1)[1])
+    # A file locked is being cached right now, waiting on it could deadlock with the job caching it
+    lock = FileLock(file["path"]).acquire(blocking=False)
+    if lock is None:
+        return None
+    try:
+        if os.path.exists(file["path"]):
+            os.remove(file["path"])
+        manifestFor(cacheDir).remove(key)
+    finally:
+        lock.release()
+    return file["bytes"]
+
+
+def evict(cacheDir: str, maxBytes: Optional[int] = None, keep: Iterable[str] = ()) -> List[str]:
+    """
+    Removes the least recently used cache and raw mirror files of cacheDir until they take at most maxBytes
+    (the budget's when None), pinned codebooks and keep are never removed. Raw files no key holds anymore go first
+    Returns the keys evicted
+    """
+    budget = getCacheBudget(cacheDir)
+    maxBytes = budget["maxBytes"] if maxBytes is None else maxBytes
+    if maxBytes is None:
+        return []
+    files = budgetedFiles(cacheDir)
+    total = sum(v["bytes"] for v in files.values())
+    if total <= maxBytes:
+        return []
+
+    accessed = accessLogFor(cacheDir).flush().get("accessed", {})
+    keep = set(keep)
+    candidates = [k for k in files if k not in keep and not isPinned(k, budget["pinned"])]
+    mirror = mirrorFor(cacheDir)
+    held = {f"{mirrorDirName}/{k}" for k in (mirror.entries() if mirror is not None else {})}
+
+    def lastUsed(key):
+        if key.startswith(f"{mirrorDirName}/") and key not in held:
+            return 0
+        path = files[key]["path"]
+        written = os.path.getmtime(path) if os.path.exists(path) else 0
+        return max(accessed.get(key, 0), written)
+
+    evicted = []
+    for key in sorted(candidates, key=lastUsed):
+        if total <= maxBytes:
+            break
+        freed = _remove(cacheDir, key, files[key])
+        if freed is None:
+            continue
+        total -= freed
+        evicted.append(key)
+        emit("evict", path=files[key]["path"], bytes=freed)
+    accessLogFor(cacheDir).forget(evicted)
+    if total > maxBytes:
+        logger.warning("%s is still over its budget of %d bytes, the rest is pinned or in use", cacheDir, maxBytes)
+    return evicted
+
+
+def enforceBudget(cacheDir: str, written: Optional[str] = None) -> List[str]:
+    """
+    Evicts once a write took cacheDir over its budget, keeping the codebook just written
+    """
+    if getCacheBudget(cacheDir)["maxBytes"] is None:
+        return []
+    return evict(cacheDir, keep=[written] if written else [])
+
+
+def cacheStats(cacheDir: str) -> Dict:
+    """
+    Returns the entries and bytes on disk of cacheDir, the bytes compression saves (against the data uncompressed),
+    the bytes its raw mirror takes, the hits, misses and hit rate of its cache reads, and its budget
+    """
+    access = accessLogFor(cacheDir).flush()
+    cached = [v for v in manifestFor(cacheDir).entries().values() if "file" in v]
+    onDisk = sum(v.get("bytes", 0) for v in cached)
+    # Against the file itself for the few files whose headers outweigh what compression saved
+    uncompressed = sum(max(v.get("uncompressedBytes", 0), v.get("bytes", 0)) for v in cached)
+    raw = sum(v["bytes"] for k, v in budgetedFiles(cacheDir).items() if k.startswith(f"{mirrorDirName}/"))
+    hits, misses = access.get("hits", 0), access.get("misses", 0)
+    budget = getCacheBudget(cacheDir)
+    return {"entries": len(cached), "bytes": onDisk, "uncompressedBytes": uncompressed,
+            "savedBytes": uncompressed - onDisk, "rawBytes": raw, "hits": hits, "misses": misses,
+            "hitRate": hits / (hits + misses) if hits + misses else None,
+            "maxBytes": budget["maxBytes"], "pinned": budget["pinned"]}
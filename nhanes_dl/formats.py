@@ -0,0 +1,321 @@
+import os
+from abc import ABC, abstractmethod
+from os.path import splitext
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+# File formats a codebook or mortality DataFrame can be cached as
+# The binary formats keep dtypes and the SEQN index, csv is kept for older caches and for reading by hand
+# Reads can be restricted to a SEQN range, parquet is written in row groups so only the overlapping ones are read
+# The binary formats are compressed with their format's compression codec (see setCompression), parquet with zstd
+# by default. Feather is left uncompressed by default, so its files can be memory mapped
+
+SEQNRange = Tuple[float, float]
+
+# Rows per parquet row group, the granularity a SEQN range read skips data at
+parquetRowGroupSize = 32768
+
+
+class CacheFormat(ABC):
+    """
+    Writes a DataFrame to a cache file and reads it back with the same index
+    """
+    name = ""
+    extension = ""
+    # Codec the files are compressed with, None when the format isn't compressed
+    compression: Optional[str] = None
+
+    @abstractmethod
+    def write(self, df: pd.DataFrame, path: str):
+        """
+        Writes df to a cache file at path
+        """
+
+    @abstractmethod
+    def read(self, path: str, columns: Optional[List[str]] = None,
+             seqnRange: Optional[SEQNRange] = None) -> pd.DataFrame:
+        """
+        Reads the cache file, only loading columns (and the SEQN index) when given
+        and only the rows with low <= SEQN <= high when seqnRange is given
+        """
+
+    @abstractmethod
+    def columns(self, path: str) -> List[str]:
+        """
+        Returns the column names of a cache file without reading its data, SEQN excluded
+        """
+
+    @abstractmethod
+    def schema(self, path: str) -> Dict[str, str]:
+        """
+        Returns the dtype of every column of a cache file without reading its data, SEQN excluded
+        """
+
+    @abstractmethod
+    def writeChunks(self, chunks: Iterable[pd.DataFrame], path: str) -> int:
+        """
+        Writes chunks of the same DataFrame to one cache file as they come, returning the rows written
+        Only one chunk is held in memory at a time
+        """
+
+    def uncompressedBytes(self, path: str) -> int:
+        """
+        Size the data of a cache file would take uncompressed, its size when it isn't compressed
+        """
+        return os.path.getsize(path)
+
+
+def _setIndex(df: pd.DataFrame) -> pd.DataFrame:
+    return df.set_index("SEQN") if "SEQN" in df.columns else df
+
+
+def _withSEQN(columns: Optional[List[str]]) -> Optional[List[str]]:
+    if columns is None:
+        return None
+    return ["SEQN"] + [c for c in columns if c != "SEQN"]
+
+
+def _dropSEQN(columns: List[str]) -> List[str]:
+    return [c for c in columns if c != "SEQN" and not c.startswith("__index_level_")]
+
+
+def _hasSEQN(path: str) -> bool:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    with pa.memory_map(path) as source:
+        return "SEQN" in ipc.open_file(source).schema.names
+
+
+def _mappableTable(df: pd.DataFrame, schema=None):
+    """
+    Arrow table of df with the NaN of float columns kept as values rather than nulls
+    A column without nulls converts back to pandas as a view of the table's memory, with nulls it has to be copied
+    """
+    import pyarrow as pa
+    df = _resetIndex(df)
+    table = pa.Table.from_pandas(df, preserve_index=False, schema=schema)
+    for i, field in enumerate(table.schema):
+        values = df.iloc[:, i]
+        if table.column(i).null_count and pa.types.is_floating(field.type) and \
+                isinstance(values.dtype, np.dtype) and values.dtype.kind == "f":
+            table = table.set_column(i, field, pa.array(values.to_numpy(), type=field.type, from_pandas=False))
+    return table
+
+
+def _mappedFrame(table) -> pd.DataFrame:
+    """
+    DataFrame of table whose columns are views of its memory, indexed by SEQN when it has one
+    The index is built from the SEQN column and set on the frame, as set_index copies every column without copy on write
+    """
+    if "SEQN" not in table.column_names:
+        return table.to_pandas(split_blocks=True)
+    seqn = pd.Index(table.column("SEQN").to_numpy(), name="SEQN")
+    # split_blocks keeps every column its own block, so pandas doesn't consolidate (copy) them
+    res = table.drop_columns(["SEQN"]).to_pandas(split_blocks=True)
+    res.index = seqn
+    return res
+
+
+def _arrowSchema(schema) -> Dict[str, str]:
+    empty = schema.empty_table().to_pandas()
+    empty = _resetIndex(empty) if empty.index.name is not None else empty
+    return {str(c): str(t) for c, t in empty.dtypes.items() if c in _dropSEQN(list(empty.columns))}
+
+
+def _inRange(df: pd.DataFrame, seqnRange: Optional[SEQNRange]) -> pd.DataFrame:
+    if seqnRange is None:
+        return df
+    low, high = seqnRange
+    return df[(df.index >= low) & (df.index <= high)]
+
+
+def _resetIndex(df: pd.DataFrame) -> pd.DataFrame:
+    return df.reset_index() if df.index.name is not None else df.reset_index(drop=True)
+
+
+class CsvFormat(CacheFormat):
+    name = "csv"
+    extension = ".csv"
+
+    def write(self, df: pd.DataFrame, path: str):
+        df.to_csv(path, index=df.index.name is not None)
+
+    def read(self, path: str, columns: Optional[List[str]] = None,
+             seqnRange: Optional[SEQNRange] = None) -> pd.DataFrame:
+        if seqnRange is None:
+            return _setIndex(pd.read_csv(path, low_memory=False, usecols=_withSEQN(columns)))
+        # Only the rows in range of one chunk are held at a time
+        with pd.read_csv(path, low_memory=False, usecols=_withSEQN(columns), chunksize=100000) as chunks:
+            return pd.concat([_inRange(_setIndex(chunk), seqnRange) for chunk in chunks])
+
+    def columns(self, path: str) -> List[str]:
+        return _dropSEQN(list(pd.read_csv(path, nrows=0).columns))
+
+    def schema(self, path: str) -> Dict[str, str]:
+        # csv has no schema, the dtypes are the ones pandas infers from the first rows
+        sample = pd.read_csv(path, nrows=1000)
+        return {str(c): str(t) for c, t in sample.dtypes.items() if c in self.columns(path)}
+
+    def writeChunks(self, chunks: Iterable[pd.DataFrame], path: str) -> int:
+        rows = 0
+        for chunk in chunks:
+            chunk.to_csv(path, index=chunk.index.name is not None,
+                         mode="w" if rows == 0 else "a", header=rows == 0)
+            rows += len(chunk)
+        return rows
+
+
+class ParquetFormat(CacheFormat):
+    name = "parquet"
+    extension = ".parquet"
+    compression = "zstd"
+
+    def write(self, df: pd.DataFrame, path: str):
+        # index=True stores a RangeIndex as a column too, so it can be filtered on
+        df.to_parquet(path, engine="pyarrow", index=True, row_group_size=parquetRowGroupSize,
+                      compression=self.compression)
+
+    def read(self, path: str, columns: Optional[List[str]] = None,
+             seqnRange: Optional[SEQNRange] = None) -> pd.DataFrame:
+        import pyarrow.parquet as pq
+        if "SEQN" not in pq.read_schema(path).names:
+            # The SEQN of a RangeIndex is only in the metadata, it is filtered once read
+            return _inRange(pd.read_parquet(path, engine="pyarrow", columns=columns), seqnRange)
+        filters = None if seqnRange is None else [("SEQN", ">=", seqnRange[0]), ("SEQN", "<=", seqnRange[1])]
+        return _setIndex(pd.read_parquet(path, engine="pyarrow", columns=_withSEQN(columns), filters=filters))
+
+    def columns(self, path: str) -> List[str]:
+        import pyarrow.parquet as pq
+        return _dropSEQN(pq.read_schema(path).names)
+
+    def uncompressedBytes(self, path: str) -> int:
+        import pyarrow.parquet as pq
+        metadata = pq.read_metadata(path)
+        return sum(metadata.row_group(i).total_byte_size for i in range(metadata.num_row_groups))
+
+    def schema(self, path: str) -> Dict[str, str]:
+        import pyarrow.parquet as pq
+        return _arrowSchema(pq.read_schema(path))
+
+    def writeChunks(self, chunks: Iterable[pd.DataFrame], path: str) -> int:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        rows = 0
+        writer = None
+        schema = None
+        try:
+            for chunk in chunks:
+                # Every chunk is cast to the first chunk's schema, a column can't change type midway
+                table = pa.Table.from_pandas(_resetIndex(chunk), preserve_index=False, schema=schema)
+                if writer is None:
+                    schema = table.schema
+                    writer = pq.ParquetWriter(path, schema, compression=self.compression)
+                writer.write_table(table)
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows
+
+
+class FeatherFormat(CacheFormat):
+    """
+    Arrow IPC files, memory mapped when read. Uncompressed (the default) the columns of a read are views of the
+    mapped file rather than copies, so processes reading the same file share the OS page cache's copy of it
+    """
+    name = "feather"
+    extension = ".feather"
+
+    def write(self, df: pd.DataFrame, path: str):
+        import pyarrow.feather as feather
+        # One record batch, a column split over several has to be concatenated (copied) to convert to pandas
+        feather.write_feather(_mappableTable(df), path, compression=self.compression or "uncompressed",
+                              chunksize=max(len(df), 1))
+
+    def read(self, path: str, columns: Optional[List[str]] = None,
+             seqnRange: Optional[SEQNRange] = None) -> pd.DataFrame:
+        import pyarrow.feather as feather
+        hasSEQN = _hasSEQN(path)
+        table = feather.read_table(path, columns=_withSEQN(columns) if hasSEQN else columns, memory_map=True)
+        if seqnRange is not None and not hasSEQN:
+            return _inRange(table.to_pandas(), seqnRange)
+        if seqnRange is not None:
+            # Only the rows in range are copied out of the file
+            import pyarrow.compute as pc
+            seqn = pc.field("SEQN")
+            table = table.filter((seqn >= seqnRange[0]) & (seqn <= seqnRange[1]))
+        return _mappedFrame(table)
+
+    def columns(self, path: str) -> List[str]:
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+        with pa.memory_map(path) as source:
+            return _dropSEQN(ipc.open_file(source).schema.names)
+
+    def schema(self, path: str) -> Dict[str, str]:
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+        with pa.memory_map(path) as source:
+            return _arrowSchema(ipc.open_file(source).schema)
+
+    def uncompressedBytes(self, path: str) -> int:
+        # Only a compressed file is decompressed, an uncompressed one is just mapped
+        import pyarrow.feather as feather
+        return feather.read_table(path, memory_map=True).nbytes
+
+    def writeChunks(self, chunks: Iterable[pd.DataFrame], path: str) -> int:
+        # Feather v2 is the Arrow IPC file format, so each chunk is written as a record batch
+        import pyarrow.ipc as ipc
+        rows = 0
+        writer = None
+        schema = None
+        try:
+            for chunk in chunks:
+                table = _mappableTable(chunk, schema)
+                if writer is None:
+                    schema = table.schema
+                    writer = ipc.new_file(path, schema, options=ipc.IpcWriteOptions(compression=self.compression))
+                writer.write_table(table)
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows
+
+
+cacheFormats: Dict[str, CacheFormat] = {f.name: f for f in [
+    CsvFormat(), ParquetFormat(), FeatherFormat()]}
+
+defaultCacheFormat = "parquet"
+
+
+def getCacheFormat(name: str) -> CacheFormat:
+    try:
+        return cacheFormats[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown cache format {name}, expected one of {', '.join(cacheFormats)}")
+
+
+def setCompression(name: str, codec: Optional[str]) -> Optional[str]:
+    """
+    Compresses the files written in the cache format name with codec (i.e zstd, lz4 or snappy for parquet),
+    None writes them uncompressed. Returns the previous codec. Files already written are read either way
+    """
+    cacheFormat = getCacheFormat(name)
+    if cacheFormat.name == CsvFormat.name and codec is not None:
+        raise ValueError("csv caches can't be compressed, use a binary cache format")
+    previous, cacheFormat.compression = cacheFormat.compression, codec
+    return previous
+
+
+def formatOfPath(path: str) -> CacheFormat:
+    """
+    Returns the CacheFormat a cache file was written in, based on its extension
+    """
+    _, extension = splitext(path)
+    for f in cacheFormats.values():
+        if f.extension == extension:
+            return f
+    raise ValueError(f"Not a cache file - {path}")
@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+from nhanes_dl.locks import FileLock, writeAtomically
+from nhanes_dl.manifest import fileChecksum, manifestFor
+
+# Persistent journal of cache builds, so an interrupted build resumes where it stopped
+# Every outcome is appended to {cacheDir}/build_journal.jsonl as soon as it happens, one json line per codebook
+# keyed like the manifest ("{startYear}-{endYear}/{codebook}"), the latest line of a key is its status
+#
+# status   fields
+# done     rows, bytes, mtime and checksum (sha256) of the cache file written
+# failed   reason
+# skipped  reason
+#
+# A build also appends a {"build": {...}} line with its arguments, resumeNhanesCache reruns the latest one
+# A done codebook is only skipped while its file still matches, the size and mtime are compared first and the
+# checksum when they differ (or always with verify), so a truncated or replaced file is cached again
+# A file rewritten outside of a build (i.e by refreshCache) still counts as done when it matches its manifest entry
+
+journalFileName = "build_journal.jsonl"
+
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class BuildJournal:
+    """
+    Status of every codebook a cache build of cacheDir went through, appended to as the build goes
+    Safe to share between threads and the processes building into the same cache directory
+    """
+
+    def __init__(self, cacheDir: str):
+        self.cacheDir = cacheDir
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+        self._build: Dict = {}
+        self._lines = 0
+        self._torn = False
+        self._load()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.cacheDir, journalFileName)
+
+    def _load(self):
+        self._entries, self._build, self._lines, self._torn = {}, {}, 0, False
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        self._torn = bool(lines) and not lines[-1].endswith("\n")
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line of a journal interrupted mid write
+                continue
+            self._lines += 1
+            if "build" in record:
+                self._build = record["build"]
+            elif "key" in record:
+                self._entries[record["key"]] = record
+
+    def _append(self, record: Dict):
+        record["time"] = time.time()
+        with self._lock, FileLock(self.path):
+            with open(self.path, "a") as f:
+                # Starts a new line after one torn by an interrupted write
+                f.write(("\n" if self._torn else "") + json.dumps(record, sort_keys=True) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._torn = False
+            self._lines += 1
+            if "build" in record:
+                self._build = record["build"]
+            else:
+                self._entries[record["key"]] = record
+
+    def startBuild(self, **arguments):
+        """
+        Catches up with what other jobs appended and records the arguments of a build, see lastBuild
+        The journal is compacted first once most of its lines are superseded
+        """
+        with self._lock, FileLock(self.path):
+            self._load()
+            if self._lines > 2 * (len(self._entries) + 1):
+                self._compact()
+        self._append({"build": arguments})
+
+    def lastBuild(self) -> Dict:
+        with self._lock:
+            return dict(self._build)
+
+    def done(self, key: str, path: str, rows: Optional[int] = None, checksum: Optional[str] = None):
+        """
+        Records the codebook of key as cached at path, checksum is computed when not given
+        """
+        stat = os.stat(path)
+        self._append({"key": key, "status": DONE, "rows": rows, "file": os.path.relpath(path, self.cacheDir),
+                      "bytes": stat.st_size, "mtime": stat.st_mtime, "checksum": checksum or fileChecksum(path)})
+
+    def failed(self, key: str, reason: str):
+        self._append({"key": key, "status": FAILED, "reason": reason})
+
+    def skipped(self, key: str, reason: str):
+        self._append({"key": key, "status": SKIPPED, "reason": reason})
+
+    def get(self, key: str) -> Dict:
+        with self._lock:
+            return dict(self._entries.get(key, {}))
+
+    def entries(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {k: dict(v) for k, v in self._entries.items()}
+
+    def withStatus(self, status: str) -> Dict[str, Dict]:
+        return {k: v for k, v in self.entries().items() if v["status"] == status}
+
+    def isDone(self, key: str, path: str, verify: bool = False) -> bool:
+        """
+        Whether the codebook of key is cached at path and the file is still the one the journal recorded,
+        or one a cache write published in the manifest since (which is then recorded as done)
+        """
+        entry = self.get(key)
+        relativePath = os.path.relpath(path, self.cacheDir)
+        if entry.get("status") != DONE or entry.get("file") != relativePath:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_size == entry["bytes"] and stat.st_mtime == entry["mtime"] and not verify:
+            return True
+        checksum = fileChecksum(path)
+        if stat.st_size == entry["bytes"] and checksum == entry["checksum"]:
+            return True
+        published = manifestFor(self.cacheDir).get(key)
+        if published.get("file") != relativePath or published.get("checksum") != checksum:
+            return False
+        self.done(key, path, published.get("rows"), checksum)
+        return True
+
+    def compact(self):
+        """
+        Rewrites the journal with only the latest line of every key
+        """
+        with self._lock, FileLock(self.path):
+            self._load()
+            self._compact()
+
+    def _compact(self):
+        records = ([{"build": self._build}] if self._build else []) + \
+                  [self._entries[k] for k in sorted(self._entries)]
+
+        def write(tmp):
+            with open(tmp, "w") as f:
+                f.writelines(json.dumps(r, sort_keys=True) + "\n" for r in records)
+        writeAtomically(self.path, write)
+        self._lines = len(records)
+
+
+_journals: Dict[str, BuildJournal] = {}
+_journalsLock = threading.Lock()
+
+
+def journalFor(cacheDir: str) -> BuildJournal:
+    """
+    Returns the process wide BuildJournal of cacheDir
+    """
+    key = os.path.abspath(cacheDir)
+    with _journalsLock:
+        journal = _journals.get(key)
+        if journal is None:
+            journal = _journals[key] = BuildJournal(cacheDir)
+        return journal
@@ -0,0 +1,103 @@
+import os
+import threading
+from typing import Callable, Dict, Optional, TypeVar
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Locking and publishing of cache files, so several jobs (or workers) can share one cache directory, i.e on NFS
+# A FileLock is a {path}.lock file locked with fcntl.lockf, POSIX record locks which NFS supports, together with
+# a threading lock since record locks only exclude other processes. Without fcntl (Windows) only threads are excluded
+# Files are written next to their destination then renamed over it, so readers never see half a file
+
+R = TypeVar('R')
+
+_threadLocks: Dict[str, threading.Lock] = {}
+_threadLocksLock = threading.Lock()
+
+
+def _threadLock(path: str) -> threading.Lock:
+    with _threadLocksLock:
+        lock = _threadLocks.get(path)
+        if lock is None:
+            lock = _threadLocks[path] = threading.Lock()
+        return lock
+
+
+class FileLock:
+    """
+    Exclusive lock of path across threads and processes, held through {path}.lock
+    Can be released by another thread than the one that acquired it
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self.lockPath = f"{self.path}.lock"
+        self._fd = None
+
+    def acquire(self, blocking: bool = True) -> Optional["FileLock"]:
+        """
+        Waits for the lock, without blocking returns None right away when it is held
+        """
+        threadLock = _threadLock(self.path)
+        if not threadLock.acquire(blocking):
+            return None
+        if fcntl is None:
+            return self
+        try:
+            fd = os.open(self.lockPath, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                if blocking:
+                    raise
+                # Held by another process
+                threadLock.release()
+                return None
+            except BaseException:
+                os.close(fd)
+                raise
+        except BaseException:
+            threadLock.release()
+            raise
+        self._fd = fd
+        return self
+
+    def release(self):
+        # The lock file is left in place, removing it would let another process lock a file nobody else sees
+        if self._fd is not None:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        _threadLock(self.path).release()
+
+    def __enter__(self) -> "FileLock":
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def temporaryPath(path: str) -> str:
+    """
+    Path next to path that only this thread writes to
+    """
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.partial"
+
+
+def writeAtomically(path: str, write: Callable[[str], R]) -> R:
+    """
+    Calls write with a temporary path then renames what it wrote to path, returning what write returned
+    Nothing is left behind if write fails
+    """
+    tmp = temporaryPath(path)
+    try:
+        res = write(tmp)
+        os.replace(tmp, path)
+        return res
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+import pandas as pd
+from nhanes_dl.formats import formatOfPath
+from nhanes_dl.locks import FileLock
+
+# Per cache directory record of what is cached, so cache reads don't have to probe the data files
+# Entries are keyed by "{startYear}-{endYear}/{codebook}" and stored in one manifest.json per year directory,
+# an entry holds the validators the codebook was downloaded with and a description of its cache file
+# Updates lock the shard and reload it first, so processes sharing a cache directory don't drop each other's entries
+
+manifestFileName = "manifest.json"
+
+
+def fileChecksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _shard(key: str) -> str:
+    return key.split("/")[0] if "/" in key else ""
+
+
+class CacheManifest:
+    """
+    Metadata of every cached codebook of a cache directory, i.e the ETag/Last-Modified it was served with,
+    its cache file, rows, SEQN range, column dtypes, size (on disk and uncompressed) and checksum
+    Every update is written straight to disk, so the manifest survives an interrupted build
+    """
+
+    def __init__(self, cacheDir: str):
+        self.cacheDir = cacheDir
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def shardPath(self, shard: str) -> str:
+        return os.path.join(self.cacheDir, shard, manifestFileName)
+
+    @property
+    def path(self) -> str:
+        return self.shardPath("")
+
+    def _load(self) -> Dict[str, Dict]:
+        shards = [""]
+        if os.path.isdir(self.cacheDir):
+            shards += sorted(d for d in os.listdir(self.cacheDir)
+                             if os.path.isdir(os.path.join(self.cacheDir, d)))
+        entries = {}
+        moved = set()
+        for shard in shards:
+            try:
+                with open(self.shardPath(shard)) as f:
+                    loaded = json.load(f).get("entries", {})
+            except (OSError, ValueError):
+                continue
+            entries.update(loaded)
+            moved |= {_shard(k) for k in loaded if _shard(k) != shard}
+
+        # Entries of a year kept in the wrong manifest (i.e the single top level one) move to the year's
+        self._entries = entries
+        for shard in sorted(moved | ({""} if moved else set())):
+            self._save(shard)
+        return entries
+
+    def _reload(self, shard: str):
+        try:
+            with open(self.shardPath(shard)) as f:
+                loaded = json.load(f).get("entries", {})
+        except (OSError, ValueError):
+            return
+        for key in [k for k in self._entries if _shard(k) == shard]:
+            del self._entries[key]
+        self._entries.update({k: v for k, v in loaded.items() if _shard(k) == shard})
+
+    def _change(self, key: str, change):
+        # Called with self._lock held, applies change to the latest version of the key's shard and saves it
+        shard = _shard(key)
+        if not os.path.isdir(os.path.dirname(self.shardPath(shard))):
+            change()
+            return
+        with FileLock(self.shardPath(shard)):
+            self._reload(shard)
+            change()
+            self._save(shard)
+
+    def _save(self, shard: str):
+        path = self.shardPath(shard)
+        if not os.path.isdir(os.path.dirname(path)):
+            return
+        entries = {k: v for k, v in self._entries.items() if _shard(k) == shard}
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"entries": entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+
+    def get(self, key: str) -> Dict:
+        with self._lock:
+            return dict(self._entries.get(key, {}))
+
+    def update(self, key: str, **fields):
+        with self._lock:
+            self._change(key, lambda: self._entries.setdefault(key, {}).update(fields))
+
+    def remove(self, key: str):
+        with self._lock:
+            self._change(key, lambda: self._entries.pop(key, None))
+
+    def entries(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {k: dict(v) for k, v in self._entries.items()}
+
+    def recordFile(self, key: str, path: str, df: Optional[pd.DataFrame] = None, rows: Optional[int] = None):
+        """
+        Describes the cache file at path, from df when it was just written from it
+        Otherwise the columns come from the file's schema and rows must be given
+        """
+        if df is not None:
+            rows = len(df)
+            columns = {str(c): str(t) for c, t in df.dtypes.items()}
+            seqn = df.index
+        else:
+            columns = formatOfPath(path).schema(path)
+            seqn = formatOfPath(path).read(path, []).index
+        seqnRange = {}
+        if len(seqn) and seqn.name == "SEQN":
+            seqnRange = {"seqnMin": float(seqn.min()), "seqnMax": float(seqn.max())}
+        self.update(key, file=os.path.relpath(path, self.cacheDir), format=formatOfPath(path).name,
+                    rows=rows, columns=columns, bytes=os.path.getsize(path), checksum=fileChecksum(path),
+                    uncompressedBytes=formatOfPath(path).uncompressedBytes(path), **seqnRange)
+
+    def cachedFiles(self, shard: str) -> Dict[str, Dict]:
+        """
+        Returns the entries of a year directory that describe a cache file, keyed by codebook
+        """
+        with self._lock:
+            return {k.split("/", 1)[1]: dict(v) for k, v in self._entries.items()
+                    if _shard(k) == shard and "file" in v}
+
+
+_manifests: Dict[str, CacheManifest] = {}
+_manifestsLock = threading.Lock()
+
+
+def manifestFor(cacheDir: str) -> CacheManifest:
+    """
+    Returns the process wide CacheManifest of cacheDir, so threads caching into it share one
+    """
+    key = os.path.abspath(cacheDir)
+    with _manifestsLock:
+        manifest: Optional[CacheManifest] = _manifests.get(key)
+        if manifest is None:
+            manifest = _manifests[key] = CacheManifest(cacheDir)
+        return manifest
+
+
+def keyOfPath(path: str) -> str:
+    """
+    Returns the manifest key of a cache file at {cacheDir}/{startYear}-{endYear}/{codebook}.{extension}
+    """
+    year = os.path.basename(os.path.dirname(path))
+    name, _ = os.path.splitext(os.path.basename(path))
+    return f"{year}/{name}"
+
+
+def recordCacheFile(path: str, df: Optional[pd.DataFrame] = None, rows: Optional[int] = None):
+    """
+    Records a cache file that was just written in the manifest of its cache directory
+    """
+    cacheDir = os.path.dirname(os.path.dirname(path)) or "."
+    manifestFor(cacheDir).recordFile(keyOfPath(path), path, df, rows)
+    # Makes room for the file within the cache directory's size budget, if it has one
+    from nhanes_dl.eviction import enforceBudget
+    enforceBudget(cacheDir, keyOfPath(path))
+
+
+def cacheSummary(cacheDir: str) -> pd.DataFrame:
+    """
+    returns DataFrame describing every cached file of a cache directory, read from its manifest only
+    """
+    rows: List[Dict] = []
+    for key, entry in sorted(manifestFor(cacheDir).entries().items()):
+        if "file" not in entry:
+            continue
+        year, codebook = key.split("/", 1)
+        rows.append({"year": year, "codebook": codebook, "file": entry["file"], "format": entry["format"],
+                     "rows": entry["rows"], "columns": len(entry["columns"]), "bytes": entry["bytes"]})
+    return pd.DataFrame(rows, columns=["year", "codebook", "file", "format", "rows", "columns", "bytes"])
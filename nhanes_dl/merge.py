@@ -0,0 +1,181 @@
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Merge engine behind types.joinCodebooks and types.appendCodebooks
+# The final SEQN index and columns are worked out first, then every column is allocated once and filled in place.
+# This keeps peak memory near the size of the merged frame instead of the several copies pd.concat makes.
+# Columns with a numpy dtype take the fast path, anything else (nullable ints, categoricals) is merged with pandas.
+
+
+def _frames(frames: List[Optional[pd.DataFrame]]) -> List[pd.DataFrame]:
+    return [f for f in frames if f is not None]
+
+
+def _unionIndex(frames: List[pd.DataFrame]) -> pd.Index:
+    """
+    Union of the frames' indexes in order of first appearance, like pd.concat(axis=1)
+    """
+    if all(f.index.equals(frames[0].index) for f in frames[1:]):
+        return frames[0].index
+    index = frames[0].index.append([f.index for f in frames[1:]]).unique()
+    return index.rename(frames[0].index.name)
+
+
+def _isFast(dtype) -> bool:
+    return isinstance(dtype, np.dtype) and dtype.kind in "iufO"
+
+
+def _smallIntegerDtype(pieces: List[np.ndarray]) -> Optional[pd.api.extensions.ExtensionDtype]:
+    """
+    Returns the smallest nullable int dtype that holds every value of float pieces, None if they aren't all integers
+    """
+    low, high = 0, 0
+    for values in pieces:
+        if values.dtype.kind != "f":
+            return None
+        present = values[~np.isnan(values)]
+        if len(present) == 0:
+            continue
+        if not np.array_equal(present, np.round(present)):
+            return None
+        low, high = min(low, present.min()), max(high, present.max())
+
+    for dtype in [pd.Int8Dtype(), pd.Int16Dtype(), pd.Int32Dtype()]:
+        info = np.iinfo(dtype.numpy_dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return None
+
+
+def _missing(index: pd.Index, dtype) -> pd.Series:
+    # Extension dtypes have their own missing value, numpy ones are filled with NaN like pd.concat does
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        return pd.Series(index=index, dtype=dtype)
+    return pd.Series(np.nan, index=index)
+
+
+class _Column:
+    """
+    A preallocated output column that pieces are written into by position
+    """
+
+    def __init__(self, length: int, dtypes: List[np.dtype], complete: bool, downcast: bool,
+                 pieces: List[np.ndarray]):
+        self.nullable = _smallIntegerDtype(pieces) if downcast else None
+        if self.nullable is not None:
+            self.values = np.zeros(length, dtype=self.nullable.numpy_dtype)
+            self.mask = np.ones(length, dtype=bool)
+            return
+
+        dtype = np.result_type(*dtypes)
+        if not complete and dtype.kind in "iu":
+            dtype = np.dtype("float64")
+        self.values = np.empty(length, dtype=dtype)
+        if not complete:
+            self.values[:] = np.nan
+
+    def fill(self, positions, values: np.ndarray):
+        if self.nullable is None:
+            self.values[positions] = values
+            return
+        missing = np.isnan(values)
+        self.values[positions] = np.where(missing, 0, values)
+        self.mask[positions] = missing
+
+    def array(self):
+        if self.nullable is None:
+            return self.values
+        return pd.arrays.IntegerArray(self.values, self.mask)
+
+
+def _build(index: pd.Index, names: List, arrays: List) -> pd.DataFrame:
+    # Keyed by position so duplicated column names survive, copy=False keeps each filled array as is
+    res = pd.DataFrame(dict(enumerate(arrays)), index=index, copy=False)
+    res.columns = pd.Index(names)
+    return res
+
+
+def joinFrames(frames: List[Optional[pd.DataFrame]], downcast: bool = False) -> pd.DataFrame:
+    """
+    Outer joins frames side by side on their index, same result as pd.concat(frames, axis=1)
+    downcast stores float columns that only hold small integers as nullable Int8/Int16/Int32
+    """
+    frames = _frames(frames)
+    if not frames:
+        return pd.DataFrame(index=pd.Index([], name="SEQN"))
+
+    index = _unionIndex(frames)
+    names, arrays = [], []
+    for f in frames:
+        complete = f.index.equals(index)
+        positions = None if complete else index.get_indexer(f.index)
+        for i, name in enumerate(f.columns):
+            series = f.iloc[:, i]
+            names.append(name)
+            if not _isFast(series.dtype):
+                arrays.append(series.reindex(index).array if not complete else series.array)
+                continue
+
+            values = series.to_numpy()
+            column = _Column(len(index), [values.dtype], complete, downcast, [values])
+            column.fill(slice(None) if complete else positions, values)
+            arrays.append(column.array())
+
+    return _build(index, names, arrays)
+
+
+def _unionCategoricals(parts: List[pd.Series]):
+    """
+    union_categoricals of parts whose categories may have different dtypes, i.e int8 codes in one year
+    and int16 ones in the next, which are cast to their common dtype first
+    """
+    categories = [p.cat.categories for p in parts]
+    common = categories[0].append(categories[1:]).dtype
+    if any(c.dtype != common for c in categories):
+        parts = [p.cat.rename_categories(c.astype(common)) for p, c in zip(parts, categories)]
+    return union_categoricals(parts)
+
+
+def appendFrames(frames: List[Optional[pd.DataFrame]], downcast: bool = False) -> pd.DataFrame:
+    """
+    Stacks frames on top of each other, same result as pd.concat(frames) with each frame's
+    repeated columns dropped first (the first one is kept)
+    downcast stores float columns that only hold small integers as nullable Int8/Int16/Int32
+    """
+    frames = _frames(frames)
+    if not frames:
+        return pd.DataFrame(index=pd.Index([], name="SEQN"))
+
+    index = frames[0].index.append([f.index for f in frames[1:]])
+    offsets = np.cumsum([0] + [len(f) for f in frames])
+
+    # Position of each column's first occurrence in every frame, columns ordered by first appearance
+    sources: Dict = {}
+    for i, f in enumerate(frames):
+        for position, name in enumerate(f.columns):
+            sources.setdefault(name, {}).setdefault(i, position)
+
+    arrays = []
+    for name, where in sources.items():
+        pieces = {i: frames[i].iloc[:, position] for i, position in where.items()}
+        complete = len(pieces) == len(frames)
+        if not all(_isFast(p.dtype) for p in pieces.values()):
+            dtype = next(iter(pieces.values())).dtype
+            parts = [pieces[i] if i in pieces else _missing(f.index, dtype) for i, f in enumerate(frames)]
+            if all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+                # Years may have different codes, pd.concat would fall back to object for them
+                arrays.append(_unionCategoricals(parts))
+            else:
+                arrays.append(pd.concat(parts).array)
+            continue
+
+        values = {i: p.to_numpy() for i, p in pieces.items()}
+        column = _Column(len(index), [v.dtype for v in values.values()], complete, downcast,
+                         list(values.values()))
+        for i, v in values.items():
+            column.fill(slice(offsets[i], offsets[i + 1]), v)
+        arrays.append(column.array())
+
+    return _build(index, list(sources), arrays)
@@ -0,0 +1,219 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Callable, Dict, Optional
+from nhanes_dl.locks import FileLock, temporaryPath
+
+# Optional mirror of the raw XPT/.dat files a cache directory was built from, kept under {cacheDir}/raw
+# Files are stored content addressed by sha256 (gzipped when the mirror compresses) and indexed by the same
+# "{startYear}-{endYear}/{codebook}" keys as the cache manifest, so the cache can be rebuilt from them offline
+# (see nhanes_dl.pipeline.buildCacheFromMirror)
+# The files count towards the size budget of the cache directory (see nhanes_dl.eviction), files of bytes no key
+# holds anymore (replaced by newer bytes) are the first evicted
+
+mirrorDirName = "raw"
+indexFileName = "index.json"
+configFileName = "config.json"
+blockSize = 1 << 20
+
+
+class RawMirror:
+    """
+    Content addressed store of raw downloads, index maps a key to the sha256 of its latest bytes
+    """
+
+    def __init__(self, root: str, compress: bool = True):
+        self.root = root
+        self.compress = compress
+        self._lock = threading.Lock()
+        self._index = self._load()
+
+    @property
+    def indexPath(self) -> str:
+        return os.path.join(self.root, indexFileName)
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.indexPath) as f:
+                return json.load(f).get("entries", {})
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        tmp = temporaryPath(self.indexPath)
+        with open(tmp, "w") as f:
+            json.dump({"entries": self._index}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.indexPath)
+
+    def objectPath(self, sha256: str, compressed: bool) -> str:
+        return os.path.join(self.root, "objects", sha256[:2], f"{sha256}{'.gz' if compressed else ''}")
+
+    def put(self, key: str, body: bytes, url: str, validators: Optional[Dict] = None) -> str:
+        """
+        Stores body as the latest raw bytes of key, returning its sha256. Bytes already stored aren't written again
+        """
+        sha256 = (validators or {}).get("sha256") or hashlib.sha256(body).hexdigest()
+        return self._store(key, sha256, len(body), url, lambda out: out.write(body))
+
+    def putFile(self, key: str, path: str, url: str) -> str:
+        """
+        Same as put for the bytes of the file at path, which are read blockSize bytes at a time so
+        memory stays bounded however large the file is
+        """
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(blockSize), b""):
+                digest.update(block)
+                size += len(block)
+
+        def copy(out):
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, out, blockSize)
+        return self._store(key, digest.hexdigest(), size, url, copy)
+
+    def _store(self, key: str, sha256: str, size: int, url: str, copy: Callable) -> str:
+        path = self.objectPath(sha256, self.compress)
+        self._writeObject(path, copy)
+
+        # Other processes may have indexed files since it was loaded
+        with self._lock, FileLock(self.indexPath):
+            self._index = self._load()
+            self._index[key] = {"sha256": sha256, "compressed": self.compress, "url": url, "bytes": size}
+            self._save()
+        # Evicted as no key held it yet, between the write and the index update
+        self._writeObject(path, copy)
+        from nhanes_dl.eviction import enforceBudget
+        enforceBudget(os.path.dirname(self.root), f"{mirrorDirName}/{key}")
+        return sha256
+
+    def _writeObject(self, path: str, copy: Callable):
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = temporaryPath(path)
+        with open(tmp, "wb") as f:
+            if self.compress:
+                with gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6, mtime=0) as out:
+                    copy(out)
+            else:
+                copy(f)
+        os.replace(tmp, path)
+
+    def path(self, key: str) -> Optional[str]:
+        """
+        Returns the file holding the latest raw bytes of key, None if it isn't mirrored
+        """
+        entry = self.entries().get(key)
+        if entry is None:
+            return None
+        path = self.objectPath(entry["sha256"], entry["compressed"])
+        if not os.path.exists(path):
+            return None
+        from nhanes_dl.eviction import accessLogFor
+        accessLogFor(os.path.dirname(self.root)).record(f"{mirrorDirName}/{key}")
+        return path
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.path(key)
+        return None if path is None else readObject(path)
+
+    def entries(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {k: dict(v) for k, v in self._index.items()}
+
+    def __contains__(self, key: str) -> bool:
+        entry = self.entries().get(key)
+        return entry is not None and os.path.exists(self.objectPath(entry["sha256"], entry["compressed"]))
+
+    def files(self) -> Dict[str, str]:
+        """
+        Returns the file of every key, and the files of bytes no key holds anymore keyed by their path
+        under the mirror ("objects/{sha256[:2]}/{sha256}.gz")
+        """
+        entries = self.entries()
+        res = {k: self.objectPath(v["sha256"], v["compressed"]) for k, v in entries.items()}
+        res = {k: path for k, path in res.items() if os.path.exists(path)}
+        held = set(res.values())
+        objects = os.path.join(self.root, "objects")
+        for directory, _, fileNames in os.walk(objects):
+            for fileName in sorted(fileNames):
+                path = os.path.join(directory, fileName)
+                if path not in held and not fileName.endswith(".partial"):
+                    res[os.path.relpath(path, self.root)] = path
+        return res
+
+    def remove(self, name: str) -> int:
+        """
+        Removes a key (or a file no key holds, named as in files) from the mirror, returning the bytes freed
+        The file of a key is only deleted once no other key holds the same bytes
+        """
+        with self._lock, FileLock(self.indexPath):
+            self._index = self._load()
+            entry = self._index.pop(name, None)
+            if entry is not None:
+                self._save()
+                path = self.objectPath(entry["sha256"], entry["compressed"])
+            else:
+                path = os.path.join(self.root, name)
+            held = {self.objectPath(v["sha256"], v["compressed"]) for v in self._index.values()}
+            if path in held or not os.path.exists(path):
+                return 0
+            freed = os.path.getsize(path)
+            os.remove(path)
+            return freed
+
+
+def readObject(path: str) -> bytes:
+    with open(path, "rb") as f:
+        body = f.read()
+    return gzip.decompress(body) if path.endswith(".gz") else body
+
+
+def copyObject(path: str, out):
+    """
+    Writes the raw bytes of the object file at path to out, blockSize bytes at a time
+    """
+    with (gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")) as f:
+        shutil.copyfileobj(f, out, blockSize)
+
+
+_mirrors: Dict[str, RawMirror] = {}
+_mirrorsLock = threading.Lock()
+
+
+def _root(cacheDir: str) -> str:
+    return os.path.join(cacheDir, mirrorDirName)
+
+
+def enableMirror(cacheDir: str, compress: bool = True) -> RawMirror:
+    """
+    Keeps the raw bytes of every file downloaded into cacheDir from now on, returns its RawMirror
+    """
+    root = _root(cacheDir)
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, configFileName), "w") as f:
+        json.dump({"compress": compress}, f)
+    with _mirrorsLock:
+        _mirrors.pop(os.path.abspath(cacheDir), None)
+    return mirrorFor(cacheDir)
+
+
+def mirrorFor(cacheDir: str) -> Optional[RawMirror]:
+    """
+    Returns the process wide RawMirror of cacheDir, None unless enableMirror was called for it
+    """
+    key = os.path.abspath(cacheDir)
+    with _mirrorsLock:
+        mirror = _mirrors.get(key)
+        if mirror is None:
+            try:
+                with open(os.path.join(_root(cacheDir), configFileName)) as f:
+                    config = json.load(f)
+            except (OSError, ValueError):
+                return None
+            mirror = _mirrors[key] = RawMirror(_root(cacheDir), config.get("compress", True))
+        return mirror
@@ -0,0 +1,145 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from nhanes_dl.types import ContinuousNHANES, Mortality
+
+# Reader for the fixed width linked mortality .dat files
+# Only the kept fields are parsed, straight from the raw bytes into small nullable ints
+
+mortalityColumnSpecs = [(1, 14), (15, 15), (16, 16),
+                        (17, 19), (20, 20), (21, 21),
+                        (22, 22), (23, 26), (27, 34),
+                        (35, 42), (43, 45), (46, 48)]
+
+mortalityWidths = [e - (s-1) for s, e in mortalityColumnSpecs]
+
+allMortalityColumns = ["PUBLICID", "ELIGSTAT", "MORTSTAT", "UCOD_LEADING", "DIABETES",
+                       "HYPERTEN", "DODQTR", "DODYEAR", "WGT_NEW", "SA_WGT_NEW", "PERMTH_INT", "PERMTH_EXM"]
+
+toDropColumns = ["PUBLICID", "DODQTR", "DODYEAR", "WGT_NEW", "SA_WGT_NEW"]
+
+# dtype each kept field is parsed into, the values are all small codes or month counts
+mortalityDtypes: Dict[str, str] = {
+    "ELIGSTAT": "Int8",
+    "MORTSTAT": "Int8",
+    "UCOD_LEADING": "Int8",
+    "DIABETES": "Int8",
+    "HYPERTEN": "Int8",
+    "PERMTH_INT": "Int16",
+    "PERMTH_EXM": "Int16",
+}
+
+
+def getMortalityColumns() -> List[str]:
+    return [x for x in allMortalityColumns if x not in toDropColumns]
+
+
+def columnSpec(column: str) -> Tuple[int, int]:
+    return mortalityColumnSpecs[allMortalityColumns.index(column)]
+
+
+def _toRecords(raw: bytes) -> np.ndarray:
+    """
+    Returns the lines of raw as a (rows, record width) array of bytes, short lines are padded
+    """
+    width = mortalityColumnSpecs[-1][1]
+    lines = np.array(raw.splitlines(), dtype=f"S{width}")
+    lines = lines[np.char.strip(lines) != b""]
+    return lines.view(np.uint8).reshape(len(lines), width)
+
+
+def _parseField(records: np.ndarray, spec: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parses the digits of a field of every record at once, returning the values and which are missing
+    Anything that isn't a digit (blanks, "." for missing) is skipped
+    """
+    s, e = spec
+    digits = records[:, s - 1:e].astype(np.int16) - ord("0")
+    isDigit = (digits >= 0) & (digits <= 9)
+
+    values = np.zeros(len(records), dtype=np.int64)
+    for i in range(digits.shape[1]):
+        values = np.where(isDigit[:, i], values * 10 + digits[:, i], values)
+    return values, ~isDigit.any(axis=1)
+
+
+def parseMortality(raw: bytes) -> Mortality:
+    """
+    returns DataFrame of a linked mortality .dat file, indexed by SEQN with the dropped columns never parsed
+    """
+    records = _toRecords(raw)
+    seqn, _ = _parseField(records, columnSpec("PUBLICID"))
+
+    data = {}
+    for column in getMortalityColumns():
+        values, missing = _parseField(records, columnSpec(column))
+        data[column] = pd.arrays.IntegerArray(
+            values.astype(mortalityDtypes[column].lower()), missing)
+
+    return Mortality(pd.DataFrame(data, index=pd.Index(seqn, name="SEQN")))
+
+
+class MortalityStore:
+    """
+    Process level store of parsed mortality data keyed by ContinuousNHANES, or (cacheDir, year) for the loads
+    that fill a cache directory. Concurrent gets for the same key share one load, the least recently used keys
+    are evicted past maxYears
+    """
+
+    def __init__(self, maxYears: Optional[int] = None):
+        self.maxYears = len(ContinuousNHANES) if maxYears is None else maxYears
+        self._lock = threading.Lock()
+        self._frames: "OrderedDict[Hashable, Mortality]" = OrderedDict()
+        self._loading: Dict[Hashable, Future] = {}
+
+    def get(self, year: Hashable, load: Callable[[], Mortality]) -> Mortality:
+        """
+        Returns a copy of the stored mortality data for year, calling load if it isn't stored
+        If another thread is already loading year, waits for its result instead
+        """
+        with self._lock:
+            if year in self._frames:
+                self._frames.move_to_end(year)
+                return Mortality(self._frames[year].copy())
+            loading = self._loading.get(year)
+            owner = loading is None
+            if owner:
+                loading = self._loading[year] = Future()
+
+        if not owner:
+            return Mortality(loading.result().copy())
+
+        try:
+            res = load()
+        except BaseException as e:
+            with self._lock:
+                del self._loading[year]
+            loading.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._loading[year]
+            if self.maxYears > 0:
+                self._frames[year] = res
+                while len(self._frames) > self.maxYears:
+                    self._frames.popitem(last=False)
+        loading.set_result(res)
+        return Mortality(res.copy())
+
+    def evict(self, year: Hashable):
+        with self._lock:
+            self._frames.pop(year, None)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+
+    def __contains__(self, year: Hashable) -> bool:
+        with self._lock:
+            return year in self._frames
+
+
+mortalityStore = MortalityStore()
@@ -0,0 +1,259 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional, Set
+from nhanes_dl import download
+from nhanes_dl.dtypes import getDtypePolicy, setDtypePolicy
+from nhanes_dl.events import loggedStats
+from nhanes_dl.formats import defaultCacheFormat, formatOfPath, getCacheFormat
+from nhanes_dl.journal import FAILED, journalFor
+from nhanes_dl.locks import FileLock, writeAtomically
+from nhanes_dl.manifest import manifestFor, recordCacheFile
+from nhanes_dl.mirror import copyObject, mirrorFor, readObject
+from nhanes_dl.mortality import parseMortality
+from nhanes_dl.rollup import declareRollups, declaredRollups
+from nhanes_dl.types import ContinuousNHANES, DownloadException, allContinuousNHANES, codebookURL, \
+    getYearsCodebookDescriptions
+from nhanes_dl.utils import makeDirectoryIfNotExists
+
+# Pipelined cache build, fetching and converting run as separate stages
+# I/O threads fetch the raw XPT bytes, a process pool decodes them and writes the cache files on every core
+# At most queueSize fetched files wait for conversion at once, so fetching can't run ahead and fill memory
+# Only this process updates the cache manifest, the conversion processes just write files
+# The conversion processes get the Rollups and dtype policy set here when they start, as they may be spawned rather than forked
+# Each codebook is locked from its fetch until its file is published, so concurrent builds into one cache
+# directory wait for each other instead of downloading the same codebook (see nhanes_dl.locks)
+
+reportFileName = "build_report.json"
+
+
+class BuildReport:
+    """
+    What a cache build did with every codebook, keyed like the manifest ("{startYear}-{endYear}/{codebook}")
+    cached holds the rows written, skipped and failed the reason
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cached: Dict[str, int] = {}
+        self.skipped: Dict[str, str] = {}
+        self.failed: Dict[str, str] = {}
+        self.started = time.time()
+        self.finished: Optional[float] = None
+
+    def add(self, outcome: str, key: str, detail):
+        with self._lock:
+            getattr(self, outcome)[key] = detail
+
+    def toDict(self) -> Dict:
+        return {"started": self.started, "finished": self.finished,
+                "cached": dict(sorted(self.cached.items())),
+                "skipped": dict(sorted(self.skipped.items())),
+                "failed": dict(sorted(self.failed.items()))}
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.toDict(), f, indent=1)
+
+    def summary(self) -> str:
+        elapsed = (self.finished or time.time()) - self.started
+        lines = [f"{len(self.cached)} cached, {len(self.skipped)} skipped, {len(self.failed)} failed "
+                 f"in {elapsed:.1f}s"]
+        lines += [f"  {key} - {reason}" for key, reason in sorted(self.failed.items())]
+        return "\n".join(lines)
+
+
+def conversionSettings() -> Dict:
+    """
+    Returns the settings of this process that parsing a codebook depends on, see installSettings
+    """
+    return {"rollups": declaredRollups(), "dtypePolicy": getDtypePolicy()}
+
+
+def installSettings(settings: Dict):
+    """
+    Applies the settings returned by conversionSettings, runs once in every conversion process
+    """
+    declareRollups(settings["rollups"])
+    setDtypePolicy(settings["dtypePolicy"])
+
+
+def conversionPool(processes: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(processes, initializer=installSettings, initargs=(conversionSettings(),))
+
+
+def convertCodebook(body: bytes, url: str, savePath: str) -> int:
+    """
+    Decodes the XPT bytes downloaded from url and writes them to savePath, returning the rows written
+    Runs in the conversion processes
+    """
+    res = download.parseCodebook(body, url)
+    writeAtomically(savePath, lambda tmp: formatOfPath(savePath).write(res, tmp))
+    return len(res)
+
+
+def convertMirrored(objectPath: str, name: str, url: str, savePath: str) -> int:
+    """
+    Converts a raw file of the mirror to savePath, returning the rows written. Runs in the conversion processes
+    Streamed codebooks are converted chunk by chunk from a temporary copy (see streamCodebookToCache)
+    """
+    if download.isStreamedCodebook(name):
+        with tempfile.NamedTemporaryFile(suffix=".XPT") as raw:
+            copyObject(objectPath, raw)
+            raw.flush()
+            return download.convertXPTFile(raw.name, url, savePath)
+    body = readObject(objectPath)
+    if name != "mortality":
+        return convertCodebook(body, url, savePath)
+    res = parseMortality(body)
+    writeAtomically(savePath, lambda tmp: formatOfPath(savePath).write(res, tmp))
+    return len(res)
+
+
+def buildNhanesCachePipeline(cacheDir: str, years: Optional[Set[ContinuousNHANES]] = None,
+                             updateCache: bool = False, ioWorkers: int = 4, processes: Optional[int] = None,
+                             cacheFormat: str = defaultCacheFormat, chunksize: Optional[int] = None,
+                             queueSize: Optional[int] = None, retryFailed: bool = False,
+                             verify: bool = False) -> BuildReport:
+    """
+    Caches every codebook of years (all when None) with ioWorkers threads fetching and processes converting
+    Streamed codebooks are only cached when chunksize is given, by an I/O thread (see streamCodebookToCache)
+    Codebooks the build journal records as done are skipped while their file is unchanged (see nhanes_dl.journal),
+    verify checksums every one of them. retryFailed only caches the codebooks that failed last time
+    Returns the BuildReport, which is also saved to {cacheDir}/build_report.json
+    """
+    processes = processes or os.cpu_count() or 1
+    queueSize = queueSize or 2 * processes
+    makeDirectoryIfNotExists(cacheDir)
+    manifest = manifestFor(cacheDir)
+    mirror = mirrorFor(cacheDir)
+    report = BuildReport()
+    years = sorted(allContinuousNHANES() if years is None else years)
+    journal = journalFor(cacheDir)
+    journal.startBuild(years=[int(y) for y in years], cacheFormat=cacheFormat, chunksize=chunksize)
+    failed = journal.withStatus(FAILED) if retryFailed else None
+
+    toCache = []
+    for year in years:
+        makeDirectoryIfNotExists(f"{cacheDir}/{download.nhanesYearSavePath(year)}")
+        for codebook in getYearsCodebookDescriptions(year).dataFile:
+            key = download.manifestKey(year, codebook)
+            if failed is not None and key not in failed:
+                continue
+            savePath = f"{cacheDir}/{download.codebookSavePath(year, codebook, cacheFormat)}"
+            streamed = download.isStreamedCodebook(codebook)
+            if not updateCache and download.journaledCache(cacheDir, key, savePath, verify):
+                report.add("skipped", key, "already cached")
+            elif download.isIgnoredCodebook(codebook, chunksize):
+                report.add("skipped", key, "ignored codebook")
+                journal.skipped(key, "ignored codebook")
+            else:
+                toCache.append((year, codebook, key, savePath, streamed))
+
+    # Released once a fetched file is converted, so it bounds the fetched files held in memory
+    pending = threading.BoundedSemaphore(queueSize)
+    conversions = []
+    conversionsLock = threading.Lock()
+
+    with loggedStats(f"buildNhanesCachePipeline {cacheDir}"), conversionPool(processes) as converters:
+        def converted(lock: FileLock):
+            pending.release()
+            lock.release()
+
+        def fetch(entry):
+            year, codebook, key, savePath, streamed = entry
+            lock = FileLock(savePath).acquire()
+            try:
+                if not updateCache and download.journaledCache(cacheDir, key, savePath):
+                    report.add("skipped", key, "cached by another job")
+                elif streamed:
+                    rows = download.streamCodebookToCache(year, codebook, savePath, chunksize)
+                    journal.done(key, savePath, rows, manifest.get(key).get("checksum"))
+                    report.add("cached", key, rows)
+                else:
+                    url = codebookURL(year, codebook)
+                    pending.acquire()
+                    try:
+                        body, validators = download.fetchIfChanged(url)
+                        if mirror is not None:
+                            mirror.put(key, body, url, validators)
+                        future = converters.submit(convertCodebook, body, url, savePath)
+                    except BaseException:
+                        pending.release()
+                        raise
+                    with conversionsLock:
+                        conversions.append((future, key, savePath, validators))
+                    # The lock is handed over to the conversion
+                    future.add_done_callback(lambda _, held=lock: converted(held))
+                    lock = None
+            except DownloadException as e:
+                report.add("failed", key, str(e))
+                journal.failed(key, str(e) or type(e).__name__)
+            finally:
+                if lock is not None:
+                    lock.release()
+
+        with ThreadPoolExecutor(max(1, ioWorkers)) as fetchers:
+            list(fetchers.map(fetch, toCache))
+
+        for future, key, savePath, validators in conversions:
+            try:
+                rows = future.result()
+                recordCacheFile(savePath, rows=rows)
+                manifest.update(key, **validators)
+                journal.done(key, savePath, rows, manifest.get(key).get("checksum"))
+                report.add("cached", key, rows)
+            except Exception as e:
+                report.add("failed", key, str(e) or type(e).__name__)
+                journal.failed(key, str(e) or type(e).__name__)
+
+    report.finished = time.time()
+    report.save(os.path.join(cacheDir, reportFileName))
+    return report
+
+
+def buildCacheFromMirror(cacheDir: str, years: Optional[Set[ContinuousNHANES]] = None,
+                         processes: Optional[int] = None, cacheFormat: str = defaultCacheFormat) -> BuildReport:
+    """
+    Converts every file in the raw mirror of cacheDir (of years, all when None) into the cache again, without
+    any network access. i.e after changing the cacheFormat. Cached files are overwritten
+    Returns the BuildReport, which is also saved to {cacheDir}/build_report.json
+    """
+    mirror = mirrorFor(cacheDir)
+    getCacheFormat(cacheFormat)
+    if mirror is None:
+        raise ValueError(f"{cacheDir} has no raw mirror, see nhanes_dl.mirror.enableMirror")
+    yearPaths = None if years is None else {download.nhanesYearSavePath(y) for y in years}
+    report = BuildReport()
+
+    toConvert = []
+    for key, entry in sorted(mirror.entries().items()):
+        yearPath, name = key.split("/", 1)
+        if yearPaths is not None and yearPath not in yearPaths:
+            continue
+        objectPath = mirror.path(key)
+        if objectPath is None:
+            report.add("failed", key, "raw file missing from the mirror")
+            continue
+        makeDirectoryIfNotExists(f"{cacheDir}/{yearPath}")
+        savePath = f"{cacheDir}/{yearPath}/{name}{getCacheFormat(cacheFormat).extension}"
+        toConvert.append((key, name, entry["url"], objectPath, savePath))
+
+    with loggedStats(f"buildCacheFromMirror {cacheDir}"), \
+            conversionPool(processes or os.cpu_count() or 1) as converters:
+        futures = [(converters.submit(convertMirrored, objectPath, name, url, savePath), key, name, savePath)
+                   for key, name, url, objectPath, savePath in toConvert]
+        for future, key, name, savePath in futures:
+            try:
+                rows = future.result()
+                recordCacheFile(savePath, rows=rows)
+                report.add("cached", key, rows)
+            except Exception as e:
+                report.add("failed", key, str(e) or type(e).__name__)
+
+    report.finished = time.time()
+    report.save(os.path.join(cacheDir, reportFileName))
+    return report
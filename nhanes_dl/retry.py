@@ -0,0 +1,144 @@
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple, Type, TypeVar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from nhanes_dl.events import emit, logger
+from nhanes_dl.types import ClientErrorException, DownloadException, HTTPStatusException, NetworkException, \
+    ServerErrorException, ThrottledException
+
+# Retry policy every fetch goes through (see getRetryPolicy)
+# Transport failures are classified into DownloadException subclasses, the transient ones are retried
+# with exponential backoff and jitter, while a per host rate limit and a process wide retry budget
+# keep a throttling server from being hammered
+
+T = TypeVar('T')
+
+
+def classify(e: Exception, url: str) -> DownloadException:
+    """
+    Returns the DownloadException subclass for a HTTPError/URLError raised fetching url
+    """
+    if isinstance(e, HTTPError):
+        retryAfter = None
+        try:
+            retryAfter = float(e.headers.get("Retry-After")) if e.headers is not None else None
+        except (TypeError, ValueError):
+            pass
+        cls: Type[HTTPStatusException] = ServerErrorException if e.code >= 500 else ClientErrorException
+        if e.code == 429:
+            cls = ThrottledException
+        return cls(f"HTTP {e.code} - {url}", e.code, retryAfter)
+    return NetworkException(f"Request timed out - {url}")
+
+
+class RateLimiter:
+    """
+    Spaces requests to the same host at least 1 / requestsPerSecond apart, None doesn't limit
+    """
+
+    def __init__(self, requestsPerSecond: Optional[float] = None):
+        self.requestsPerSecond = requestsPerSecond
+        self._lock = threading.Lock()
+        self._next: Dict[str, float] = {}
+
+    def wait(self, host: str):
+        if not self.requestsPerSecond:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next.get(host, now))
+            self._next[host] = at + 1 / self.requestsPerSecond
+        if at > now:
+            time.sleep(at - now)
+
+
+class RetryBudget:
+    """
+    Token bucket of retries shared by every fetch, holds at most retries and refills them over perSeconds
+    Once it is empty failures are raised straight away instead of retried
+    """
+
+    def __init__(self, retries: int = 100, perSeconds: float = 60.0):
+        self.retries = retries
+        self.perSeconds = perSeconds
+        self._lock = threading.Lock()
+        self._tokens = float(retries)
+        self._updated = time.monotonic()
+
+    def spend(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.retries, self._tokens + (now - self._updated) * self.retries / self.perSeconds)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    """
+    Calls a fetch up to attempts times, sleeping min(maxDelay, baseDelay * 2 ** attempt) +- jitter between
+    A server's Retry-After is used instead when it sent one
+    """
+    retryable: Tuple[Type[DownloadException], ...] = (NetworkException, ServerErrorException, ThrottledException)
+
+    def __init__(self, attempts: int = 4, baseDelay: float = 1.0, maxDelay: float = 30.0, jitter: float = 0.5,
+                 rateLimiter: Optional[RateLimiter] = None, budget: Optional[RetryBudget] = None):
+        self.attempts = attempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.jitter = jitter
+        self.rateLimiter = rateLimiter or RateLimiter()
+        self.budget = budget or RetryBudget()
+
+    def delay(self, attempt: int, e: DownloadException) -> float:
+        retryAfter = getattr(e, "retryAfter", None)
+        if retryAfter is not None:
+            return min(self.maxDelay, retryAfter)
+        delay = min(self.maxDelay, self.baseDelay * 2 ** attempt)
+        return max(0.0, delay * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def call(self, fetch: Callable[[], T], url: str, onRetry: Optional[Callable[[int, DownloadException], None]] = None) -> T:
+        """
+        Returns fetch(), retrying transient failures. Raises the classified DownloadException once out of
+        attempts, retry budget, or if the failure isn't transient
+        """
+        host = urlsplit(url).netloc
+        for attempt in range(self.attempts):
+            self.rateLimiter.wait(host)
+            try:
+                return fetch()
+            except (HTTPError, URLError) as raw:
+                e = classify(raw, url)
+                e.__cause__ = raw
+            except DownloadException as typed:
+                e = typed
+
+            last = attempt + 1 >= self.attempts
+            if last or not isinstance(e, self.retryable) or not self.budget.spend():
+                raise e
+            delay = self.delay(attempt, e)
+            logger.info("Retrying %s in %.1fs (attempt %d): %s", url, delay, attempt + 1, e)
+            emit("retry", url=url, attempt=attempt + 1, delay=delay, error=str(e))
+            if onRetry is not None:
+                onRetry(attempt + 1, e)
+            time.sleep(delay)
+
+
+_policy = RetryPolicy()
+
+
+def getRetryPolicy() -> RetryPolicy:
+    return _policy
+
+
+def setRetryPolicy(policy: RetryPolicy) -> RetryPolicy:
+    """
+    Replaces the retry policy every fetch goes through, returning the previous one
+    """
+    global _policy
+    previous, _policy = _policy, policy
+    return previous
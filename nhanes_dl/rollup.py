@@ -0,0 +1,138 @@
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from nhanes_dl.catalog import familyOf
+from nhanes_dl.events import timed
+
+# Roll up of long format codebooks (several rows per SEQN, i.e prescriptions or dietary recall foods)
+# into one row per SEQN, so they can be joined and cached like any other codebook
+# The rows are grouped once (SEQN factorized into group codes) and every aggregation is a vectorized
+# bincount or first occurrence lookup over those codes, so a multi million row file is rolled up in one pass
+# Codebooks without a declared Rollup still throw a DuplicateSEQNException when they repeat SEQN
+
+aggregations = ["first", "sum", "mean"]
+
+
+class Rollup:
+    """
+    How the rows of a long format codebook are rolled up into one row per SEQN
+    count names the column holding the rows of every SEQN, None leaves it out
+    columns aggregates each column with "first" (first non missing value), "sum" or "mean" (missing values skipped)
+    pivot counts the rows of every code of a column, as a {column}_{code} column per code
+    Columns not named are dropped
+    """
+
+    def __init__(self, count: Optional[str] = None, columns: Optional[Dict[str, str]] = None,
+                 pivot: Optional[Dict[str, List]] = None):
+        self.count = count
+        self.columns = dict(columns or {})
+        self.pivot = {k: list(v) for k, v in (pivot or {}).items()}
+        unknown = {a for a in self.columns.values() if a not in aggregations}
+        if unknown:
+            raise ValueError(f"Unknown aggregations {sorted(unknown)}, use one of {aggregations}")
+
+    def apply(self, df: pd.DataFrame, source: str = "") -> pd.DataFrame:
+        """
+        Returns df rolled up to one row per SEQN, ordered by SEQN, emitting a rollup event (see nhanes_dl.events)
+        """
+        with timed("rollup", source=source) as fields:
+            codes, seqn = pd.factorize(df.index, sort=True)
+            groups = len(seqn)
+            res = {}
+            if self.count:
+                res[self.count] = np.bincount(codes, minlength=groups)
+            for column, aggregation in self.columns.items():
+                if column in df.columns:
+                    res[column] = _aggregate(df[column], codes, groups, aggregation)
+            for column, values in self.pivot.items():
+                if column in df.columns:
+                    res.update(_pivot(df[column], codes, groups, column, values))
+            res = pd.DataFrame(res, index=pd.Index(seqn, name=df.index.name))
+            fields.update(rows=len(df), groups=groups)
+        return res
+
+
+def _aggregate(values: pd.Series, codes: np.ndarray, groups: int, aggregation: str):
+    present = values.notna().to_numpy()
+    if aggregation == "first":
+        positions = np.flatnonzero(present)
+        found, first = np.unique(codes[positions], return_index=True)
+        res = np.full(groups, None, dtype=object) if values.dtype == object else np.full(groups, np.nan)
+        res[found] = values.to_numpy()[positions[first]]
+        return res
+
+    numbers = values.to_numpy(dtype="float64", na_value=np.nan)
+    sums = np.bincount(codes, weights=np.where(present, numbers, 0), minlength=groups)
+    if aggregation == "sum":
+        return sums
+    counts = np.bincount(codes, weights=present, minlength=groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def _pivot(values: pd.Series, codes: np.ndarray, groups: int, column: str, pivotCodes: List) -> Dict:
+    # Character codes are matched whether given as str or as the bytes pd.read_sas returns
+    position = {c: i for i, c in enumerate(pivotCodes)}
+    position.update({c.encode("latin-1"): i for c, i in position.items() if isinstance(c, str)})
+    which = pd.Index(list(position)).get_indexer(values.to_numpy())
+    matched = which >= 0
+    which = np.array(list(position.values()))[which[matched]]
+    counts = np.bincount(codes[matched] * len(pivotCodes) + which, minlength=groups * len(pivotCodes))
+    counts = counts.reshape(groups, len(pivotCodes))
+    return {f"{column}_{_codeName(code)}": counts[:, i] for i, code in enumerate(pivotCodes)}
+
+
+def _codeName(code) -> str:
+    if isinstance(code, bytes):
+        code = code.decode("latin-1")
+    if isinstance(code, float) and code.is_integer():
+        code = int(code)
+    return str(code)
+
+
+def _dietaryRecall(day: int) -> Rollup:
+    # Totals of the nutrients of every food eaten on the recall day
+    nutrients = ["KCAL", "PROT", "CARB", "SUGR", "FIBE", "TFAT"]
+    return Rollup(count=f"DR{day}IFDN", columns={f"DR{day}I{n}": "sum" for n in nutrients})
+
+
+# Declared roll ups by codebook family (or data file name), see setRollup
+_rollups: Dict[str, Rollup] = {
+    "RXQ_RX": Rollup(count="RXDN", columns={"RXDUSE": "first", "RXDCOUNT": "first"}),
+    "DR1IFF": _dietaryRecall(1),
+    "DR2IFF": _dietaryRecall(2),
+}
+
+
+def getRollup(codebook: str) -> Optional[Rollup]:
+    """
+    Returns the Rollup declared for the data file codebook or its family, None when there isn't one
+    """
+    return _rollups.get(codebook, _rollups.get(familyOf(codebook)))
+
+
+def setRollup(codebook: str, rollup: Optional[Rollup]) -> Optional[Rollup]:
+    """
+    Declares how codebook (a family like RXQ_RX, or a single data file like RXQ_RX_D) is rolled up
+    None removes the declaration. Returns the previous one
+    A pipelined build hands the declarations to its conversion processes when it starts (see declareRollups)
+    """
+    previous = _rollups.pop(codebook, None)
+    if rollup is not None:
+        _rollups[codebook] = rollup
+    return previous
+
+
+def declaredRollups() -> Dict[str, Rollup]:
+    """
+    Returns every declared Rollup, keyed by codebook family or data file
+    """
+    return dict(_rollups)
+
+
+def declareRollups(rollups: Dict[str, Rollup]):
+    """
+    Replaces every declared Rollup with rollups, i.e the declarations of the process that started this one
+    """
+    _rollups.clear()
+    _rollups.update(rollups)
@@ -0,0 +1,194 @@
+import http.client
+import queue
+import socket
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from email.message import Message
+from typing import BinaryIO, Dict, Optional, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import urljoin, urlsplit
+
+# Every request to the CDC (and the codebook catalog) goes through the transport returned by getTransport
+# HTTPTransport keeps a pool of keep-alive connections per host, tests can setTransport a fake instead
+# Failures are raised as urllib's HTTPError/URLError, so callers handle them the same as urlopen
+
+defaultTimeout = 60.0
+defaultMaxConnectionsPerHost = 8
+_redirects = {301, 302, 303, 307, 308}
+
+
+class Response:
+    """
+    Status and headers of a finished request, body is None when it was written to a file
+    """
+
+    def __init__(self, url: str, status: int, headers: Message, body: Optional[bytes] = None):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class Transport(ABC):
+    @abstractmethod
+    def request(self, url: str, headers: Optional[Dict[str, str]] = None) -> Response:
+        """
+        GETs url, returning its body in memory. Statuses >= 400 raise HTTPError, network failures URLError
+        A 304 is returned as is, with an empty body
+        """
+
+    @abstractmethod
+    def download(self, url: str, out: BinaryIO, headers: Optional[Dict[str, str]] = None) -> Response:
+        """
+        Same as request, but the body is streamed into out instead of held in memory
+        """
+
+
+class _Pool:
+    def __init__(self, connect, size: int):
+        self.connect = connect
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = queue.LifoQueue()
+
+    def get(self) -> Tuple[http.client.HTTPConnection, bool]:
+        """
+        Returns a connection and whether it was reused, blocks while the host has no free slot
+        """
+        self.slots.acquire()
+        try:
+            return self.idle.get_nowait(), True
+        except queue.Empty:
+            return self.connect(), False
+
+    def put(self, connection: Optional[http.client.HTTPConnection]):
+        if connection is not None:
+            self.idle.put(connection)
+        self.slots.release()
+
+
+class HTTPTransport(Transport):
+    """
+    http(s) transport with at most maxConnectionsPerHost keep-alive connections per host
+    Asks for gzip and decompresses it, follows redirects
+    """
+
+    def __init__(self, timeout: float = defaultTimeout,
+                 maxConnectionsPerHost: int = defaultMaxConnectionsPerHost):
+        self.timeout = timeout
+        self.maxConnectionsPerHost = maxConnectionsPerHost
+        self._lock = threading.Lock()
+        self._pools: Dict[Tuple[str, str], _Pool] = {}
+
+    def _pool(self, scheme: str, netloc: str) -> _Pool:
+        with self._lock:
+            pool = self._pools.get((scheme, netloc))
+            if pool is None:
+                cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+                pool = self._pools[(scheme, netloc)] = _Pool(
+                    lambda: cls(netloc, timeout=self.timeout), self.maxConnectionsPerHost)
+            return pool
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            while not pool.idle.empty():
+                pool.idle.get_nowait().close()
+
+    def request(self, url: str, headers: Optional[Dict[str, str]] = None) -> Response:
+        chunks = []
+        res = self._get(url, headers or {}, chunks.append)
+        res.body = b"".join(chunks)
+        return res
+
+    def download(self, url: str, out: BinaryIO, headers: Optional[Dict[str, str]] = None) -> Response:
+        return self._get(url, headers or {}, out.write)
+
+    def _get(self, url: str, headers: Dict[str, str], write, redirects: int = 5) -> Response:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise URLError(f"Unsupported url - {url}")
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        pool = self._pool(parts.scheme, parts.netloc)
+        for attempt in range(2):
+            connection, reused = pool.get()
+            response, kept = None, None
+            # The host's slot is given back however the request ends, the connection only when it can be reused
+            try:
+                connection.request("GET", path, headers={"Accept-Encoding": "gzip", **headers})
+                response = connection.getresponse()
+                status, responseHeaders = response.status, response.msg
+                redirect = status in _redirects and responseHeaders.get("Location") and redirects > 0
+                if redirect or status >= 400:
+                    response.read()
+                else:
+                    self._copy(response, write, responseHeaders.get("Content-Encoding") == "gzip")
+                if response.will_close:
+                    connection.close()
+                else:
+                    kept = connection
+            except zlib.error as e:
+                # A corrupt or truncated gzip body, raised like any other broken response
+                connection.close()
+                raise URLError(e)
+            except (http.client.HTTPException, socket.timeout, OSError) as e:
+                connection.close()
+                # A reused connection may have been closed by the server while idle,
+                # if nothing was received yet the request is sent again on a new one
+                if reused and response is None and attempt == 0 and not isinstance(e, socket.timeout):
+                    continue
+                raise URLError(e)
+            except BaseException:
+                connection.close()
+                raise
+            finally:
+                pool.put(kept)
+
+            if redirect:
+                return self._get(urljoin(url, responseHeaders["Location"]), headers, write, redirects - 1)
+            if status >= 400:
+                raise HTTPError(url, status, response.reason, responseHeaders, None)
+            return Response(url, status, responseHeaders)
+
+    @staticmethod
+    def _copy(response: http.client.HTTPResponse, write, gzipped: bool):
+        if not gzipped:
+            for block in iter(lambda: response.read(1 << 20), b""):
+                write(block)
+            return
+        decompress = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for block in iter(lambda: response.read(1 << 20), b""):
+            write(decompress.decompress(block))
+        write(decompress.flush())
+        if not decompress.eof:
+            raise zlib.error("Truncated gzip body")
+
+
+_transport: Transport = HTTPTransport()
+
+
+def getTransport() -> Transport:
+    return _transport
+
+
+def setTransport(transport: Transport) -> Transport:
+    """
+    Replaces the transport every fetch goes through (i.e a HTTPTransport with other timeouts, or a fake in tests)
+    Returns the previous one
+    """
+    global _transport
+    previous, _transport = _transport, transport
+    return previous
+
+
+def configure(timeout: float = defaultTimeout, maxConnectionsPerHost: int = defaultMaxConnectionsPerHost):
+    """
+    Uses a new HTTPTransport with these settings for every fetch
+    """
+    previous = setTransport(HTTPTransport(timeout, maxConnectionsPerHost))
+    if isinstance(previous, HTTPTransport):
+        previous.close()
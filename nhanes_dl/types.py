@@ -1,6 +1,7 @@
 from enum import IntEnum
-from typing import Tuple, List, NewType, Callable, Set
+from typing import Any, Iterable, Iterator, Optional, Tuple, List, NewType, Callable, Set
 import pandas as pd
+from nhanes_dl.events import frameFields, timed
 
 
 class ContinuousNHANES(IntEnum):
@@ -23,7 +24,6 @@ class ContinuousNHANES(IntEnum):
 
 Codebook = NewType('Codebook', pd.DataFrame)
 Mortality = NewType('Mortality', pd.DataFrame)
-LinkedDataset = NewType('LinkedDataset', pd.DataFrame)
 Downloader = Callable[[str], pd.DataFrame]
 CodebookDescription = NewType('CodebookDescription', pd.DataFrame)
 
@@ -50,9 +50,13 @@ def allContinuousNHANES() -> Set[ContinuousNHANES]:
     return set([x for x in ContinuousNHANES])
 
 
+# Base of every codebook url, can be pointed at a mirror or a local server
+nhanesURL = "https://wwwn.cdc.gov/Nchs/NHANES"
+
+
 def codebookURL(year: ContinuousNHANES, codebookName: str) -> str:
     (s, e) = getStartEndYear(year)
-    return f"https://wwwn.cdc.gov/Nchs/NHANES/{s}-{e}/{codebookName}.XPT"
+    return f"{nhanesURL}/{s}-{e}/{codebookName}.XPT"
 
 
 def mortalityURL(year: ContinuousNHANES) -> str:
@@ -73,15 +77,25 @@ def getCodebookNames(c: ContinuousNHANES) -> List[str]:
     return [""]
 
 
-def joinCodebooks(codebooks: List[Codebook]) -> Codebook:
-    return Codebook(pd.concat(codebooks, axis=1))
-
+def joinCodebooks(codebooks: List[Codebook], downcast: bool = False) -> Codebook:
+    """
+    Outer joins the codebooks of a NHANES year on SEQN (see nhanes_dl.merge)
+    downcast stores float columns that only hold small integer codes as nullable ints
+    """
+    from nhanes_dl import merge
+    with timed("join") as fields:
+        res = merge.joinFrames(codebooks, downcast)
+        fields.update(frameFields(codebooks, res))
+    return Codebook(res)
 
-def appendCodebooks(codebooks: List[Codebook]) -> Codebook:
-    # Some codebooks may have repeat columns, have to remove them in order to append codebooks safely
-    noDuplicates = [x.loc[:, ~x.columns.duplicated()] for x in codebooks]
 
-    return Codebook(pd.concat(noDuplicates))
+def appendCodebooks(codebooks: List[Codebook], downcast: bool = False) -> Codebook:
+    # Some codebooks may have repeat columns, only the first of them is appended
+    from nhanes_dl import merge
+    with timed("append") as fields:
+        res = merge.appendFrames(codebooks, downcast)
+        fields.update(frameFields(codebooks, res))
+    return Codebook(res)
 
 
 def appendMortalities(mortalities: List[Mortality]) -> Mortality:
@@ -93,7 +107,10 @@ def linkCodebookWithMortality(code: Codebook, mort: Mortality) -> Codebook:
     # This is why a outer join is necessary
     # code = code.set_index("SEQN")
     # mort = mort.set_index("SEQN")
-    return Codebook(code.join(mort, how="outer"))
+    with timed("linkMortality") as fields:
+        res = code.join(mort, how="outer")
+        fields.update(frameFields([code, mort], res))
+    return Codebook(res)
 
 
 class CodebookDownload:
@@ -106,17 +123,149 @@ class DownloadException(Exception):
     pass
 
 
+class NetworkException(DownloadException):
+    """
+    The request never got a response, i.e the connection failed or timed out
+    """
+    pass
+
+
+class HTTPStatusException(DownloadException):
+    """
+    The server answered with an error status, retryAfter is its Retry-After in seconds if it sent one
+    """
+
+    def __init__(self, message: str, code: int, retryAfter: Optional[float] = None):
+        super().__init__(message)
+        self.code = code
+        self.retryAfter = retryAfter
+
+
+class ClientErrorException(HTTPStatusException):
+    pass
+
+
+class ThrottledException(ClientErrorException):
+    """
+    429 Too Many Requests
+    """
+    pass
+
+
+class ServerErrorException(HTTPStatusException):
+    pass
+
+
+class ParseException(DownloadException):
+    """
+    The file was downloaded but isn't a valid codebook or mortality file
+    """
+    pass
+
+
+class DuplicateSEQNException(ParseException):
+    pass
+
+
 def getYearsCodebookDescriptions(year: ContinuousNHANES) -> CodebookDescription:
-    desc = getAllCodebookDescriptions()
-    (s, e) = getStartEndYear(year)
-    inYear = (desc.startYear == s) & (desc.endYear == e)
-    return CodebookDescription(desc.loc[inYear, :])
+    from nhanes_dl import catalog
+    return catalog.defaultCatalog.year(getStartEndYear(year))
 
 
 def getAllCodebookDescriptions() -> CodebookDescription:
-    url = "https://raw.githubusercontent.com/LeviButcher/nhanes-scraper/master/results/nhanes_codebooks.csv"
-    # Removes any duplicate rows, if any exist
-    res = pd.read_csv(url).drop_duplicates(
-        subset=["startYear", "endYear", "dataFile"])
+    """
+    Returns the codebook catalog, loaded once per process (see nhanes_dl.catalog)
+    """
+    from nhanes_dl import catalog
+    return catalog.defaultCatalog.all()
+
+
+def resolveFamily(family: str, years: Optional[Iterable[ContinuousNHANES]] = None) -> List[CodebookDownload]:
+    """
+    Resolves a codebook family (i.e DEMO or BPX) against the catalog into a CodebookDownload per year, ordered by year
+    years defaults to all of them, years without the family are left out
+    """
+    from nhanes_dl import catalog
+    files = catalog.defaultCatalog.family(family)
+    years = sorted(allContinuousNHANES() if years is None else set(years))
+    return [CodebookDownload(y, *files[getStartEndYear(y)]) for y in years if getStartEndYear(y) in files]
+
+
+class LinkedDataset:
+    """
+    Lazy handle on the codebooks (and optionally mortality) of a cache directory
+    Each method returns a new handle with the years, variables or row filters added to its plan,
+    nothing is read until collect (see nhanes_dl.dataset)
+    """
 
-    return CodebookDescription(res)
+    def __init__(self, cacheDir: str, years: Optional[Iterable[ContinuousNHANES]] = None,
+                 variables: Optional[Iterable[str]] = None,
+                 filters: Iterable[Tuple[str, str, Any]] = (), mortality: bool = False,
+                 cacheFormat: Optional[str] = None):
+        self.cacheDir = cacheDir
+        self.years = sorted(allContinuousNHANES() if years is None else set(years))
+        self.variables = None if variables is None else list(dict.fromkeys(variables))
+        self.filters = list(filters)
+        self.mortality = mortality
+        self.cacheFormat = cacheFormat
+
+    def _with(self, **changes) -> "LinkedDataset":
+        plan = dict(cacheDir=self.cacheDir, years=self.years, variables=self.variables,
+                    filters=self.filters, mortality=self.mortality, cacheFormat=self.cacheFormat)
+        plan.update(changes)
+        return LinkedDataset(**plan)
+
+    def forYears(self, *years: ContinuousNHANES) -> "LinkedDataset":
+        return self._with(years=years)
+
+    def select(self, *variables: str) -> "LinkedDataset":
+        return self._with(variables=(self.variables or []) + list(variables))
+
+    def filter(self, column: str, op: str, value: Any) -> "LinkedDataset":
+        """
+        Only keeps rows where column op value holds, op is one of ==, !=, <, <=, >, >=, in, not in
+        """
+        from nhanes_dl import dataset
+        if op not in dataset.filterOperators:
+            raise ValueError(
+                f"Unknown filter operator {op}, expected one of {', '.join(dataset.filterOperators)}")
+        return self._with(filters=self.filters + [(column, op, value)])
+
+    def withMortality(self, mortality: bool = True) -> "LinkedDataset":
+        return self._with(mortality=mortality)
+
+    def collect(self) -> Codebook:
+        """
+        Reads and joins only what the plan needs, returning the DataFrame
+        """
+        from nhanes_dl import dataset
+        return dataset.collect(self)
+
+    def to_pandas(self) -> Codebook:
+        return self.collect()
+
+    def partitions(self, rows: Optional[int] = None) -> List[Any]:
+        """
+        Splits the plan into Partitions, a year and SEQN range of about rows people, that can be collected
+        separately (i.e by different workers) with collectPartition
+        """
+        from nhanes_dl import dataset
+        return dataset.partitions(self, rows or dataset.defaultPartitionRows)
+
+    def collectPartition(self, partition) -> Codebook:
+        from nhanes_dl import dataset
+        return dataset.collectPartition(self, partition)
+
+    def batches(self, rows: Optional[int] = None) -> Iterator[Codebook]:
+        """
+        Yields the result of collect in batches of about rows rows, holding one batch in memory at a time
+        """
+        from nhanes_dl import dataset
+        return dataset.batches(self, rows or dataset.defaultPartitionRows)
+
+    def __repr__(self) -> str:
+        years = ", ".join(y.name for y in self.years)
+        variables = "all" if self.variables is None else ", ".join(self.variables)
+        filters = " and ".join(f"{c} {op} {v!r}" for c, op, v in self.filters) or "none"
+        return (f"LinkedDataset({self.cacheDir}: years {years}; variables {variables}; "
+                f"filters {filters}; mortality {self.mortality})")
@@ -1,26 +1,73 @@
-from typing import Callable
+import os
+from typing import Callable, Iterable, List, TypeVar
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-from os.path import exists
+from os.path import exists, splitext
+from nhanes_dl.events import emit, logger, timed
+from nhanes_dl.eviction import recordAccess
+from nhanes_dl.formats import CsvFormat, formatOfPath
+from nhanes_dl.locks import FileLock, writeAtomically
+from nhanes_dl.manifest import recordCacheFile
 
+T = TypeVar('T')
+R = TypeVar('R')
 
-def makeDirectoryIfNotExists(directory: str) -> bool:
-    import os
-
-    try:
-        os.mkdir(directory)
-        return True
 
-    except:
+def makeDirectoryIfNotExists(directory: str) -> bool:
+    """
+    Creates directory along with any missing parents, returns whether it had to be created
+    """
+    if os.path.isdir(directory):
         return False
+    os.makedirs(directory, exist_ok=True)
+    return True
 
 
 def readOrUpdateCache(cachePath: str, getDataframe: Callable[[], pd.DataFrame],
                       updateCache: bool = False) -> pd.DataFrame:
+    """
+    Reads the DataFrame cached at cachePath, the extension of cachePath picks the cache format
+    If it isn't cached yet but a csv cache of it is, the csv is converted instead of downloading again
+    Every file written is recorded in the manifest of its cache directory (see nhanes_dl.manifest)
+    Safe with other threads and processes caching the same path, only one of them calls getDataframe while the
+    others wait and read what it cached (see nhanes_dl.locks)
+    Reads are recorded for the cache directory's size budget (see nhanes_dl.eviction)
+    """
+    cacheFormat = formatOfPath(cachePath)
     if exists(cachePath) and not updateCache:
-        print(f"{cachePath} - already exists")
-        return pd.read_csv(cachePath, low_memory=False)
+        logger.debug("%s - already exists", cachePath)
+        emit("cacheHit", path=cachePath)
+        recordAccess(cachePath, hit=True)
+        return cacheFormat.read(cachePath)
+
+    with FileLock(cachePath):
+        if exists(cachePath) and not updateCache:
+            logger.debug("%s - cached while waiting", cachePath)
+            emit("cacheHit", path=cachePath)
+            recordAccess(cachePath, hit=True)
+            return cacheFormat.read(cachePath)
+        emit("cacheMiss", path=cachePath)
+        recordAccess(cachePath, hit=False)
+
+        csvPath = f"{splitext(cachePath)[0]}{CsvFormat.extension}"
+        if exists(csvPath) and not updateCache:
+            res = CsvFormat().read(csvPath)
+        else:
+            res = getDataframe()
+        with timed("cacheWrite", path=cachePath, rows=len(res)):
+            writeAtomically(cachePath, lambda tmp: cacheFormat.write(res, tmp))
+        recordCacheFile(cachePath, res)
+    return res
+
+
+def mapConcurrently(f: Callable[[T], R], xs: Iterable[T], workers: int = 1) -> List[R]:
+    """
+    Maps f over xs with at most workers calls running at once
+    Results are returned in the same order as xs, workers <= 1 runs sequentially
+    """
+    xs = list(xs)
+    if workers <= 1 or len(xs) <= 1:
+        return [f(x) for x in xs]
 
-    else:
-        res = getDataframe()
-        res.to_csv(cachePath)
-        return res
+    with ThreadPoolExecutor(max_workers=min(workers, len(xs))) as pool:
+        return list(pool.map(f, xs))
@@ -0,0 +1,30 @@
+from email.message import Message
+from typing import Dict, List
+from urllib.error import HTTPError
+from nhanes_dl.transport import Response, Transport
+
+# Helpers for running the download functions offline, FakeTransport serves files from memory
+# The files themselves are built with the writers of benchmarks.synthetic (writeXPT, writeMortality), which
+# localServer serves over http
+
+
+class FakeTransport(Transport):
+    """
+    Transport serving a dict of url -> bytes, anything else is a 404. Records every url requested
+    """
+
+    def __init__(self, files: Dict[str, bytes]):
+        self.files = files
+        self.requested: List[str] = []
+
+    def request(self, url, headers=None):
+        self.requested.append(url)
+        if url not in self.files:
+            raise HTTPError(url, 404, "Not Found", Message(), None)
+        return Response(url, 200, Message(), self.files[url])
+
+    def download(self, url, out, headers=None):
+        res = self.request(url, headers)
+        out.write(res.body)
+        res.body = None
+        return res
@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+from nhanes_dl import catalog, types
+from benchmarks.synthetic import localServer
+
+
+@pytest.fixture
+def catalogServer(tmp_path):
+    served = tmp_path / "served"
+    served.mkdir()
+    pd.DataFrame({
+        "codebookType": ["Demographics", "Examination", "Examination", "Demographics"],
+        "startYear": [2005, 2005, 2005, 2007],
+        "endYear": [2006, 2006, 2006, 2008],
+        "dataFile": ["DEMO_D", "BMX_D", "BMX_D", "DEMO_E"],
+    }).to_csv(served / "nhanes_codebooks.csv", index=False)
+
+    with localServer(str(served)) as url:
+        yield f"{url}/nhanes_codebooks.csv", tmp_path / "persisted"
+
+
+def test_catalog_indexesByYear(catalogServer):
+    url, persisted = catalogServer
+    c = catalog.CodebookCatalog(url, str(persisted))
+
+    res = c.year((2005, 2006))
+    assert list(res.dataFile) == ["DEMO_D", "BMX_D"]
+    assert len(c.year((2017, 2018))) == 0
+    assert len(c.all()) == 3
+
+
+def test_catalog_persistsAndWorksOffline(catalogServer):
+    url, persisted = catalogServer
+    catalog.CodebookCatalog(url, str(persisted)).all()
+    assert (persisted / "nhanes_codebooks.csv").exists()
+
+    offline = catalog.CodebookCatalog("http://127.0.0.1:9/nhanes_codebooks.csv", str(persisted), maxAge=0)
+    assert len(offline.year((2007, 2008))) == 1
+
+
+def test_catalog_revalidatesWhenStale(catalogServer):
+    url, persisted = catalogServer
+    catalog.CodebookCatalog(url, str(persisted)).all()
+
+    stale = catalog.CodebookCatalog(url, str(persisted), maxAge=0)
+    assert len(stale.refresh()) == 3
+
+
+def test_getYearsCodebookDescriptions_usesDefaultCatalog(catalogServer, monkeypatch):
+    url, persisted = catalogServer
+    monkeypatch.setattr(catalog, "defaultCatalog", catalog.CodebookCatalog(url, str(persisted)))
+
+    res = types.getYearsCodebookDescriptions(types.ContinuousNHANES.Fifth)
+    assert list(res.dataFile) == ["DEMO_E"]
+
+
+def test_catalog_indexesByFamily(catalogServer):
+    url, persisted = catalogServer
+    c = catalog.CodebookCatalog(url, str(persisted))
+
+    assert c.family("DEMO") == {(2005, 2006): ["DEMO_D"], (2007, 2008): ["DEMO_E"]}
+    assert c.family("bmx") == {(2005, 2006): ["BMX_D"]}
+    assert c.family("BPX") == {}
+    assert catalog.familyOf("DEMO_D") == "DEMO" and catalog.familyOf("DEMO") == "DEMO"
@@ -0,0 +1,124 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from nhanes_dl import download, types
+from benchmarks.synthetic import fakeMortality
+
+year = types.ContinuousNHANES.Fourth
+
+
+@pytest.fixture
+def cacheDir(tmp_path, monkeypatch):
+    seqn = np.arange(1, 101, dtype=float)
+    codebooks = {
+        "DEMO_D": pd.DataFrame({"RIDAGEYR": np.arange(100, dtype=float), "RIAGENDR": seqn % 2 + 1},
+                               index=pd.Index(seqn, name="SEQN")),
+        "GLU_D": pd.DataFrame({"LBXGLU": seqn[::2] * 10}, index=pd.Index(seqn[::2], name="SEQN")),
+        "BMX_D": pd.DataFrame({"BMXWT": seqn * 2}, index=pd.Index(seqn, name="SEQN")),
+    }
+    cache = tmp_path / "cache"
+    (cache / download.nhanesYearSavePath(year)).mkdir(parents=True)
+    for name, df in codebooks.items():
+        df.to_parquet(cache / download.codebookSavePath(year, name))
+    mortality = fakeMortality(np.arange(1, 121)).rename(columns={"PUBLICID": "SEQN"}).set_index("SEQN")
+    mortality[download.getMortalityColumns()].to_parquet(cache / download.mortalitySavePath(year))
+
+    monkeypatch.setattr(download, "getYearsCodebookDescriptions",
+                        lambda y: pd.DataFrame({"dataFile": list(codebooks) if y == year else []}))
+    return str(cache)
+
+
+def test_linkedDataset_isLazy(cacheDir):
+    ds = types.LinkedDataset(cacheDir + "/missing", [year]).select("RIDAGEYR").filter("RIDAGEYR", ">=", 20)
+
+    assert ds.variables == ["RIDAGEYR"]
+    assert "RIDAGEYR >= 20" in repr(ds)
+
+
+def test_linkedDataset_matchesEagerRead(cacheDir):
+    ds = types.LinkedDataset(cacheDir, [year]).withMortality()
+
+    res = ds.collect()
+    expected = download.readCacheNhanesYearsWithMortality(cacheDir, {year})
+
+    pd.testing.assert_frame_equal(res, expected)
+
+
+def test_linkedDataset_selectAndFilter(cacheDir):
+    ds = types.LinkedDataset(cacheDir, [year]) \
+        .select("LBXGLU", "MORTSTAT") \
+        .filter("RIDAGEYR", ">=", 20) \
+        .filter("RIAGENDR", "in", [2])
+
+    res = ds.to_pandas()
+    full = download.readCacheNhanesYearsWithMortality(cacheDir, {year})
+    expected = full[(full.RIDAGEYR >= 20) & (full.RIAGENDR == 2)][["LBXGLU", "MORTSTAT"]]
+
+    assert list(res.columns) == ["LBXGLU", "MORTSTAT"]
+    pd.testing.assert_frame_equal(res, expected)
+
+
+def test_linkedDataset_unknownOperator(cacheDir):
+    with pytest.raises(ValueError):
+        types.LinkedDataset(cacheDir).filter("RIDAGEYR", "~", 20)
+
+
+def test_linkedDataset_keepsFilteredRowsWithoutSelection(cacheDir):
+    res = types.LinkedDataset(cacheDir, [year]).select("LBXGLU").filter("RIDAGEYR", "<", 10).collect()
+
+    assert len(res) == 10
+    assert res.LBXGLU.isna().sum() == 5
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_linkedDataset_batchesMatchCollect(cacheDir, indexed):
+    if indexed:
+        download.indexCache(cacheDir)
+    ds = types.LinkedDataset(cacheDir, [year]).select("RIDAGEYR", "LBXGLU").filter("RIAGENDR", "==", 1) \
+        .withMortality()
+
+    assert [(p.low, p.high) for p in ds.partitions(30)] == [(1, 30), (31, 60), (61, 90), (91, 120)]
+    batches = list(ds.batches(30))
+
+    assert len(batches) == 4 and max(len(b) for b in batches) <= 30
+    pd.testing.assert_frame_equal(pd.concat(batches), ds.collect(), check_dtype=False)
+
+
+def test_readCacheCodebook_seqnRange(cacheDir):
+    res = download.readCacheCodebook(cacheDir, year, "GLU_D", seqnRange=(10, 20))
+
+    assert list(res.index) == [11.0, 13.0, 15.0, 17.0, 19.0]
+
+
+def test_readCacheLinkedYears_mapsJoinedDataset(cacheDir):
+    from nhanes_dl import manifest
+    expected = download.readCacheNhanesYearsWithMortality(cacheDir, {year})
+
+    first = download.readCacheLinkedYears(cacheDir, {year})
+    again = download.readCacheLinkedYears(cacheDir, {year})
+    pd.testing.assert_frame_equal(first, expected, check_index_type=False)
+    pd.testing.assert_frame_equal(again, expected, check_index_type=False)
+    # Views of the memory mapped file rather than copies
+    assert not again["BMXWT"].to_numpy().flags.writeable
+    linked = os.listdir(os.path.join(cacheDir, download.linkedDirectory))
+    assert len([f for f in linked if f.endswith(".feather")]) == 1
+
+    # Recording the codebooks in the manifest changes what the linked file is named after, the old one goes
+    download.indexCache(cacheDir)
+    download.readCacheLinkedYears(cacheDir, {year})
+    relinked = [f for f in os.listdir(os.path.join(cacheDir, download.linkedDirectory)) if f.endswith(".feather")]
+    assert len(relinked) == 1 and relinked != linked
+    assert manifest.manifestFor(cacheDir).get(f"{download.linkedDirectory}/{relinked[0][:-8]}")["rows"] == 120
+
+
+def test_readCacheLinkedYears_relinksUnindexedCache(cacheDir):
+    first = download.readCacheLinkedYears(cacheDir, {year})
+    bmxPath = os.path.join(cacheDir, download.codebookSavePath(year, "BMX_D"))
+    changed = pd.read_parquet(bmxPath) * 3
+    changed.to_parquet(bmxPath)
+    os.utime(bmxPath, (1, 1))
+
+    # The cache has no manifest, the codebook changed on disk is still noticed
+    res = download.readCacheLinkedYears(cacheDir, {year})
+    assert (res["BMXWT"].dropna() == first["BMXWT"].dropna() * 3).all()
@@ -0,0 +1,530 @@
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from nhanes_dl import catalog, download, manifest, types
+from benchmarks.synthetic import localServer, writeXPT
+
+# Same download functions as test_download, but against fixture files served from a local server
+
+year = types.ContinuousNHANES.Fourth
+
+
+def fakeCodebook(seqn, prefix, columns):
+    rng = np.random.default_rng(len(prefix) + columns)
+    data = {f"{prefix}{i:03d}": rng.integers(1, 10, len(seqn)).astype(float)
+            for i in range(columns)}
+    return pd.DataFrame(data, index=pd.Index(seqn, name="SEQN"))
+
+
+@pytest.fixture
+def nhanesServer(tmp_path, monkeypatch):
+    yearDir = tmp_path / download.nhanesYearSavePath(year)
+    yearDir.mkdir()
+    seqn = list(range(31127, 31227))
+    codebooks = {
+        "DEMO_D": fakeCodebook(seqn, "RIA", 6),
+        "ACQ_D": fakeCodebook(seqn[:60], "ACD", 3),
+        "BMX_D": fakeCodebook(seqn[20:], "BMX", 4),
+        "GLU_D": fakeCodebook(seqn[::2], "LBX", 2),
+    }
+    for name, df in codebooks.items():
+        writeXPT(df, str(yearDir / f"{name}.XPT"), name)
+    s, e = types.getStartEndYear(year)
+    pd.DataFrame({"startYear": s, "endYear": e, "dataFile": list(codebooks)}).to_csv(
+        tmp_path / "nhanes_codebooks.csv", index=False)
+
+    with localServer(str(tmp_path)) as url:
+        monkeypatch.setattr(types, "nhanesURL", url)
+        monkeypatch.setattr(catalog, "defaultCatalog", catalog.CodebookCatalog(
+            f"{url}/nhanes_codebooks.csv", str(tmp_path / "catalog")))
+        yield codebooks
+
+
+def test_downloadCodebook_local(nhanesServer):
+    res = download.downloadCodebook(year, "DEMO_D")
+
+    assert res.shape == (100, 6)
+    assert res.index.name == "SEQN"
+
+
+def test_downloadCodebooks_concurrentMatchesSequential(nhanesServer):
+    conf = download.CodebookDownload(year, *nhanesServer, "MISSING_D")
+
+    sequential = download.downloadCodebooks(conf)
+    concurrent = download.downloadCodebooks(conf, workers=4)
+
+    assert sequential.shape == (100, 15)
+    assert list(concurrent.columns) == list(sequential.columns)
+    pd.testing.assert_frame_equal(concurrent, sequential)
+
+
+def test_readCacheOrDownloadCodebook_keepsDtypes(nhanesServer, tmp_path):
+    cacheDir = str(tmp_path / "cache")
+    download.makeDirectoryIfNotExists(cacheDir)
+
+    downloaded = download.readCacheOrDownloadCodebook(cacheDir, year, "DEMO_D")
+    cached = download.readCacheCodebook(cacheDir, year, "DEMO_D")
+
+    assert (tmp_path / "cache" / download.codebookSavePath(year, "DEMO_D")).exists()
+    pd.testing.assert_frame_equal(cached, downloaded)
+
+
+def test_migrateCache_convertsCsv(nhanesServer, tmp_path):
+    cacheDir = str(tmp_path / "cache")
+    download.makeDirectoryIfNotExists(cacheDir)
+    download.readCacheOrDownloadCodebook(cacheDir, year, "DEMO_D", cacheFormat="csv")
+
+    written = download.migrateCache(cacheDir, removeCsv=True)
+    res = download.readCacheCodebook(cacheDir, year, "DEMO_D")
+
+    assert len(written) == 1
+    assert not (tmp_path / "cache" / download.codebookSavePath(year, "DEMO_D", "csv")).exists()
+    assert res.shape == (100, 6)
+    assert res.index.name == "SEQN"
+
+
+def test_readCacheVariables_onlyReadsSelection(nhanesServer, tmp_path):
+    cacheDir = str(tmp_path / "cache")
+    download.buildNhanesCache(cacheDir)
+
+    res = download.readCacheOrDownloadVariables(cacheDir, year, ["LBX001", "RIA002", "NOTAVAR"])
+    full = download.readCacheAllCodebooks(cacheDir, year)
+
+    assert list(res.columns) == ["LBX001", "RIA002"]
+    assert res.index.name == "SEQN"
+    pd.testing.assert_frame_equal(res, full.loc[res.index, ["LBX001", "RIA002"]])
+
+
+def test_selectCodebookVariables_firstCodebookWins():
+    res = download.selectCodebookVariables(
+        {"DEMO_D": ["A", "B"], "BMX_D": ["B", "C"], "ACQ_D": ["D"]}, ["C", "B"])
+
+    assert res == {"DEMO_D": ["B"], "BMX_D": ["C"]}
+
+
+@pytest.mark.parametrize("cacheFormat", ["parquet", "feather", "csv"])
+def test_readCacheOrStreamCodebook_longFormat(nhanesServer, tmp_path, cacheFormat):
+    yearDir = tmp_path / download.nhanesYearSavePath(year)
+    minutes = pd.DataFrame({"SEQN": np.repeat(np.arange(31127, 31177), 7).astype(float),
+                            "PAXINTEN": np.arange(1, 351, dtype=float)})
+    writeXPT(minutes, str(yearDir / "PAXRAW_D.XPT"), "PAXRAW_D")
+    cacheDir = str(tmp_path / "cache")
+
+    with pytest.raises(download.DownloadException):
+        download.downloadCodebook(year, "PAXRAW_D")
+    path = download.readCacheOrStreamCodebook(cacheDir, year, "PAXRAW_D", cacheFormat=cacheFormat, chunksize=32)
+    res = download.readCacheCodebook(cacheDir, year, "PAXRAW_D", cacheFormat)
+
+    assert path.endswith(download.codebookSavePath(year, "PAXRAW_D", cacheFormat))
+    assert res.shape == (350, 1)
+    assert res.index.name == "SEQN"
+    assert list(res.PAXINTEN) == list(minutes.PAXINTEN)
+
+
+def test_refreshCache_onlyDownloadsChanged(nhanesServer, tmp_path):
+    cacheDir = str(tmp_path / "cache")
+    download.makeDirectoryIfNotExists(cacheDir)
+    for name in ["DEMO_D", "BMX_D"]:
+        download.readCacheOrDownloadCodebook(cacheDir, year, name)
+
+    changed = nhanesServer["BMX_D"] * 2
+    served = tmp_path / download.nhanesYearSavePath(year) / "BMX_D.XPT"
+    writeXPT(changed, str(served), "BMX_D")
+    os.utime(served, (time.time() + 100, time.time() + 100))
+
+    report = download.refreshCache(cacheDir, {year})
+    again = download.refreshCache(cacheDir, {year})
+
+    assert report == {"refreshed": ["2005-2006/BMX_D"], "unchanged": ["2005-2006/DEMO_D"], "failed": []}
+    assert again["refreshed"] == []
+    pd.testing.assert_frame_equal(download.readCacheCodebook(cacheDir, year, "BMX_D"), changed,
+                                  check_index_type=False)
+
+
+def test_refreshCache_unchangedWithoutValidators(nhanesServer, tmp_path):
+    cacheDir = str(tmp_path / "cache")
+    yearDir = tmp_path / "cache" / download.nhanesYearSavePath(year)
+    yearDir.mkdir(parents=True)
+    # Cached by a version without a manifest, so without validators
+    for name in ["DEMO_D", "BMX_D"]:
+        nhanesServer[name].to_csv(yearDir / f"{name}.csv")
+    writeXPT(nhanesServer["BMX_D"] * 2, str(tmp_path / download.nhanesYearSavePath(year) / "BMX_D.XPT"), "BMX_D")
+    written = os.path.getmtime(yearDir / "DEMO_D.csv")
+
+    report = download.refreshCache(cacheDir, {year}, cacheFormat="csv")
+
+    assert report == {"refreshed": ["2005-2006/BMX_D"], "unchanged": ["2005-2006/DEMO_D"], "failed": []}
+    assert os.path.getmtime(yearDir / "DEMO_D.csv") == written
+    assert manifest.manifestFor(cacheDir).get("2005-2006/DEMO_D")["sha256"]
+
+
+def test_manifest_describesCache(nhanesServer, tmp_path, monkeypatch):
+    cacheDir = str(tmp_path / "cache")
+    download.makeDirectoryIfNotExists(cacheDir)
+    for name in ["DEMO_D", "GLU_D"]:
+        download.readCacheOrDownloadCodebook(cacheDir, year, name)
+
+    entry = manifest.manifestFor(cacheDir).get("2005-2006/DEMO_D")
+    summary = manifest.cacheSummary(cacheDir)
+
+    assert entry["rows"] == 100
+    assert list(entry["columns"]) == list(nhanesServer["DEMO_D"].columns)
+    assert entry["checksum"] == manifest.fileChecksum(str(tmp_path / "cache" / entry["file"]))
+    assert list(summary.codebook) == ["DEMO_D", "GLU_D"]
+    assert download.cachedCodebooks(cacheDir, year) == ["DEMO_D", "GLU_D"]
+
+    def noProbing(*args):
+        raise AssertionError("readCacheCodebook shouldn't be needed")
+    monkeypatch.setattr(download, "readCacheCodebook", noProbing)
+    assert download.readCacheAllCodebooks(cacheDir, year).shape == (100, 8)
+
+
+def test_indexCache_recordsExistingFiles(nhanesServer, tmp_path):
+    cacheDir = str(tmp_path / "cache")
+    yearDir = tmp_path / "cache" / download.nhanesYearSavePath(year)
+    yearDir.mkdir(parents=True)
+    nhanesServer["BMX_D"].to_parquet(yearDir / "BMX_D.parquet")
+
+    assert download.indexCache(cacheDir) == 1
+    assert manifest.manifestFor(cacheDir).get("2005-2006/BMX_D")["rows"] == 80
+    assert (yearDir / manifest.manifestFileName).exists()
+
+
+def test_cachedEntries_partlyIndexedCache(nhanesServer, tmp_path):
+    cacheDir = str(tmp_path / "cache")
+    yearDir = tmp_path / "cache" / download.nhanesYearSavePath(year)
+    yearDir.mkdir(parents=True)
+    # A csv cache from before there was a manifest, then one codebook cached by a newer version
+    for name in ["ACQ_D", "BMX_D", "GLU_D"]:
+        nhanesServer[name].to_csv(yearDir / f"{name}.csv")
+    download.readCacheOrDownloadCodebook(cacheDir, year, "DEMO_D")
+
+    assert download.cachedCodebooks(cacheDir, year) == list(nhanesServer)
+    assert sorted(download.cachedCodebookVariables(cacheDir, year)) == sorted(nhanesServer)
+    assert download.readCacheAllCodebooks(cacheDir, year).shape == (100, 15)
+
+
+def test_buildNhanesCachePipeline_matchesDownload(nhanesServer, tmp_path):
+    from nhanes_dl import pipeline
+    cacheDir = str(tmp_path / "cache")
+    names = list(nhanesServer)
+
+    report = pipeline.buildNhanesCachePipeline(cacheDir, {year}, processes=2, queueSize=1)
+
+    assert sorted(report.cached) == sorted(download.manifestKey(year, n) for n in names)
+    assert report.cached[download.manifestKey(year, "DEMO_D")] == 100
+    assert not report.failed
+    assert (tmp_path / "cache" / pipeline.reportFileName).exists()
+    pd.testing.assert_frame_equal(download.readCacheCodebook(cacheDir, year, "DEMO_D"),
+                                  download.downloadCodebook(year, "DEMO_D"))
+    assert manifest.manifestFor(cacheDir).get(download.manifestKey(year, "DEMO_D"))["sha256"]
+
+    again = pipeline.buildNhanesCachePipeline(cacheDir, {year}, processes=2)
+    assert not again.cached and len(again.skipped) == len(names)
+
+
+def test_buildCacheFromMirror_offline(nhanesServer, tmp_path, monkeypatch):
+    from nhanes_dl import mirror, pipeline
+    cacheDir = str(tmp_path / "cache")
+    download.makeDirectoryIfNotExists(cacheDir)
+    raw = mirror.enableMirror(cacheDir)
+    downloaded = download.readCacheOrDownloadCodebook(cacheDir, year, "DEMO_D", cacheFormat="csv")
+    assert download.manifestKey(year, "DEMO_D") in raw
+
+    # Nothing can be downloaded any more
+    monkeypatch.setattr(types, "nhanesURL", "http://127.0.0.1:9")
+    report = pipeline.buildCacheFromMirror(cacheDir, {year}, processes=1)
+
+    assert list(report.cached) == [download.manifestKey(year, "DEMO_D")] and not report.failed
+    pd.testing.assert_frame_equal(download.readCacheCodebook(cacheDir, year, "DEMO_D"), downloaded,
+                                  check_dtype=False)
+
+
+def test_buildCacheFromMirror_streamedCodebook(nhanesServer, tmp_path, monkeypatch):
+    from nhanes_dl import mirror, pipeline
+    yearDir = tmp_path / download.nhanesYearSavePath(year)
+    minutes = pd.DataFrame({"SEQN": np.repeat(np.arange(31127, 31177), 7).astype(float),
+                            "PAXINTEN": np.arange(1, 351, dtype=float)})
+    writeXPT(minutes, str(yearDir / "PAXRAW_D.XPT"), "PAXRAW_D")
+    cacheDir = str(tmp_path / "cache")
+    download.makeDirectoryIfNotExists(cacheDir)
+    raw = mirror.enableMirror(cacheDir)
+    download.readCacheOrStreamCodebook(cacheDir, year, "PAXRAW_D", cacheFormat="csv", chunksize=32)
+    key = download.manifestKey(year, "PAXRAW_D")
+    assert raw.get(key) == (yearDir / "PAXRAW_D.XPT").read_bytes()
+
+    monkeypatch.setattr(types, "nhanesURL", "http://127.0.0.1:9")
+    report = pipeline.buildCacheFromMirror(cacheDir, {year}, processes=1, cacheFormat="parquet")
+    res = download.readCacheCodebook(cacheDir, year, "PAXRAW_D", "parquet")
+
+    assert list(report.cached) == [key] and not report.failed
+    assert res.shape == (350, 1)
+    assert list(res.PAXINTEN) == list(minutes.PAXINTEN)
+
+
+def test_readOrUpdateCache_singleFlight(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    from nhanes_dl import utils
+    yearDir = tmp_path / download.nhanesYearSavePath(year)
+    download.makeDirectoryIfNotExists(str(yearDir / "nested"))
+    assert not download.makeDirectoryIfNotExists(str(yearDir))
+    calls = []
+
+    def getDataframe():
+        calls.append(1)
+        time.sleep(0.2)
+        return fakeCodebook(list(range(1, 11)), "X", 2)
+
+    path = str(yearDir / "X.parquet")
+    with ThreadPoolExecutor(4) as pool:
+        res = list(pool.map(lambda _: utils.readOrUpdateCache(path, getDataframe), range(4)))
+
+    assert len(calls) == 1
+    for r in res:
+        pd.testing.assert_frame_equal(r, res[0], check_index_type=False)
+    assert [f for f in os.listdir(yearDir) if f.endswith(".partial")] == []
+
+
+def test_events_instrumentCacheReads(nhanesServer, tmp_path, capsys):
+    from nhanes_dl import events
+    cacheDir = str(tmp_path / "cache")
+    seen = []
+    listener = events.subscribe(lambda event, fields: seen.append((event, fields)))
+    try:
+        with events.collectStats() as stats:
+            download.readCacheOrDownloadCodebook(cacheDir, year, "DEMO_D")
+            download.readCacheOrDownloadCodebook(cacheDir, year, "DEMO_D")
+    finally:
+        events.unsubscribe(listener)
+
+    names = [e for e, _ in seen]
+    assert names == ["cacheMiss", "downloadStart", "download", "parse", "cacheWrite", "cacheHit"]
+    assert dict(seen)["downloadStart"]["url"] == types.codebookURL(year, "DEMO_D")
+    fetched = dict(seen)["download"]
+    assert fetched["status"] == 200 and fetched["bytes"] > 0
+    assert dict(seen)["parse"]["rows"] == 100
+    assert stats.totals["cacheHit"]["count"] == 1
+    assert "download" in stats.summary()
+    assert capsys.readouterr().out == ""
+
+
+@pytest.fixture
+def compactDtypes():
+    from nhanes_dl import dtypes
+    previous = dtypes.setDtypePolicy(dtypes.DtypePolicy())
+    yield
+    dtypes.setDtypePolicy(previous)
+
+
+@pytest.mark.parametrize("cacheFormat", ["parquet", "csv"])
+def test_dtypePolicy_keptInCache(nhanesServer, tmp_path, compactDtypes, cacheFormat):
+    cacheDir = str(tmp_path / "cache")
+    downloaded = download.readCacheOrDownloadCodebook(cacheDir, year, "DEMO_D", cacheFormat=cacheFormat)
+    assert set(downloaded.dtypes.astype(str)) == {"Int8"}
+
+    from nhanes_dl import dtypes
+    dtypes.setDtypePolicy(None)
+    cached = download.readCacheCodebook(cacheDir, year, "DEMO_D", cacheFormat)
+    pd.testing.assert_frame_equal(cached, downloaded, check_index_type=False)
+
+
+@pytest.fixture
+def familyServer(tmp_path, monkeypatch):
+    # DEMO in two years with a column added in the second, BMX only in the first
+    years = [types.ContinuousNHANES.Fourth, types.ContinuousNHANES.Fifth]
+    rows = []
+    for k, y in enumerate(years):
+        (tmp_path / download.nhanesYearSavePath(y)).mkdir()
+        seqn = list(range(1 + 100 * k, 81 + 100 * k))
+        suffix = "DE"[k]
+        files = {f"DEMO_{suffix}": fakeCodebook(seqn, "RIA", 3 + k)}
+        if k == 0:
+            files["BMX_D"] = fakeCodebook(seqn[10:], "BMX", 2)
+        for name, df in files.items():
+            writeXPT(df, str(tmp_path / download.nhanesYearSavePath(y) / f"{name}.XPT"), name)
+            s, e = types.getStartEndYear(y)
+            rows.append({"startYear": s, "endYear": e, "dataFile": name})
+    pd.DataFrame(rows).to_csv(tmp_path / "nhanes_codebooks.csv", index=False)
+
+    with localServer(str(tmp_path)) as url:
+        monkeypatch.setattr(types, "nhanesURL", url)
+        monkeypatch.setattr(catalog, "defaultCatalog", catalog.CodebookCatalog(
+            f"{url}/nhanes_codebooks.csv", str(tmp_path / "catalog")))
+        yield years
+
+
+def test_downloadCodebookFamily_appendsEveryYear(familyServer):
+    fourth, fifth = familyServer
+    assert [(x.year, x.codebooks) for x in types.resolveFamily("demo")] == \
+        [(fourth, {"DEMO_D"}), (fifth, {"DEMO_E"})]
+    assert [x.year for x in types.resolveFamily("BMX")] == [fourth]
+
+    res = download.downloadCodebookFamily("DEMO")
+    expected = types.appendCodebooks([download.downloadCodebook(fourth, "DEMO_D"),
+                                      download.downloadCodebook(fifth, "DEMO_E")])
+    assert res.shape == (160, 4)
+    pd.testing.assert_frame_equal(res, expected)
+    assert res["RIA003"].isna().sum() == 80
+
+
+def test_readCacheOrDownloadCodebookFamily_matchesDownload(familyServer, tmp_path):
+    cacheDir = str(tmp_path / "cache")
+    downloaded = download.downloadCodebookFamily("DEMO")
+
+    res = download.readCacheOrDownloadCodebookFamily(cacheDir, "DEMO")
+    pd.testing.assert_frame_equal(res, downloaded, check_index_type=False)
+    cached = download.readCacheOrDownloadCodebookFamily(cacheDir, "DEMO", {familyServer[1]})
+    assert cached.shape == (80, 4)
+
+
+def test_buildNhanesCachePipeline_resumesFromJournal(nhanesServer, tmp_path):
+    from nhanes_dl import journal, pipeline
+    cacheDir = str(tmp_path / "cache")
+    served = tmp_path / download.nhanesYearSavePath(year) / "BMX_D.XPT"
+    os.rename(served, f"{served}.hidden")
+    bmx, demo = download.manifestKey(year, "BMX_D"), download.manifestKey(year, "DEMO_D")
+
+    first = pipeline.buildNhanesCachePipeline(cacheDir, {year}, processes=2)
+    assert list(first.failed) == [bmx]
+    assert list(journal.journalFor(cacheDir).withStatus(journal.FAILED)) == [bmx]
+
+    # A truncated file isn't trusted, but retryFailed leaves everything that didn't fail alone
+    with open(os.path.join(cacheDir, download.codebookSavePath(year, "DEMO_D")), "r+b") as f:
+        f.truncate(100)
+    os.rename(f"{served}.hidden", served)
+    retried = pipeline.buildNhanesCachePipeline(cacheDir, {year}, processes=2, retryFailed=True)
+    assert list(retried.cached) == [bmx] and not retried.skipped
+
+    download.resumeNhanesCache(cacheDir, processes=2)
+    resumed = json.loads((tmp_path / "cache" / pipeline.reportFileName).read_text())
+    assert list(resumed["cached"]) == [demo] and len(resumed["skipped"]) == len(nhanesServer) - 1
+    pd.testing.assert_frame_equal(download.readCacheCodebook(cacheDir, year, "DEMO_D"),
+                                  download.downloadCodebook(year, "DEMO_D"))
+
+
+def test_buildNhanesCache_retriesFailedOnly(nhanesServer, tmp_path, monkeypatch):
+    from nhanes_dl import journal
+    cacheDir = str(tmp_path / "cache")
+    key = download.manifestKey(year, "GLU_D")
+    download.buildNhanesCache(cacheDir, years={year})
+    entries = journal.journalFor(cacheDir).entries()
+    assert {e["status"] for e in entries.values()} == {journal.DONE} and len(entries) == len(nhanesServer)
+
+    os.remove(os.path.join(cacheDir, download.codebookSavePath(year, "GLU_D")))
+    journal.journalFor(cacheDir).failed(key, "timed out")
+    fetched = []
+    monkeypatch.setattr(download, "downloadCodebookToCache",
+                        lambda cacheDir, c, codebook: fetched.append(codebook) or nhanesServer[codebook])
+    download.resumeNhanesCache(cacheDir, retryFailed=True)
+    assert fetched == ["GLU_D"]
+    assert journal.journalFor(cacheDir).get(key)["status"] == journal.DONE
+
+
+def test_buildNhanesCache_trustsRefreshedFiles(nhanesServer, tmp_path, monkeypatch):
+    cacheDir = str(tmp_path / "cache")
+    download.buildNhanesCache(cacheDir, years={year})
+    served = tmp_path / download.nhanesYearSavePath(year) / "BMX_D.XPT"
+    writeXPT(nhanesServer["BMX_D"] * 2, str(served), "BMX_D")
+    os.utime(served, (time.time() + 100, time.time() + 100))
+    assert download.refreshCache(cacheDir, {year})["refreshed"] == [download.manifestKey(year, "BMX_D")]
+
+    fetched = []
+    monkeypatch.setattr(download, "downloadCodebookToCache",
+                        lambda cacheDir, c, codebook: fetched.append(codebook) or nhanesServer[codebook])
+    download.buildNhanesCache(cacheDir, years={year})
+    assert fetched == []
+
+
+def test_ignoredCodebooks_journaledAsSkipped(nhanesServer, tmp_path):
+    from nhanes_dl import journal, pipeline
+    s, e = types.getStartEndYear(year)
+    names = list(nhanesServer) + ["PAXRAW_D", "RDC_D"]
+    pd.DataFrame({"startYear": s, "endYear": e, "dataFile": names}).to_csv(
+        tmp_path / "nhanes_codebooks.csv", index=False)
+    ignored = {download.manifestKey(year, n) for n in ["PAXRAW_D", "RDC_D"]}
+
+    statuses = []
+    for build in [lambda cacheDir: download.buildNhanesCache(cacheDir, years={year}),
+                  lambda cacheDir: pipeline.buildNhanesCachePipeline(cacheDir, {year}, processes=1)]:
+        cacheDir = str(tmp_path / f"cache{len(statuses)}")
+        build(cacheDir)
+        statuses.append({k: v["status"] for k, v in journal.journalFor(cacheDir).entries().items()})
+
+    assert statuses[0] == statuses[1]
+    assert {k for k, status in statuses[0].items() if status == journal.SKIPPED} == ignored
+
+
+def test_longFormatCodebook_rolledUpAndCached(nhanesServer, tmp_path):
+    seqn = np.repeat(np.arange(31127, 31227, 2, dtype=float), 3)
+    long = pd.DataFrame({"RXDUSE": np.ones(len(seqn)), "RXDCOUNT": np.full(len(seqn), 3.0),
+                         "RXDDAYS": np.arange(1, len(seqn) + 1, dtype=float)}, index=pd.Index(seqn, name="SEQN"))
+    writeXPT(long, str(tmp_path / download.nhanesYearSavePath(year) / "RXQ_RX_D.XPT"), "RXQ_RX_D")
+    writeXPT(long, str(tmp_path / download.nhanesYearSavePath(year) / "RXQ_XX_D.XPT"), "RXQ_XX_D")
+
+    res = download.downloadCodebook(year, "RXQ_RX_D")
+    assert res.shape == (50, 3) and not res.index.has_duplicates
+    assert list(res.RXDN) == [3] * 50
+    with pytest.raises(types.DuplicateSEQNException):
+        download.downloadCodebook(year, "RXQ_XX_D")
+
+    joined = download.downloadCodebooks(download.CodebookDownload(year, "DEMO_D", "RXQ_RX_D", "RXQ_XX_D"))
+    assert {"RXDN", "RXDUSE", "RXDCOUNT"} <= set(joined.columns) and joined.RXDN.notna().sum() == 50
+
+    cacheDir = str(tmp_path / "cache")
+    cached = download.readCacheOrDownloadCodebook(cacheDir, year, "RXQ_RX_D")
+    pd.testing.assert_frame_equal(download.readCacheCodebook(cacheDir, year, "RXQ_RX_D"), cached)
+
+
+@pytest.fixture
+def spawnedConverters(monkeypatch):
+    # Spawned conversion processes only know what the build hands them, unlike forked ones
+    import functools
+    import multiprocessing
+    from nhanes_dl import pipeline
+    monkeypatch.setattr(pipeline, "ProcessPoolExecutor", functools.partial(
+        pipeline.ProcessPoolExecutor, mp_context=multiprocessing.get_context("spawn")))
+
+
+def test_buildNhanesCachePipeline_declaredRollupSpawned(nhanesServer, tmp_path, spawnedConverters):
+    from nhanes_dl import pipeline, rollup
+    seqn = np.repeat(np.arange(31127, 31227, 2, dtype=float), 2)
+    long = pd.DataFrame({"BMX000": np.arange(1, len(seqn) + 1, dtype=float)}, index=pd.Index(seqn, name="SEQN"))
+    writeXPT(long, str(tmp_path / download.nhanesYearSavePath(year) / "BMX_D.XPT"), "BMX_D")
+    previous = rollup.setRollup("BMX", rollup.Rollup(count="BMXN", columns={"BMX000": "sum"}))
+    try:
+        report = pipeline.buildNhanesCachePipeline(str(tmp_path / "cache"), {year}, processes=1)
+    finally:
+        rollup.setRollup("BMX", previous)
+
+    assert not report.failed
+    res = download.readCacheCodebook(str(tmp_path / "cache"), year, "BMX_D")
+    assert list(res.columns) == ["BMXN", "BMX000"] and list(res.BMXN) == [2] * 50
+
+
+def test_buildNhanesCachePipeline_dtypePolicySpawned(nhanesServer, tmp_path, compactDtypes, spawnedConverters):
+    from nhanes_dl import dtypes, pipeline
+    cacheDir = str(tmp_path / "cache")
+    pipeline.buildNhanesCachePipeline(cacheDir, {year}, processes=1)
+
+    dtypes.setDtypePolicy(None)
+    assert set(download.readCacheCodebook(cacheDir, year, "DEMO_D").dtypes.astype(str)) == {"Int8"}
+
+
+def test_cacheBudget_evictedCodebooksDownloadedAgain(nhanesServer, tmp_path):
+    from nhanes_dl import eviction
+    cacheDir = str(tmp_path / "cache")
+    first = download.readCacheOrDownloadCodebook(cacheDir, year, "DEMO_D")
+    size = manifest.manifestFor(cacheDir).get(download.manifestKey(year, "DEMO_D"))["bytes"]
+    eviction.setCacheBudget(cacheDir, size)
+
+    download.readCacheOrDownloadCodebook(cacheDir, year, "BMX_D")
+    assert download.readCacheCodebook(cacheDir, year, "DEMO_D") is None
+
+    again = download.readCacheOrDownloadCodebook(cacheDir, year, "DEMO_D")
+    pd.testing.assert_frame_equal(again, first)
+    stats = eviction.cacheStats(cacheDir)
+    assert stats["entries"] == 1 and stats["bytes"] <= size
+    assert (stats["hits"], stats["misses"]) == (0, 3)
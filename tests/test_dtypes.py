@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+from nhanes_dl import dtypes, events, types
+
+
+def codebook():
+    return pd.DataFrame({
+        "CODE": [1.0, 2.0, np.nan, 9.0],
+        "AGE": [30.0, 85.0, 150.0, 600.0],
+        "WEIGHT": [71.5, 80.2, 65.0, np.nan],
+        "NAME": [b"ab", b"", b"c", b"d"],
+    }, index=pd.Index([1.0, 2.0, 3.0, 4.0], name="SEQN"))
+
+
+def test_dtypePolicy_downcastsIntegers():
+    res = dtypes.DtypePolicy().apply(codebook())
+
+    assert res.dtypes.astype(str).to_dict() == {"CODE": "Int8", "AGE": "Int16", "WEIGHT": "float64", "NAME": "string"}
+    assert res["CODE"].isna().tolist() == [False, False, True, False]
+    assert res["NAME"].tolist()[:2] == ["ab", pd.NA]
+    pd.testing.assert_frame_equal(res[["CODE", "AGE", "WEIGHT"]].astype("float64"),
+                                  codebook()[["CODE", "AGE", "WEIGHT"]])
+
+
+def test_dtypePolicy_categoricalCodes():
+    res = dtypes.DtypePolicy(categoryMaxCodes=3).apply(codebook())
+
+    assert isinstance(res["CODE"].dtype, pd.CategoricalDtype)
+    assert list(res["CODE"].cat.categories) == [1, 2, 9]
+    assert str(res["AGE"].dtype) == "Int16"
+
+
+def test_dtypePolicy_categoriesAppendAcrossYears():
+    policy = dtypes.DtypePolicy(categoryMaxCodes=3)
+    # Codes that fit in int8 one year and need int16 the next
+    first = policy.apply(pd.DataFrame({"CODE": [1.0, 2.0, 9.0]}, index=pd.Index([1.0, 2.0, 3.0], name="SEQN")))
+    second = policy.apply(pd.DataFrame({"CODE": [1.0, 777.0, np.nan]}, index=pd.Index([4.0, 5.0, 6.0], name="SEQN")))
+
+    res = types.appendCodebooks([first, second])
+
+    assert isinstance(res["CODE"].dtype, pd.CategoricalDtype)
+    assert res["CODE"].astype("float64").tolist()[:5] == [1.0, 2.0, 9.0, 1.0, 777.0]
+    assert res["CODE"].isna().tolist() == [False] * 5 + [True]
+
+
+def test_dtypePolicy_reportsSaving():
+    df = pd.DataFrame(np.random.default_rng(0).integers(1, 10, (1000, 10)).astype(float))
+    with events.collectStats() as stats:
+        res = dtypes.DtypePolicy().apply(df)
+
+    assert stats.totals["compact"]["count"] == 1
+    assert dtypes.memoryUsage(res) < dtypes.memoryUsage(df) / 3
+    assert stats.totals["compact"]["saved"] == dtypes.memoryUsage(df) - dtypes.memoryUsage(res)
+
+
+def test_restoreDtypes():
+    read = pd.DataFrame({"CODE": [1, 2, 9], "AGE": [30.0, np.nan, 85.0]})
+    res = dtypes.restoreDtypes(read, {"CODE": "category", "AGE": "Int16", "MISSING": "Int8"})
+
+    assert isinstance(res["CODE"].dtype, pd.CategoricalDtype)
+    assert str(res["AGE"].dtype) == "Int16"
@@ -0,0 +1,33 @@
+import logging
+import pandas as pd
+from nhanes_dl import events, types
+
+
+def test_joinEmitsShape():
+    seen = []
+    with events.collectStats() as stats:
+        listener = events.subscribe(lambda event, fields: seen.append((event, fields)))
+        try:
+            a = pd.DataFrame({"A": [1.0, 2.0]}, index=pd.Index([1, 2], name="SEQN"))
+            b = pd.DataFrame({"B": [3.0]}, index=pd.Index([3], name="SEQN"))
+            types.joinCodebooks([a, None, b])
+        finally:
+            events.unsubscribe(listener)
+
+    event, fields = seen[0]
+    assert event == "join"
+    assert (fields["frames"], fields["rows"], fields["columns"]) == (2, 3, 2)
+    assert stats.totals["join"]["rows"] == 3
+
+
+def test_failingListenerIsLogged(caplog):
+    def failing(event, fields):
+        raise RuntimeError("broken listener")
+
+    events.subscribe(failing)
+    try:
+        with caplog.at_level(logging.ERROR, logger="nhanes_dl"):
+            events.emit("cacheHit", path="x")
+    finally:
+        events.unsubscribe(failing)
+    assert "cacheHit" in caplog.text
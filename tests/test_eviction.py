@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import pandas as pd
+from nhanes_dl import eviction, formats, manifest, mirror
+
+
+def cacheFile(cacheDir, codebook, rows=2000):
+    yearDir = os.path.join(cacheDir, "2005-2006")
+    os.makedirs(yearDir, exist_ok=True)
+    path = os.path.join(yearDir, f"{codebook}.parquet")
+    df = pd.DataFrame({f"{codebook}{i}": np.random.default_rng(i).random(rows) for i in range(3)},
+                      index=pd.Index(np.arange(rows, dtype=float), name="SEQN"))
+    formats.getCacheFormat("parquet").write(df, path)
+    manifest.recordCacheFile(path, df)
+    return path
+
+
+def test_evict_leastRecentlyUsedFirst(tmp_path):
+    cacheDir = str(tmp_path)
+    paths = {name: cacheFile(cacheDir, name) for name in ["DEMO_D", "BMX_D", "ACQ_D"]}
+    size = os.path.getsize(paths["DEMO_D"])
+    for i, name in enumerate(["BMX_D", "DEMO_D", "ACQ_D"]):
+        os.utime(paths[name], (1000 + i, 1000 + i))
+    eviction.recordAccess(paths["BMX_D"], hit=True)
+
+    evicted = eviction.setCacheBudget(cacheDir, 2 * size + size // 2)
+
+    assert evicted == ["2005-2006/DEMO_D"]
+    assert not os.path.exists(paths["DEMO_D"]) and os.path.exists(paths["BMX_D"])
+    assert "file" not in manifest.manifestFor(cacheDir).get("2005-2006/DEMO_D")
+
+
+def test_budget_keepsPinnedAndNewestWrite(tmp_path):
+    cacheDir = str(tmp_path)
+    eviction.pin(cacheDir, "DEMO")
+    first = cacheFile(cacheDir, "DEMO_D")
+    eviction.setCacheBudget(cacheDir, 1)
+    second = cacheFile(cacheDir, "BMX_D")
+    assert os.path.exists(first) and os.path.exists(second)
+
+    third = cacheFile(cacheDir, "ACQ_D")
+    assert os.path.exists(first) and not os.path.exists(second) and os.path.exists(third)
+    assert eviction.getCacheBudget(cacheDir) == {"maxBytes": 1, "pinned": ["DEMO"]}
+
+    eviction.unpin(cacheDir, "DEMO")
+    assert eviction.evict(cacheDir) == ["2005-2006/DEMO_D", "2005-2006/ACQ_D"]
+
+
+def test_cacheStats_reportsCompressionAndHitRate(tmp_path):
+    cacheDir = str(tmp_path)
+    path = cacheFile(cacheDir, "DEMO_D")
+    eviction.recordAccess(path, hit=True)
+    eviction.recordAccess(path, hit=True)
+    eviction.recordAccess(path, hit=False)
+
+    stats = eviction.cacheStats(cacheDir)
+    assert stats["entries"] == 1 and stats["bytes"] == os.path.getsize(path)
+    assert stats["uncompressedBytes"] > 0 and stats["savedBytes"] == stats["uncompressedBytes"] - stats["bytes"]
+    assert (stats["hits"], stats["misses"]) == (2, 1) and abs(stats["hitRate"] - 2 / 3) < 1e-9
+    assert stats["maxBytes"] is None
+
+
+def test_budget_countsRawMirror(tmp_path):
+    cacheDir = str(tmp_path)
+    raw = mirror.enableMirror(cacheDir, compress=False)
+    raw.put("2005-2006/DEMO_D", b"old" * 1000, "http://x/DEMO_D.XPT")
+    raw.put("2005-2006/DEMO_D", b"new" * 1000, "http://x/DEMO_D.XPT")
+    raw.put("2005-2006/BMX_D", b"bmx" * 1000, "http://x/BMX_D.XPT")
+    for i, key in enumerate(["2005-2006/DEMO_D", "2005-2006/BMX_D"]):
+        os.utime(raw.objectPath(raw.entries()[key]["sha256"], False), (1000 + i, 1000 + i))
+    path = cacheFile(cacheDir, "BMX_D")
+    assert eviction.cacheStats(cacheDir)["rawBytes"] == 9000
+
+    # The replaced raw bytes go first, then the least recently used raw file
+    evicted = eviction.setCacheBudget(cacheDir, os.path.getsize(path) + 3000)
+    assert evicted[0].startswith("raw/objects/") and evicted[1] == "raw/2005-2006/DEMO_D"
+    assert "2005-2006/DEMO_D" not in raw and "2005-2006/BMX_D" in raw
+    assert eviction.cacheStats(cacheDir)["rawBytes"] == 3000
@@ -0,0 +1,96 @@
+import os
+import pandas as pd
+import pytest
+from nhanes_dl import formats
+
+
+def sampleCodebook():
+    return pd.DataFrame({
+        "SEQN": [31127.0, 31128.0, 31129.0],
+        "RIAGENDR": [1.0, 2.0, None],
+        "RIDAGEYR": [45.0, 12.0, 80.0],
+        "DMDBORN": ["US", "MX", "US"],
+    }).set_index("SEQN")
+
+
+@pytest.mark.parametrize("name", list(formats.cacheFormats))
+def test_cacheFormat_roundTrip(tmp_path, name):
+    f = formats.getCacheFormat(name)
+    df = sampleCodebook()
+    path = str(tmp_path / f"DEMO_D{f.extension}")
+
+    f.write(df, path)
+    res = f.read(path)
+
+    assert res.index.name == "SEQN"
+    assert formats.formatOfPath(path) is f
+    pd.testing.assert_frame_equal(res, df, check_dtype=name != "csv")
+
+
+def test_getCacheFormat_unknown():
+    with pytest.raises(ValueError):
+        formats.getCacheFormat("xlsx")
+
+
+def test_cacheFormat_incompleteFailsOnInstantiation():
+    class NoChunks(formats.CacheFormat):
+        write = formats.CsvFormat.write
+        read = formats.CsvFormat.read
+        columns = formats.CsvFormat.columns
+        schema = formats.CsvFormat.schema
+
+    with pytest.raises(TypeError):
+        NoChunks()
+
+
+@pytest.mark.parametrize("name", list(formats.cacheFormats))
+def test_cacheFormat_readsOnlyColumns(tmp_path, name):
+    f = formats.getCacheFormat(name)
+    path = str(tmp_path / f"DEMO_D{f.extension}")
+    f.write(sampleCodebook(), path)
+
+    res = f.read(path, ["RIDAGEYR"])
+
+    assert f.columns(path) == ["RIAGENDR", "RIDAGEYR", "DMDBORN"]
+    assert list(res.columns) == ["RIDAGEYR"]
+    assert res.index.name == "SEQN"
+
+
+@pytest.mark.parametrize("name", ["parquet", "feather"])
+def test_setCompression_readsEitherWay(tmp_path, name):
+    f = formats.getCacheFormat(name)
+    df = pd.DataFrame({"RIDAGEYR": [float(i % 80) for i in range(5000)]},
+                      index=pd.Index([float(i) for i in range(5000)], name="SEQN"))
+    plain = str(tmp_path / f"PLAIN{f.extension}")
+    compressed = str(tmp_path / f"ZSTD{f.extension}")
+
+    previous = formats.setCompression(name, None)
+    try:
+        f.write(df, plain)
+        formats.setCompression(name, "zstd")
+        f.write(df, compressed)
+    finally:
+        formats.setCompression(name, previous)
+
+    assert os.path.getsize(compressed) < os.path.getsize(plain)
+    assert f.uncompressedBytes(compressed) > os.path.getsize(compressed)
+    pd.testing.assert_frame_equal(f.read(compressed), f.read(plain))
+    with pytest.raises(ValueError):
+        formats.setCompression("csv", "zstd")
+
+
+def test_featherFormat_readIsZeroCopy(tmp_path):
+    import numpy as np
+    import pyarrow as pa
+    f = formats.getCacheFormat("feather")
+    n = 200000
+    values = np.where(np.arange(n) % 10 == 0, np.nan, np.arange(n, dtype=float))
+    df = pd.DataFrame({"RIDAGEYR": values, "BMXWT": values * 2}, index=pd.Index(np.arange(n, dtype=float), name="SEQN"))
+    path = str(tmp_path / f"DEMO_D{f.extension}")
+    f.write(df, path)
+
+    allocated = pa.total_allocated_bytes()
+    res = f.read(path)
+    assert pa.total_allocated_bytes() - allocated < n
+    assert not res["RIDAGEYR"].to_numpy().flags.writeable
+    pd.testing.assert_frame_equal(res, df)
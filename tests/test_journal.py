@@ -0,0 +1,58 @@
+import os
+from nhanes_dl import journal
+
+
+def writeFile(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+    return str(path)
+
+
+def test_journal_latestStatusWinsAcrossReloads(tmp_path):
+    cacheDir = str(tmp_path)
+    path = writeFile(tmp_path / "DEMO_D.parquet", "cached")
+    j = journal.BuildJournal(cacheDir)
+    j.startBuild(years=[2005], cacheFormat="parquet", chunksize=None)
+    j.failed("2005-2006/DEMO_D", "Server error")
+    j.done("2005-2006/DEMO_D", path, rows=10)
+    j.skipped("2005-2006/RDC_D", "ignored codebook")
+
+    reloaded = journal.BuildJournal(cacheDir)
+    assert reloaded.get("2005-2006/DEMO_D")["status"] == journal.DONE
+    assert list(reloaded.withStatus(journal.SKIPPED)) == ["2005-2006/RDC_D"]
+    assert reloaded.lastBuild() == {"years": [2005], "cacheFormat": "parquet", "chunksize": None}
+    assert reloaded.isDone("2005-2006/DEMO_D", path)
+
+
+def test_journal_detectsChangedFiles(tmp_path):
+    j = journal.BuildJournal(str(tmp_path))
+    path = writeFile(tmp_path / "DEMO_D.parquet", "cached")
+    j.done("2005-2006/DEMO_D", path)
+
+    # Same size and content with another mtime is checksummed and still done
+    os.utime(path, (1, 1))
+    assert j.isDone("2005-2006/DEMO_D", path)
+    writeFile(path, "cachex")
+    os.utime(path, (1, 1))
+    assert not j.isDone("2005-2006/DEMO_D", path)
+    writeFile(path, "cach")
+    assert not j.isDone("2005-2006/DEMO_D", path)
+    os.remove(path)
+    assert not j.isDone("2005-2006/DEMO_D", path)
+
+
+def test_journal_survivesTornLineAndCompacts(tmp_path):
+    j = journal.BuildJournal(str(tmp_path))
+    for i in range(5):
+        j.failed("2005-2006/DEMO_D", f"attempt {i}")
+    with open(j.path, "a") as f:
+        f.write('{"key": "2005-2006/BMX_D", "sta')
+
+    torn = journal.BuildJournal(str(tmp_path))
+    assert list(torn.entries()) == ["2005-2006/DEMO_D"]
+    torn.failed("2005-2006/BMX_D", "timed out")
+    torn.compact()
+
+    with open(j.path) as f:
+        assert len(f.readlines()) == 2
+    assert journal.BuildJournal(str(tmp_path)).get("2005-2006/BMX_D")["reason"] == "timed out"
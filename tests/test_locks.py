@@ -0,0 +1,34 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+from nhanes_dl import locks, manifest
+
+
+def recordEntries(cacheDir, prefix):
+    m = manifest.CacheManifest(cacheDir)
+    for i in range(20):
+        m.update(f"2005-2006/{prefix}{i}", rows=i)
+
+
+def test_manifest_processesKeepEachOthersEntries(tmp_path):
+    os.makedirs(tmp_path / "2005-2006")
+    with ProcessPoolExecutor(2) as pool:
+        list(pool.map(recordEntries, [str(tmp_path)] * 2, ["A", "B"]))
+
+    with open(tmp_path / "2005-2006" / manifest.manifestFileName) as f:
+        entries = json.load(f)["entries"]
+    assert len(entries) == 40
+
+
+def test_writeAtomically_leavesNothingOnFailure(tmp_path):
+    path = str(tmp_path / "DEMO_D.parquet")
+
+    def failingWrite(tmp):
+        with open(tmp, "w") as f:
+            f.write("half")
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        locks.writeAtomically(path, failingWrite)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+from nhanes_dl import merge
+
+
+def frame(seqn, **columns):
+    return pd.DataFrame(columns, index=pd.Index(seqn, name="SEQN", dtype=float))
+
+
+def sampleFrames():
+    return [
+        frame([1, 2, 3, 4], A=[1.0, 2.0, np.nan, 9.0], B=["a", "b", "c", "d"]),
+        frame([3, 4, 5], C=[1, 2, 3], D=pd.array([1, None, 3], dtype="Int16")),
+        frame([6, 1], A=[0.5, 7.0], E=[True, False]),
+    ]
+
+
+def test_joinFrames_matchesConcat():
+    frames = sampleFrames()
+
+    res = merge.joinFrames(frames + [None])
+
+    pd.testing.assert_frame_equal(res, pd.concat(frames, axis=1))
+
+
+def test_appendFrames_matchesConcat():
+    frames = sampleFrames()
+    frames[0] = pd.concat([frames[0], frames[0][["A"]] * 2], axis=1)
+
+    res = merge.appendFrames(frames)
+    expected = pd.concat([f.loc[:, ~f.columns.duplicated()] for f in frames])
+
+    pd.testing.assert_frame_equal(res, expected)
+
+
+def test_joinFrames_downcastsSmallCodes():
+    frames = [frame([1, 2, 3], A=[1.0, 2.0, 9.0], B=[0.5, 1.0, 2.0]),
+              frame([2, 4], C=[300.0, np.nan])]
+
+    res = merge.joinFrames(frames, downcast=True)
+
+    assert res.A.dtype == pd.Int8Dtype()
+    assert res.B.dtype == np.float64
+    assert res.C.dtype == pd.Int16Dtype()
+    pd.testing.assert_frame_equal(res.astype(float), pd.concat(frames, axis=1))
+
+
+def test_emptyFrames():
+    assert merge.joinFrames([]).index.name == "SEQN"
+    assert len(merge.appendFrames([None])) == 0
@@ -0,0 +1,27 @@
+import os
+from nhanes_dl import mirror
+
+
+def test_rawMirror_contentAddressed(tmp_path):
+    cacheDir = str(tmp_path)
+    assert mirror.mirrorFor(cacheDir) is None
+    raw = mirror.enableMirror(cacheDir)
+
+    sha = raw.put("2005-2006/DEMO_D", b"xpt bytes" * 100, "http://x/DEMO_D.XPT")
+    raw.put("2007-2008/DEMO_E", b"xpt bytes" * 100, "http://x/DEMO_E.XPT")
+
+    assert raw.get("2007-2008/DEMO_E") == b"xpt bytes" * 100
+    assert raw.path("2005-2006/DEMO_D") == raw.path("2007-2008/DEMO_E")
+    assert raw.path("2005-2006/DEMO_D").endswith(f"{sha}.gz")
+    assert os.path.getsize(raw.path("2005-2006/DEMO_D")) < 900
+    assert "2005-2006/BMX_D" not in raw
+
+
+def test_rawMirror_persists(tmp_path):
+    raw = mirror.RawMirror(str(tmp_path / "raw"), compress=False)
+    os.makedirs(raw.root)
+    raw.put("2005-2006/mortality", b"dat", "http://x/mort.dat")
+
+    reopened = mirror.RawMirror(raw.root)
+    assert reopened.get("2005-2006/mortality") == b"dat"
+    assert not reopened.path("2005-2006/mortality").endswith(".gz")
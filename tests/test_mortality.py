@@ -0,0 +1,89 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from nhanes_dl import download, mortality, types
+from benchmarks.synthetic import fakeMortality, localServer, readFwf, writeMortality
+
+
+def test_parseMortality_matchesFwf(tmp_path):
+    path = str(tmp_path / "mortality.dat")
+    writeMortality(fakeMortality(np.arange(31127, 33127)), path)
+
+    with open(path, "rb") as f:
+        res = mortality.parseMortality(f.read())
+    expected = readFwf(path)
+
+    assert res.index.name == "SEQN"
+    assert list(res.columns) == mortality.getMortalityColumns()
+    assert res.dtypes.to_dict() == {c: pd.Int8Dtype() if t == "Int8" else pd.Int16Dtype()
+                                    for c, t in mortality.mortalityDtypes.items()}
+    pd.testing.assert_frame_equal(res.astype(float), expected.astype(float), check_index_type=False)
+
+
+def test_downloadMortality_local(tmp_path, monkeypatch):
+    year = types.ContinuousNHANES.Fourth
+    writeMortality(fakeMortality(np.arange(31127, 31227)), str(tmp_path / "mortality.dat"))
+
+    with localServer(str(tmp_path)) as url:
+        monkeypatch.setattr(download, "mortalityURL", lambda _: f"{url}/mortality.dat")
+        res = download.downloadMortality(year)
+
+    assert res.shape == (100, 7)
+    assert res.index.name == "SEQN"
+
+
+def test_readCacheOrDownloadMortality_recordsEveryCacheDir(tmp_path, monkeypatch):
+    from nhanes_dl import manifest, mirror
+    year = types.ContinuousNHANES.Fourth
+    writeMortality(fakeMortality(np.arange(31127, 31227)), str(tmp_path / "mortality.dat"))
+    cacheDir = str(tmp_path / "cache")
+    raw = mirror.enableMirror(cacheDir)
+    key = download.manifestKey(year, "mortality")
+    monkeypatch.setattr(download, "getYearsCodebookDescriptions", lambda y: pd.DataFrame({"dataFile": []}))
+    mortality.mortalityStore.clear()
+
+    with localServer(str(tmp_path)) as url:
+        monkeypatch.setattr(download, "mortalityURL", lambda _: f"{url}/mortality.dat")
+        # The process store already holds the year when the cache directory is filled
+        download.storedMortality(year)
+        res = download.readCacheOrDownloadMortality(cacheDir, year, cacheFormat="csv")
+        assert manifest.manifestFor(cacheDir).get(key)["sha256"] and key in raw
+        report = download.refreshCache(cacheDir, {year}, cacheFormat="csv")
+
+    assert res.shape == (100, 7)
+    assert report["unchanged"] == [key]
+    mortality.mortalityStore.clear()
+
+
+def test_mortalityStore_singleFlight():
+    store = mortality.MortalityStore(maxYears=2)
+    calls = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.1)
+        return types.Mortality(pd.DataFrame({"MORTSTAT": [0, 1]}))
+
+    year = types.ContinuousNHANES.Fourth
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        res = list(pool.map(lambda _: store.get(year, load), range(4)))
+
+    assert len(calls) == 1
+    assert all(r.equals(res[0]) for r in res)
+    assert year in store
+
+
+def test_mortalityStore_evictsLeastRecentlyUsed():
+    store = mortality.MortalityStore(maxYears=2)
+    frame = types.Mortality(pd.DataFrame({"MORTSTAT": [0]}))
+    fourth, fifth, sixth = types.ContinuousNHANES.Fourth, types.ContinuousNHANES.Fifth, types.ContinuousNHANES.Sixth
+
+    store.get(fourth, lambda: frame)
+    store.get(fifth, lambda: frame)
+    store.get(fourth, lambda: frame)
+    store.get(sixth, lambda: frame)
+
+    assert fourth in store
+    assert fifth not in store
+    assert sixth in store
@@ -0,0 +1,118 @@
+from email.message import Message
+from urllib.error import HTTPError, URLError
+import numpy as np
+import pandas as pd
+import pytest
+from nhanes_dl import download, retry, transport, types
+from benchmarks.synthetic import writeXPT
+from tests.fixtures import FakeTransport
+
+
+class FlakyTransport(FakeTransport):
+    """
+    Fails the first failures requests of every url with the given error before serving it
+    """
+
+    def __init__(self, files, failures, error):
+        super().__init__(files)
+        self.failures = failures
+        self.error = error
+
+    def request(self, url, headers=None):
+        if self.requested.count(url) < self.failures:
+            self.requested.append(url)
+            raise self.error(url)
+        return super().request(url, headers)
+
+
+def status(code, retryAfter=None):
+    def error(url):
+        headers = Message()
+        if retryAfter is not None:
+            headers["Retry-After"] = str(retryAfter)
+        return HTTPError(url, code, "error", headers, None)
+    return error
+
+
+@pytest.fixture
+def noDelay():
+    previous = retry.setRetryPolicy(retry.RetryPolicy(attempts=3, baseDelay=0, jitter=0))
+    yield retry.getRetryPolicy()
+    retry.setRetryPolicy(previous)
+
+
+@pytest.fixture
+def flaky():
+    previous = transport.getTransport()
+
+    def use(*args):
+        transport.setTransport(FlakyTransport(*args))
+        return transport.getTransport()
+    yield use
+    transport.setTransport(previous)
+
+
+def xpt(tmp_path):
+    path = str(tmp_path / "DEMO_D.XPT")
+    writeXPT(pd.DataFrame({"SEQN": np.arange(1.0, 11.0), "X": np.arange(1.0, 11.0)}), path)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_classify():
+    assert isinstance(retry.classify(status(503)("u"), "u"), types.ServerErrorException)
+    assert isinstance(retry.classify(status(404)("u"), "u"), types.ClientErrorException)
+    throttled = retry.classify(status(429, 7)("u"), "u")
+    assert isinstance(throttled, types.ThrottledException) and throttled.retryAfter == 7
+    assert isinstance(retry.classify(URLError("down"), "u"), types.NetworkException)
+
+
+def test_transientFailuresAreRetried(tmp_path, noDelay, flaky):
+    url = download.codebookURL(types.ContinuousNHANES.Fourth, "DEMO")
+    fake = flaky({url: xpt(tmp_path)}, 2, status(503))
+    res = download.downloadCodebook(types.ContinuousNHANES.Fourth, "DEMO")
+    assert len(res) == 10
+    assert fake.requested.count(url) == 3
+
+
+def test_clientErrorsAreNotRetried(noDelay, flaky):
+    fake = flaky({}, 0, status(404))
+    with pytest.raises(types.ClientErrorException) as e:
+        download.downloadCodebook(types.ContinuousNHANES.Fourth, "DEMO")
+    assert str(e.value).startswith("Failed to download DEMO for")
+    assert e.value.code == 404
+    assert len(fake.requested) == 1
+
+
+def test_networkFailuresRaiseOnceOutOfAttempts(noDelay, flaky):
+    fake = flaky({}, 10, lambda url: URLError("down"))
+    with pytest.raises(types.NetworkException, match="Request timed out"):
+        download.downloadMortality(types.ContinuousNHANES.Fourth)
+    assert len(fake.requested) == 3
+
+
+def test_retryBudgetStopsRetries(noDelay, flaky):
+    noDelay.budget = retry.RetryBudget(retries=1, perSeconds=3600)
+    fake = flaky({}, 10, status(500))
+    with pytest.raises(types.ServerErrorException):
+        download.downloadCodebook(types.ContinuousNHANES.Fourth, "DEMO")
+    assert len(fake.requested) == 2
+
+
+def test_retryAfterIsHonoured():
+    policy = retry.RetryPolicy(maxDelay=5)
+    assert policy.delay(0, types.ThrottledException("", 429, 3)) == 3
+    assert policy.delay(0, types.ThrottledException("", 429, 60)) == 5
+    assert 0.5 <= policy.delay(0, types.ServerErrorException("", 503)) <= 1.5
+
+
+def test_retriesAreEmitted(tmp_path, noDelay, flaky):
+    from nhanes_dl import events
+    url = download.codebookURL(types.ContinuousNHANES.Fourth, "DEMO")
+    flaky({url: xpt(tmp_path)}, 1, status(503))
+    with events.collectStats() as stats:
+        download.downloadCodebook(types.ContinuousNHANES.Fourth, "DEMO")
+
+    assert stats.totals["retry"]["count"] == 1
+    assert stats.totals["downloadFailed"]["count"] == 1
+    assert stats.totals["download"]["count"] == 1
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+from nhanes_dl import rollup
+
+
+@pytest.fixture
+def prescriptions():
+    return pd.DataFrame({
+        "RXDUSE": [1.0, 1.0, 1.0, 2.0, np.nan, 1.0],
+        "RXDDAYS": [30.0, np.nan, 90.0, np.nan, 10.0, 20.0],
+        "RXDDRGID": [b"d00001", b"d00002", b"d00001", b"", b"d00003", b"d00001"],
+        "RXDDRUG": [b"A", b"B", b"A", b"", b"C", b"A"],
+    }, index=pd.Index([31130.0, 31127.0, 31127.0, 31128.0, 31129.0, 31129.0], name="SEQN"))
+
+
+def test_rollup_matchesGroupby(prescriptions):
+    r = rollup.Rollup(count="RXDN", columns={"RXDUSE": "first", "RXDDAYS": "mean", "RXDDRUG": "first"},
+                      pivot={"RXDDRGID": ["d00001", "d00003"]})
+    res = r.apply(prescriptions)
+
+    grouped = prescriptions.groupby(level=0)
+    assert list(res.index) == [31127.0, 31128.0, 31129.0, 31130.0] and res.index.name == "SEQN"
+    assert list(res.columns) == ["RXDN", "RXDUSE", "RXDDAYS", "RXDDRUG", "RXDDRGID_d00001", "RXDDRGID_d00003"]
+    assert list(res.RXDN) == list(grouped.size())
+    np.testing.assert_array_equal(res.RXDUSE, grouped.RXDUSE.first())
+    np.testing.assert_array_equal(res.RXDDAYS, grouped.RXDDAYS.mean())
+    assert list(res.RXDDRUG) == [b"B", b"", b"C", b"A"]
+    assert list(res.RXDDRGID_d00001) == [1, 0, 1, 1]
+    assert list(res.RXDDRGID_d00003) == [0, 0, 1, 0]
+
+
+def test_rollup_sumsAndNumericPivot():
+    rng = np.random.default_rng(0)
+    seqn = rng.integers(0, 1000, 100000).astype(float)
+    df = pd.DataFrame({"DR1IKCAL": rng.random(100000) * 500, "DR1FS": rng.integers(1, 4, 100000).astype(float)},
+                      index=pd.Index(seqn, name="SEQN"))
+    df.iloc[::7, 0] = np.nan
+
+    res = rollup.Rollup(columns={"DR1IKCAL": "sum"}, pivot={"DR1FS": [1, 3]}).apply(df)
+
+    grouped = df.groupby(level=0)
+    np.testing.assert_allclose(res.DR1IKCAL, grouped.DR1IKCAL.sum())
+    assert list(res.DR1FS_1) == list(grouped.DR1FS.apply(lambda x: (x == 1).sum()))
+    assert list(res.columns) == ["DR1IKCAL", "DR1FS_1", "DR1FS_3"]
+
+
+def test_rollup_declaredByFamily():
+    assert rollup.getRollup("RXQ_RX_D") is rollup.getRollup("RXQ_RX")
+    assert rollup.getRollup("DEMO_D") is None
+    with pytest.raises(ValueError):
+        rollup.Rollup(columns={"RXDUSE": "median"})
+
+    declared = rollup.Rollup(count="N")
+    previous = rollup.setRollup("DEMO_D", declared)
+    try:
+        assert previous is None and rollup.getRollup("DEMO_D") is declared
+    finally:
+        rollup.setRollup("DEMO_D", None)
+    assert rollup.getRollup("DEMO_D") is None
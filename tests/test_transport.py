@@ -0,0 +1,101 @@
+import gzip
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+import pandas as pd
+import pytest
+from nhanes_dl import download, transport, types
+from benchmarks.synthetic import _QuietHandler, localServer, writeXPT
+from tests.fixtures import FakeTransport
+
+
+class KeepAliveHandler(_QuietHandler):
+    protocol_version = "HTTP/1.1"
+    connections = []
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            self.connections.append(self.client_address)
+
+    def do_GET(self):
+        if self.path == "/gzipped":
+            body = gzip.compress(b"compressed body")
+            self.send_response(200)
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path in ("/truncated", "/corrupt"):
+            body = gzip.compress(b"compressed body" * 100)
+            body = body[:len(body) // 2] if self.path == "/truncated" else body[:10] + b"\xff" * 20 + body[30:]
+            self.send_response(200)
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        super().do_GET()
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / "a.txt").write_bytes(b"a" * 1000)
+    KeepAliveHandler.connections = []
+    with localServer(str(tmp_path), KeepAliveHandler) as url:
+        yield url
+
+
+def test_httpTransport_reusesConnections(server):
+    t = transport.HTTPTransport(timeout=5, maxConnectionsPerHost=2)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        res = list(pool.map(lambda _: t.request(f"{server}/a.txt"), range(20)))
+
+    assert all(r.body == b"a" * 1000 for r in res)
+    assert len(KeepAliveHandler.connections) <= 2
+    t.close()
+
+
+def test_httpTransport_gzipAndErrors(server, tmp_path):
+    t = transport.HTTPTransport(timeout=5)
+
+    with open(tmp_path / "out", "wb") as out:
+        t.download(f"{server}/gzipped", out)
+    with pytest.raises(HTTPError) as e:
+        t.request(f"{server}/missing.txt")
+
+    assert (tmp_path / "out").read_bytes() == b"compressed body"
+    assert e.value.code == 404
+    with pytest.raises(URLError):
+        t.request("http://127.0.0.1:9/a.txt")
+
+
+def test_httpTransport_badGzipReleasesConnection(server):
+    t = transport.HTTPTransport(timeout=5, maxConnectionsPerHost=1)
+
+    for path in ["truncated", "corrupt"]:
+        with pytest.raises(URLError):
+            t.request(f"{server}/{path}")
+
+    # The only slot of the host was given back, so this doesn't block
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        assert pool.submit(t.request, f"{server}/a.txt").result(timeout=5).body == b"a" * 1000
+    t.close()
+
+
+def test_setTransport_fake(tmp_path, monkeypatch):
+    year = types.ContinuousNHANES.Fourth
+    path = tmp_path / "DEMO_D.XPT"
+    writeXPT(pd.DataFrame({"SEQN": [1.0, 2.0], "RIAGENDR": [1.0, 2.0]}), str(path))
+    fake = FakeTransport({types.codebookURL(year, "DEMO_D"): path.read_bytes()})
+    monkeypatch.setattr(transport, "_transport", fake)
+
+    res = download.downloadCodebook(year, "DEMO_D")
+
+    assert res.shape == (2, 1)
+    assert fake.requested == [types.codebookURL(year, "DEMO_D")]
+    with pytest.raises(download.DownloadException):
+        download.downloadCodebook(year, "BMX_D")